@@ -0,0 +1,364 @@
+"""Endpoint benchmark suite with latency percentiles and regression gates.
+
+Seeds SQLite databases of several sizes with ``src.seed``, then drives the hot endpoints
+(``POST /completions/``, ``GET /analytics/{user_id}``, ``GET /health``) with a
+fixed number of concurrent clients, both in-process (ASGI transport, no
+network) and over HTTP against a uvicorn subprocess.  Each database size and
+mode runs ``--repeat`` times, each in a fresh interpreter on a copy of the
+seeded file, and the median of every metric is reported.
+
+Two gates catch regressions:
+
+* ``--compare`` fails if p95 latency or throughput is worse than the stored
+  baseline by more than ``--tolerance`` (machine-specific; regenerate the
+  baseline with ``--save-baseline`` on the machine that runs the gate).
+* ``--max-growth`` fails if an endpoint's p50 at the largest size exceeds
+  its p50 at the smallest size by more than that factor.  This needs no
+  baseline, so it catches a hot path that turned O(n) on any machine.
+
+Run from the ``agent`` directory:
+
+    python -m benchmarks.endpoints --sizes 1k,100k --compare benchmarks/baseline.json
+
+The analytics cache is disabled (``ANALYTICS_CACHE_LOCAL_TTL=0``, and
+``ANALYTICS_CACHE_TTL=0`` for a shared tier) so the analytics scenario
+measures the query rather than a cache lookup.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# Approximate completion counts; src.seed sizes the user base to match
+SIZES = {"1k": 1_000, "100k": 100_000, "10m": 10_000_000}
+MODES = ["inprocess", "http"]
+SCENARIOS = ["record_completion", "get_user_analytics", "health_check"]
+SEED_AS_OF = datetime(2024, 6, 1)
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(__file__), ".data")
+# Gated metrics and whether larger values are better
+GATED_METRICS = {"p95_ms": False, "rps": True}
+
+
+def seed_database(database_url, completions, seed=0, report=print):
+    """Fill an empty database with about ``completions`` completions and build habit stats."""
+    from src import recompute
+    from src import seed as dataset
+    from src.models.database import build_engine
+
+    engine = build_engine(database_url)
+    try:
+        dataset.generate(
+            engine, users=dataset.estimate_users(completions), as_of=SEED_AS_OF.date(),
+            seed=seed, report=report
+        )
+    finally:
+        engine.dispose()
+    recompute.run(database_url, report=lambda message: None)
+
+
+def seeded_database(data_dir, size, seed=0, report=print):
+    """Path of the seeded database for ``size``, creating it on first use."""
+    path = os.path.join(data_dir, f"synthetic-{size}-seed{seed}.db")
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        report(f"Seeding {size} ({SIZES[size]:,} completions) into {path}")
+        partial = f"{path}.partial"
+        for leftover in (partial, f"{partial}-wal", f"{partial}-shm"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        seed_database(f"sqlite:///{partial}", SIZES[size], seed=seed, report=report)
+        os.replace(partial, path)
+    return path
+
+
+def summarize(latencies, wall_seconds, errors):
+    ordered = sorted(latencies)
+    last = len(ordered) - 1
+
+    def percentile(p):
+        return round(ordered[min(last, int(round(p / 100 * last)))] * 1000, 3)
+
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "p50_ms": percentile(50),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "rps": round(len(ordered) / wall_seconds, 1),
+    }
+
+
+def _request(scenario, rng, user_ids, habit_ids):
+    if scenario == "record_completion":
+        return "POST", "/completions/", {
+            "habit_id": rng.choice(habit_ids),
+            "completed_at": SEED_AS_OF.isoformat(),
+            "mood": rng.randint(1, 5), "difficulty": rng.randint(1, 5),
+        }
+    if scenario == "get_user_analytics":
+        return "GET", f"/analytics/{rng.choice(user_ids)}", None
+    if scenario == "health_check":
+        return "GET", "/health", None
+    raise ValueError(f"Unknown scenario: {scenario}")
+
+
+async def drive(client, scenario, requests, concurrency, user_ids, habit_ids, seed=0):
+    """Send ``requests`` requests from ``concurrency`` closed-loop clients."""
+    rng = random.Random(seed)
+    plan = [_request(scenario, rng, user_ids, habit_ids) for _ in range(requests)]
+    latencies = []
+    errors = 0
+
+    async def client_loop(worker):
+        nonlocal errors
+        for method, path, body in plan[worker::concurrency]:
+            started = time.perf_counter()
+            response = await client.request(method, path, json=body)
+            latencies.append(time.perf_counter() - started)
+            errors += response.status_code >= 400
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client_loop(worker) for worker in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+def _free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+async def _measure(mode, scenarios, requests, concurrency, warmup):
+    import httpx
+
+    from sqlalchemy import select
+
+    from src.models.database import Habit, SessionLocal, User
+
+    with SessionLocal() as db:
+        user_ids = db.execute(select(User.id).order_by(User.id)).scalars().all()
+        habit_ids = db.execute(select(Habit.id).order_by(Habit.id)).scalars().all()
+
+    server = None
+    if mode == "inprocess":
+        from src.main import app, lifespan
+
+        transport, base_url = httpx.ASGITransport(app=app), "http://agent"
+        context = lifespan(app)
+    else:
+        port = _free_port()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "src.main:app", "--port", str(port),
+             "--log-level", "warning"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        transport, base_url = None, f"http://127.0.0.1:{port}"
+        context = None
+
+    limits = httpx.Limits(max_connections=concurrency)
+    try:
+        async with httpx.AsyncClient(
+            transport=transport, base_url=base_url, limits=limits, timeout=60
+        ) as client:
+            if context is not None:
+                await context.__aenter__()
+            else:
+                await _wait_ready(client)
+            results = {}
+            for scenario in scenarios:
+                await drive(client, scenario, warmup, concurrency, user_ids, habit_ids, seed=1)
+                results[scenario] = await drive(
+                    client, scenario, requests, concurrency, user_ids, habit_ids
+                )
+            if context is not None:
+                await context.__aexit__(None, None, None)
+            return results
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+async def _wait_ready(client, timeout=30.0):
+    import httpx
+
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if (await client.get("/health/live")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.05)
+    raise TimeoutError(f"agent not ready after {timeout}s")
+
+
+def _run_isolated(database_path, mode, scenarios, requests, concurrency, warmup):
+    """Measure one database in a fresh interpreter on a scratch copy of it."""
+    with tempfile.TemporaryDirectory() as scratch:
+        copy = os.path.join(scratch, "bench.db")
+        shutil.copyfile(database_path, copy)
+        env = dict(os.environ)
+        env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+        env.update(DATABASE_URL=f"sqlite:///{copy}", ANALYTICS_CACHE_TTL="0",
+                   ANALYTICS_CACHE_LOCAL_TTL="0")
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.endpoints", "measure", "--mode", mode,
+             "--scenarios", ",".join(scenarios), "--requests", str(requests),
+             "--concurrency", str(concurrency), "--warmup", str(warmup)],
+            env=env, check=True, capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def median_of(runs):
+    """Per-metric medians of repeated runs of the same scenarios."""
+    return {
+        scenario: {
+            metric: statistics.median(run[scenario][metric] for run in runs)
+            for metric in runs[0][scenario]
+        }
+        for scenario in runs[0]
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Regressions against ``baseline`` beyond ``tolerance`` (a fraction, e.g. 0.25)."""
+    regressions = []
+    for size, modes in results.items():
+        for mode, scenarios in modes.items():
+            for scenario, current in scenarios.items():
+                reference = baseline.get(size, {}).get(mode, {}).get(scenario)
+                if reference is None:
+                    continue
+                for metric, higher_is_better in GATED_METRICS.items():
+                    before, after = reference[metric], current[metric]
+                    if higher_is_better:
+                        regressed = after < before * (1 - tolerance)
+                    else:
+                        regressed = after > before * (1 + tolerance)
+                    if regressed:
+                        regressions.append(
+                            f"{size}/{mode}/{scenario}: {metric} {before} -> {after}"
+                        )
+    return regressions
+
+
+def check_growth(results, max_growth):
+    """Endpoints whose p50 grows more than ``max_growth``x from the smallest to the largest size."""
+    measured = sorted(results, key=SIZES.get)
+    if len(measured) < 2:
+        return []
+    smallest, largest = measured[0], measured[-1]
+    violations = []
+    for mode, scenarios in results[largest].items():
+        for scenario, current in scenarios.items():
+            reference = results[smallest].get(mode, {}).get(scenario)
+            if reference is None:
+                continue
+            growth = current["p50_ms"] / max(reference["p50_ms"], 1e-6)
+            if growth > max_growth:
+                violations.append(
+                    f"{mode}/{scenario}: p50 {reference['p50_ms']}ms at {smallest} -> "
+                    f"{current['p50_ms']}ms at {largest} ({growth:.1f}x)"
+                )
+    return violations
+
+
+def _csv(value):
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the agent's hot endpoints")
+    parser.add_argument("command", nargs="?", default="run", choices=["run", "measure"])
+    parser.add_argument("--sizes", type=_csv, default=["1k", "100k"],
+                        help=f"Comma-separated database sizes from {', '.join(SIZES)}")
+    parser.add_argument("--modes", type=_csv, default=MODES)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--scenarios", type=_csv, default=SCENARIOS)
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Runs per size and mode; the median of each metric is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR,
+                        help="Where seeded databases are kept between runs")
+    parser.add_argument("--output", help="Write results JSON here")
+    parser.add_argument("--compare", metavar="BASELINE", help="Baseline JSON to gate against")
+    parser.add_argument("--tolerance", type=float, default=0.3,
+                        help="Allowed fractional regression against the baseline")
+    parser.add_argument("--max-growth", type=float, default=3.0,
+                        help="Allowed p50 ratio between the largest and smallest size")
+    parser.add_argument("--save-baseline", metavar="PATH")
+    args = parser.parse_args(argv)
+
+    if args.command == "measure":
+        results = asyncio.run(_measure(
+            args.mode, args.scenarios, args.requests, args.concurrency, args.warmup
+        ))
+        print(json.dumps(results))
+        return 0
+
+    unknown = [size for size in args.sizes if size not in SIZES]
+    if unknown:
+        parser.error(f"unknown sizes: {', '.join(unknown)}")
+
+    results = {}
+    for size in args.sizes:
+        database_path = seeded_database(
+            args.data_dir, size, seed=args.seed,
+            report=lambda message: print(message, file=sys.stderr)
+        )
+        results[size] = {}
+        for mode in args.modes:
+            print(f"Measuring {size} / {mode}", file=sys.stderr)
+            results[size][mode] = median_of([
+                _run_isolated(
+                    database_path, mode, args.scenarios, args.requests,
+                    args.concurrency, args.warmup
+                )
+                for _ in range(args.repeat)
+            ])
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, "w") as output:
+            output.write(text + "\n")
+
+    failures = check_growth(results, args.max_growth)
+    if args.compare:
+        with open(args.compare) as baseline:
+            failures += compare(results, json.load(baseline)["results"], args.tolerance)
+    for failure in failures:
+        print(f"REGRESSION {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
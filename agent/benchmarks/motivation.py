@@ -0,0 +1,57 @@
+"""Throughput of motivation generation at different batch sizes.
+
+Sends distinct prompts (so the cache never hits) through ``MotivationService``
+from ``--concurrency`` concurrent callers and reports messages per second for
+each maximum batch size.  Requires ``torch`` and ``transformers``.  Run from
+the ``agent`` directory:
+
+    python -m benchmarks.motivation --batch-sizes 1,4,16 --concurrency 32 --threads 1
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from src import motivation
+
+
+def _prompts(count):
+    return [
+        motivation.build_prompt(
+            f"Habit {index}", "health", index % 40, (index % 10) / 10,
+            mood=index % 5 + 1, difficulty=index % 5 + 1
+        )
+        for index in range(count)
+    ]
+
+
+def measure(model, batch_size, concurrency, requests):
+    service = motivation.MotivationService(model, max_batch_size=batch_size)
+    prompts = _prompts(requests)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as callers:
+        wait([callers.submit(lambda prompt: service.submit(prompt).result(), prompt)
+              for prompt in prompts])
+    elapsed = time.perf_counter() - started
+    return {"messages_per_second": round(requests / elapsed, 2), "seconds": round(elapsed, 2)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure batched motivation throughput")
+    parser.add_argument("--batch-sizes", default="1,4,16")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=128)
+    parser.add_argument("--threads", type=int, default=1, help="torch threads")
+    args = parser.parse_args(argv)
+
+    model = motivation.TransformerModel(threads=args.threads)
+    model.generate(["Warm up."])
+    results = {
+        batch_size: measure(model, int(batch_size), args.concurrency, args.requests)
+        for batch_size in args.batch_sizes.split(",")
+    }
+    print(json.dumps({"model": model.name, "threads": args.threads, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
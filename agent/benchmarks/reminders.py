@@ -0,0 +1,144 @@
+"""Reminder scheduler at scale.
+
+Seeds a SQLite database with ``--users`` users, each with one active habit, a
+random timezone and a notification time on a 15-minute grid.  The database
+is kept under ``benchmarks/.data`` for later runs.  The benchmark then
+measures:
+
+* ``load``: scheduling every user from the database, and the memory it takes;
+* ``refresh``: re-reading and rescheduling changed users, as ``notify`` does;
+* ``dispatch``: a simulated day with the clock advanced a minute per tick.
+  Every user is reminded once, with a habit query and a checkpoint write per
+  batch.  Tick latency is the time to deliver everything due in one minute.
+
+Run from the ``agent`` directory:
+
+    python -m benchmarks.reminders --users 1000000
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import time
+from datetime import time as dt_time
+
+import numpy as np
+from sqlalchemy import delete, insert
+
+from src import reminders
+from src.models.database import Habit, ReminderCheckpoint, User, build_engine, init_db
+from src.seed import TIMEZONES
+
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(__file__), ".data")
+INSERT_CHUNK = 50_000
+
+
+class CountingSink:
+    def __init__(self):
+        self.count = 0
+
+    def send(self, batch):
+        self.count += len(batch)
+
+
+def seeded_database(data_dir, users, seed):
+    path = os.path.join(data_dir, f"reminders-{users}-seed{seed}.db")
+    bind = build_engine(f"sqlite:///{path}")
+    if os.path.exists(path):
+        return bind
+    init_db(bind)
+    rng = np.random.default_rng(seed)
+    zones = rng.choice(len(TIMEZONES), users).tolist()
+    slots = rng.integers(6 * 4, 22 * 4, users).tolist()
+    for low in range(0, users, INSERT_CHUNK):
+        index = range(low, min(users, low + INSERT_CHUNK))
+        with bind.begin() as connection:
+            connection.execute(insert(User), [{
+                "id": f"user-{i:07d}", "name": f"User {i}", "timezone": TIMEZONES[zones[i]],
+                "preferred_notification_time": dt_time(slots[i] // 4, slots[i] % 4 * 15),
+            } for i in index])
+            connection.execute(insert(Habit), [{
+                "id": f"habit-{i:07d}", "user_id": f"user-{i:07d}", "name": "Read",
+                "is_active": True,
+            } for i in index])
+    return bind
+
+
+def _rss_mb():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        # Not Linux: peak RSS is the best available
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(bind, users, refresh_count, seed):
+    with bind.begin() as connection:
+        connection.execute(delete(ReminderCheckpoint))
+    sink = CountingSink()
+    scheduler = reminders.ReminderScheduler(sink, bind)
+
+    rss_before = _rss_mb()
+    started = time.perf_counter()
+    scheduled = scheduler.load()
+    load_seconds = time.perf_counter() - started
+    results = {
+        "users": scheduled,
+        "load": {
+            "seconds": round(load_seconds, 2),
+            "users_per_second": round(scheduled / load_seconds),
+            "rss_growth_mb": round(_rss_mb() - rss_before),
+        },
+    }
+
+    changed = random.Random(seed).sample(range(users), refresh_count)
+    started = time.perf_counter()
+    scheduler.refresh_users(f"user-{i:07d}" for i in changed)
+    refresh_seconds = time.perf_counter() - started
+    results["refresh"] = {
+        "users": refresh_count,
+        "users_per_second": round(refresh_count / refresh_seconds),
+    }
+
+    start = scheduler.next_due()
+    ticks = []
+    for now in range(start, start + 86400, 60):
+        tick_started = time.perf_counter()
+        scheduler.dispatch_due(now)
+        ticks.append((time.perf_counter() - tick_started) * 1000)
+    busy = sorted(ticks)
+    results["dispatch"] = {
+        "reminders": sink.count,
+        "seconds": round(sum(ticks) / 1000, 2),
+        "reminders_per_second": round(sink.count / (sum(ticks) / 1000)),
+        "tick_p50_ms": round(statistics.median(busy), 2),
+        "tick_p99_ms": round(busy[int(len(busy) * 0.99)], 2),
+        "tick_max_ms": round(busy[-1], 2),
+        "heap_entries": len(scheduler._heap),
+    }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the reminder scheduler")
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--refresh", type=int, default=10_000,
+                        help="Users re-read from the database in the refresh measurement")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    started = time.perf_counter()
+    bind = seeded_database(args.data_dir, args.users, args.seed)
+    seeding = time.perf_counter() - started
+    results = measure(bind, args.users, min(args.refresh, args.users), args.seed)
+    results["seed_seconds"] = round(seeding, 1)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Serialization benchmark for the hot read endpoints.
+
+Compares, per request, the old path (return a model/dict and let FastAPI
+validate it against ``response_model`` and encode it with ``jsonable_encoder``
+and ``json.dumps``) with the pre-serialized, cached ``Response`` the agent
+now returns.  Reports wall and CPU time per request for ``GET /habits/{id}`` and
+``GET /analytics/{user_id}``.  Run from the ``agent`` directory:
+
+    python -m benchmarks.serialization --requests 2000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from fastapi import FastAPI, Depends
+from fastapi.testclient import TestClient
+
+
+def _seed(client):
+    user_id, habit_id = "bench-user", "bench-habit"
+    created_at = datetime(2024, 1, 1).isoformat()
+    client.post("/users/", json={
+        "id": user_id, "name": "Bench", "habits": [],
+        "preferred_notification_time": "09:00:00", "timezone": "UTC",
+        "created_at": created_at,
+    })
+    client.post(f"/habits/?user_id={user_id}", json={
+        "id": habit_id, "name": "Read", "description": "Read a chapter",
+        "frequency": "daily", "target_time": "09:00:00", "created_at": created_at,
+        "difficulty": 3, "category": "learning",
+    })
+    client.post("/completions/batch", json=[
+        {"habit_id": habit_id, "completed_at": f"2024-02-{day:02d}T09:00:00",
+         "mood": day % 5 + 1, "difficulty": day % 3 + 1}
+        for day in range(1, 29)
+    ])
+    return user_id, habit_id
+
+
+def _legacy_app():
+    """The same two endpoints as FastAPI's default serialization path."""
+    from sqlalchemy.orm import Session
+    from src import analytics
+    from src.models.database import Habit, get_db
+    from src.models.habit import Habit as HabitModel
+
+    legacy = FastAPI()
+
+    @legacy.get("/habits/{habit_id}", response_model=HabitModel)
+    def get_habit(habit_id: str, db: Session = Depends(get_db)):
+        return HabitModel.model_validate(db.get(Habit, habit_id))
+
+    @legacy.get("/analytics/{user_id}")
+    def get_user_analytics(user_id: str, db: Session = Depends(get_db)):
+        body = analytics.analytics_cache.get(("legacy", user_id))
+        if body is None:
+            body = analytics.compute_user_analytics(db, user_id)
+            analytics.analytics_cache.set(("legacy", user_id), body)
+        return body
+
+    return legacy
+
+
+def _time(client, path, requests):
+    client.get(path).raise_for_status()
+    wall, cpu = time.perf_counter(), time.process_time()
+    for _ in range(requests):
+        client.get(path)
+    return {
+        "wall_us": (time.perf_counter() - wall) / requests * 1e6,
+        "cpu_us": (time.process_time() - cpu) / requests * 1e6,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure response serialization cost")
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as database_dir:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(database_dir, 'bench.db')}"
+        from src.main import app
+
+        with TestClient(app) as current:
+            user_id, habit_id = _seed(current)
+            paths = {"habit": f"/habits/{habit_id}", "analytics": f"/analytics/{user_id}"}
+            legacy = TestClient(_legacy_app())
+            results = {
+                name: {
+                    "default": _time(legacy, path, args.requests),
+                    "pre_serialized": _time(current, path, args.requests),
+                }
+                for name, path in paths.items()
+            }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
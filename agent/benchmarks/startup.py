@@ -0,0 +1,104 @@
+"""Startup-time benchmark for the agent.
+
+Measures, in fresh interpreter processes, how long ``import src.main`` takes
+and how long a uvicorn server takes from spawn until ``/health/live``
+answers.  Run from the ``agent`` directory:
+
+    python -m benchmarks.startup --runs 5
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+HEAVY_MODULES = ["numpy", "pandas", "scipy", "sklearn", "torch", "transformers"]
+
+IMPORT_PROBE = f"""
+import json, sys, time
+started = time.perf_counter()
+import src.main
+elapsed = time.perf_counter() - started
+print(json.dumps({{
+    "seconds": elapsed,
+    "heavy_modules": [m for m in {HEAVY_MODULES!r} if m in sys.modules],
+}}))
+"""
+
+
+def _environment(database_dir):
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(database_dir, 'startup.db')}")
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    return env
+
+
+def measure_import(env):
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE], env=env, check=True,
+        capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def _free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def measure_ready(env, timeout=30.0):
+    """Seconds from spawning uvicorn until /health/live returns 200."""
+    port = _free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.main:app", "--port", str(port),
+         "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health/live", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.01)
+        raise TimeoutError(f"agent not ready after {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def _summary(samples):
+    return {
+        "median": statistics.median(samples),
+        "min": min(samples),
+        "max": max(samples),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure agent import and startup time")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as database_dir:
+        env = _environment(database_dir)
+        imports = [measure_import(env) for _ in range(args.runs)]
+        ready = [measure_ready(env) for _ in range(args.runs)]
+
+    print(json.dumps({
+        "import_seconds": _summary([sample["seconds"] for sample in imports]),
+        "ready_seconds": _summary(ready),
+        "heavy_modules_loaded": sorted({m for sample in imports for m in sample["heavy_modules"]}),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
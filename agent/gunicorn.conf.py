@@ -0,0 +1,42 @@
+"""Gunicorn settings for running the agent on several uvicorn workers.
+
+    gunicorn -c gunicorn.conf.py src.main:app
+
+Prometheus samples from every worker are written to PROMETHEUS_MULTIPROC_DIR
+and merged when /metrics is scraped.  Server-sent events reach every
+worker's subscribers only through EVENTS_RELAY_URL.
+"""
+import glob
+import multiprocessing
+import os
+
+bind = os.getenv("AGENT_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+graceful_timeout = 30
+
+
+def on_starting(server):
+    # Stale files from a previous run would be merged into the new counters
+    multiproc_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if multiproc_dir:
+        os.makedirs(multiproc_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(multiproc_dir, "*.db")):
+            os.remove(path)
+
+    # Without a relay, /events/stream only shows the connected worker's events
+    if server.cfg.workers > 1 and not os.environ.get("EVENTS_RELAY_URL"):
+        server.log.warning(
+            "%d workers without EVENTS_RELAY_URL: event stream clients will miss "
+            "events published by other workers", server.cfg.workers
+        )
+
+    # Create the schema once before forking so workers don't race on it
+    from src.models.database import engine, init_db
+    init_db()
+    engine.dispose()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,94 @@
+"""Per-user analytics built from a single aggregate query.
+
+Serialized results are cached like habit and user records (see
+``src.records``): a short-lived copy per worker in front of the optional
+``SHARED_CACHE_URL`` tier, so a write in one worker is visible in the others
+within ``ANALYTICS_CACHE_LOCAL_TTL`` seconds.
+"""
+import os
+
+from sqlalchemy import func, select
+
+from .cache import SHARED_CACHE_URL, ReadThroughCache, TTLCache, shared_backend
+from .responses import dumps
+from .models.database import ArchivedCompletionCount, Habit, HabitCompletion
+
+ANALYTICS_CACHE_TTL = float(os.getenv("ANALYTICS_CACHE_TTL", "60"))
+ANALYTICS_CACHE_LOCAL_TTL = float(os.getenv("ANALYTICS_CACHE_LOCAL_TTL", "2"))
+
+analytics_cache = ReadThroughCache(
+    TTLCache(maxsize=int(os.getenv("ANALYTICS_CACHE_SIZE", "10000")), ttl=ANALYTICS_CACHE_LOCAL_TTL),
+    shared=shared_backend(SHARED_CACHE_URL),
+    shared_ttl=ANALYTICS_CACHE_TTL,
+)
+
+
+def user_analytics_query(user_id):
+    completion_count = (
+        select(func.count(HabitCompletion.id))
+        .where(HabitCompletion.habit_id == Habit.id)
+        .correlate(Habit)
+        .scalar_subquery()
+    )
+    # Completions moved to cold storage by src.archive still count
+    archived_count = (
+        select(ArchivedCompletionCount.completions)
+        .where(ArchivedCompletionCount.habit_id == Habit.id)
+        .correlate(Habit)
+        .scalar_subquery()
+    )
+    return (
+        select(
+            Habit.category,
+            func.count(Habit.id),
+            func.coalesce(func.sum(Habit.streak), 0),
+            func.coalesce(func.sum(Habit.success_rate), 0.0),
+            func.coalesce(func.sum(completion_count + func.coalesce(archived_count, 0)), 0),
+        )
+        .where(Habit.user_id == user_id)
+        .group_by(Habit.category)
+    )
+
+
+def compute_user_analytics(db, user_id):
+    total_habits = 0
+    total_streaks = 0
+    total_success_rate = 0.0
+    total_completions = 0
+    habits_by_category = {}
+    completions_by_category = {}
+
+    for category, habits, streaks, success_rate, completions in db.execute(
+        user_analytics_query(user_id)
+    ):
+        total_habits += habits
+        total_streaks += streaks
+        total_success_rate += success_rate
+        total_completions += completions
+        habits_by_category[category] = habits
+        completions_by_category[category] = completions
+
+    average_success_rate = (total_success_rate / total_habits) * 100 if total_habits else 0.0
+    return {
+        "total_habits": total_habits,
+        "average_success_rate": float(average_success_rate),
+        "total_streaks": total_streaks,
+        "total_completions": total_completions,
+        "habits_by_category": habits_by_category,
+        "completions_by_category": completions_by_category,
+    }
+
+
+def get_user_analytics_json(db, user_id):
+    """Serialized analytics for the user; cached as bytes so hits skip encoding."""
+    return analytics_cache.get_or_load(
+        _key(user_id), lambda: dumps(compute_user_analytics(db, user_id))
+    )
+
+
+def _key(user_id):
+    return f"analytics:{user_id}"
+
+
+def invalidate_user(user_id):
+    analytics_cache.invalidate(_key(user_id))
@@ -0,0 +1,331 @@
+"""Cold storage for old completions as monthly Parquet files.
+
+``run`` moves completions older than ``ARCHIVE_HORIZON_DAYS`` out of
+``habit_completions`` into zstd-compressed Parquet files, one directory per
+month (``month=2024-01/part-<first id>-<last id>.parquet``).  Rows are sorted
+by user, and each row group records its user id range, so per-user reads
+skip most of a file.  Every file is listed in ``completion_archives``, and
+per-habit archived counts are kept in ``archived_completion_counts``.  The
+daily and weekly rollups are never archived, so time series and analytics
+totals still cover the full history.
+
+The cutoff is always a Monday at 00:00 UTC, so no rollup week is split
+between the archive and the hot table.  A file is written and renamed into
+place before its rows are deleted.  The delete must remove exactly the rows
+written; otherwise it is rolled back and the file removed.
+
+Exports and the cohort analytics read archived rows with ``iter_batches``,
+which memory-maps each file.  Streak rebuilds (``src.stats``,
+``src.recompute``) fold in ``completion_times`` for habits with archived
+rows.  ``pyarrow`` is imported only when an archive is written or read.
+
+    python -m src.archive run --horizon-days 365
+"""
+import argparse
+import bisect
+import os
+import uuid
+from collections import defaultdict, namedtuple
+from datetime import datetime, time as dt_time, timedelta
+
+from sqlalchemy import delete, func, select
+
+from . import recommendations, stats
+from .models.database import (
+    ArchivedCompletionCount, CompletionArchive, Habit, HabitCompletion, SessionLocal, engine
+)
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "/app/data/archive")
+HORIZON_DAYS = int(os.getenv("ARCHIVE_HORIZON_DAYS", "365"))
+# Rolling stats and recommendations read recent completions from the hot table
+MIN_HORIZON_DAYS = max(stats.WINDOW_DAYS, recommendations.LOOKBACK_DAYS)
+ROW_GROUP_SIZE = 100_000
+COLUMNS = ["id", "habit_id", "user_id", "category", "completed_at", "notes", "mood", "difficulty"]
+
+ArchivedCompletion = namedtuple("ArchivedCompletion", COLUMNS)
+
+
+class ArchiveUnavailable(RuntimeError):
+    """pyarrow is needed to write or read archived completions."""
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+    except ImportError as exc:
+        raise ArchiveUnavailable("Install pyarrow to write or read archived completions") from exc
+    return pa, pc, pq
+
+
+def _schema(pa):
+    return pa.schema([
+        ("id", pa.int64()), ("habit_id", pa.string()), ("user_id", pa.string()),
+        ("category", pa.string()), ("completed_at", pa.timestamp("us")),
+        ("notes", pa.string()), ("mood", pa.int8()), ("difficulty", pa.int8()),
+    ])
+
+
+def archive_cutoff(now, horizon_days):
+    """The Monday 00:00 on or before ``now - horizon_days``."""
+    day = (now - timedelta(days=horizon_days)).date()
+    return datetime.combine(day - timedelta(days=day.weekday()), dt_time())
+
+
+def archived_before(db):
+    """Everything before this has been archived; None if nothing has."""
+    return db.execute(select(func.max(CompletionArchive.archived_before))).scalar()
+
+
+def _next_month(month):
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _rows_query(start, end):
+    return (
+        select(
+            HabitCompletion.id, HabitCompletion.habit_id, Habit.user_id, Habit.category,
+            HabitCompletion.completed_at, HabitCompletion.notes, HabitCompletion.mood,
+            HabitCompletion.difficulty,
+        )
+        # Outer join: completions of deleted habits are archived too
+        .outerjoin(Habit, Habit.id == HabitCompletion.habit_id)
+        .where(HabitCompletion.completed_at >= start, HabitCompletion.completed_at < end)
+        .order_by(Habit.user_id, HabitCompletion.id)
+    )
+
+
+def _write_month(db, directory, month, start, end, cutoff, row_group_size):
+    """Archive completions in [start, end) to a new file; returns its manifest row."""
+    pa, _, pq = _pyarrow()
+    schema = _schema(pa)
+    folder = os.path.join(directory, f"month={month:%Y-%m}")
+    os.makedirs(folder, exist_ok=True)
+    temporary = os.path.join(folder, f".{uuid.uuid4().hex}.parquet.tmp")
+
+    rows = 0
+    # (min id, max id, first, last) per chunk; rows are sorted by user, not id
+    bounds = []
+    habits = {}
+    try:
+        with pq.ParquetWriter(temporary, schema, compression="zstd") as writer:
+            result = db.execute(_rows_query(start, end).execution_options(yield_per=row_group_size))
+            for chunk in result.partitions():
+                columns = list(zip(*chunk))
+                writer.write_table(pa.table(dict(zip(COLUMNS, columns)), schema=schema))
+                rows += len(chunk)
+                ids, habit_ids, completed = columns[0], columns[1], columns[4]
+                bounds.append((min(ids), max(ids), min(completed), max(completed)))
+                for habit_id, completed_at in zip(habit_ids, completed):
+                    count, latest = habits.get(habit_id, (0, completed_at))
+                    habits[habit_id] = (count + 1, max(latest, completed_at))
+        # End the read transaction before deleting
+        db.rollback()
+        min_id, max_id = min(bound[0] for bound in bounds), max(bound[1] for bound in bounds)
+        first_at, last_at = min(bound[2] for bound in bounds), max(bound[3] for bound in bounds)
+        with open(temporary, "rb") as written:
+            os.fsync(written.fileno())
+        relative = os.path.join(f"month={month:%Y-%m}", f"part-{min_id:012d}-{max_id:012d}.parquet")
+        path = os.path.join(directory, relative)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+    try:
+        deleted = db.execute(delete(HabitCompletion).where(
+            HabitCompletion.completed_at >= start, HabitCompletion.completed_at < end,
+            HabitCompletion.id <= max_id,
+        )).rowcount
+        if deleted != rows:
+            raise RuntimeError(
+                f"{month:%Y-%m}: wrote {rows} completions but would delete {deleted}; "
+                "completions changed while archiving"
+            )
+        archive = CompletionArchive(
+            month=month, path=relative, rows=rows, size_bytes=os.path.getsize(path),
+            min_id=min_id, max_id=max_id, min_completed_at=first_at, max_completed_at=last_at,
+            archived_before=cutoff,
+        )
+        db.add(archive)
+        _add_counts(db, habits)
+        db.commit()
+    except BaseException:
+        db.rollback()
+        os.remove(path)
+        raise
+    return archive
+
+
+def _add_counts(db, habits):
+    habit_ids = [habit_id for habit_id in habits if habit_id is not None]
+    for start in range(0, len(habit_ids), 500):
+        batch = habit_ids[start:start + 500]
+        existing = {
+            row.habit_id: row
+            for row in db.execute(
+                select(ArchivedCompletionCount).where(ArchivedCompletionCount.habit_id.in_(batch))
+            ).scalars()
+        }
+        for habit_id in batch:
+            count, latest = habits[habit_id]
+            row = existing.get(habit_id)
+            if row is None:
+                db.add(ArchivedCompletionCount(
+                    habit_id=habit_id, completions=count, last_completed_at=latest
+                ))
+            else:
+                row.completions += count
+                row.last_completed_at = max(row.last_completed_at or latest, latest)
+
+
+def run(bind=engine, horizon_days=HORIZON_DAYS, directory=None, now=None,
+        row_group_size=ROW_GROUP_SIZE, report=print):
+    """Archive completions older than the horizon, a month at a time; returns the new files."""
+    directory = directory or ARCHIVE_DIR
+    if horizon_days < MIN_HORIZON_DAYS:
+        raise ValueError(f"The archive horizon must be at least {MIN_HORIZON_DAYS} days")
+    _pyarrow()
+    cutoff = archive_cutoff(now or datetime.utcnow(), horizon_days)
+    written = []
+    while True:
+        with SessionLocal(bind=bind) as db:
+            oldest = db.execute(
+                select(func.min(HabitCompletion.completed_at))
+                .where(HabitCompletion.completed_at < cutoff)
+            ).scalar()
+            if oldest is None:
+                break
+            month = oldest.date().replace(day=1)
+            start = datetime.combine(month, dt_time())
+            end = min(datetime.combine(_next_month(month), dt_time()), cutoff)
+            archive = _write_month(db, directory, month, start, end, cutoff, row_group_size)
+            db.refresh(archive)
+            db.expunge(archive)
+        written.append(archive)
+        report(f"Archived {archive.rows:,} completions from {month:%Y-%m} "
+               f"({archive.size_bytes / 2 ** 20:.1f} MiB)")
+    return written
+
+
+def archived_files(db, start=None, end=None):
+    """Archive paths that may hold completions in [start, end), oldest first."""
+    query = select(CompletionArchive.path).order_by(CompletionArchive.month, CompletionArchive.min_id)
+    if start is not None:
+        query = query.where(CompletionArchive.max_completed_at >= stats.naive_utc(start))
+    if end is not None:
+        query = query.where(CompletionArchive.min_completed_at < stats.naive_utc(end))
+    return db.execute(query).scalars().all()
+
+
+def _row_groups(parquet, users):
+    """Row groups whose user id range can contain one of the sorted ``users``."""
+    metadata = parquet.metadata
+    if users is None:
+        return list(range(metadata.num_row_groups))
+    column = parquet.schema_arrow.get_field_index("user_id")
+    groups = []
+    for index in range(metadata.num_row_groups):
+        statistics = metadata.row_group(index).column(column).statistics
+        if statistics is None or not statistics.has_min_max:
+            groups.append(index)
+            continue
+        first = bisect.bisect_left(users, statistics.min)
+        if first < len(users) and users[first] <= statistics.max:
+            groups.append(index)
+    return groups
+
+
+def iter_batches(paths, user_id=None, start=None, end=None, columns=None,
+                 directory=None, batch_size=ROW_GROUP_SIZE, user_ids=None):
+    """Archived completions as pyarrow record batches, filtered and memory-mapped.
+
+    Pass ``user_id`` for one user or ``user_ids`` for several.
+    """
+    if not paths:
+        return
+    directory = directory or ARCHIVE_DIR
+    pa, pc, pq = _pyarrow()
+    if user_id is not None:
+        user_ids = [user_id]
+    users = None if user_ids is None else sorted(set(user_ids))
+    read = None if columns is None else list(dict.fromkeys(
+        list(columns) + (["user_id"] if users is not None else [])
+        + (["completed_at"] if start is not None or end is not None else [])
+    ))
+    for path in paths:
+        parquet = pq.ParquetFile(os.path.join(directory, path), memory_map=True)
+        groups = _row_groups(parquet, users)
+        if not groups:
+            continue
+        for batch in parquet.iter_batches(batch_size=batch_size, row_groups=groups, columns=read):
+            conditions = []
+            if users is not None:
+                conditions.append(pc.is_in(batch.column("user_id"), value_set=pa.array(users, pa.string())))
+            if start is not None:
+                conditions.append(pc.greater_equal(
+                    batch.column("completed_at"), pa.scalar(stats.naive_utc(start), pa.timestamp("us"))
+                ))
+            if end is not None:
+                conditions.append(pc.less(
+                    batch.column("completed_at"), pa.scalar(stats.naive_utc(end), pa.timestamp("us"))
+                ))
+            if conditions:
+                mask = conditions[0]
+                for condition in conditions[1:]:
+                    mask = pc.and_(mask, condition)
+                batch = batch.filter(mask)
+            if columns is not None:
+                batch = batch.select(list(columns))
+            if batch.num_rows:
+                yield batch
+
+
+def iter_rows(paths, user_id=None, start=None, end=None, directory=None):
+    """Archived completions as ``ArchivedCompletion`` tuples, file by file."""
+    for batch in iter_batches(paths, user_id, start, end, directory=directory):
+        yield from map(ArchivedCompletion._make, zip(*(
+            batch.column(name).to_pylist() for name in COLUMNS
+        )))
+
+
+def completion_times(db, user_ids, directory=None):
+    """Archived completion times of the users' habits: habit id -> sorted list."""
+    times = defaultdict(list)
+    user_ids = list(user_ids)
+    if not user_ids:
+        return times
+    for batch in iter_batches(
+        archived_files(db), columns=["habit_id", "completed_at"], directory=directory,
+        user_ids=user_ids,
+    ):
+        for habit_id, completed_at in zip(
+            batch.column("habit_id").to_pylist(), batch.column("completed_at").to_pylist()
+        ):
+            times[habit_id].append(completed_at)
+    for values in times.values():
+        values.sort()
+    return times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive old completions to Parquet")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    run_parser = subcommands.add_parser("run", help="Archive completions older than the horizon")
+    run_parser.add_argument("--horizon-days", type=int, default=HORIZON_DAYS)
+    run_parser.add_argument("--directory", default=None, help="Default: $ARCHIVE_DIR")
+    run_parser.add_argument("--vacuum", action="store_true",
+                            help="VACUUM a SQLite database afterwards to return freed pages to the OS")
+    args = parser.parse_args(argv)
+
+    written = run(horizon_days=args.horizon_days, directory=args.directory)
+    print(f"Wrote {len(written)} archive files, {sum(archive.rows for archive in written):,} completions")
+    if args.vacuum and written and engine.url.get_backend_name() == "sqlite":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.exec_driver_sql("VACUUM")
+
+
+if __name__ == "__main__":
+    main()
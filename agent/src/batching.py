@@ -0,0 +1,76 @@
+"""Coalesce work submitted from many callers into batches."""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class BatchQueue:
+    """Hands batches of submitted items to ``handler`` on a background thread.
+
+    A batch is flushed once it holds ``max_batch_size`` items or ``max_delay``
+    seconds after its first item arrived, whichever comes first.  ``handler``
+    receives the list of items and returns one result per item; a result that
+    is an exception is raised to that item's caller only.
+    """
+
+    def __init__(self, handler, max_batch_size=500, max_delay=0.005, name="batch-queue"):
+        self.handler = handler
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.name = name
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def submit(self, item):
+        future = Future()
+        self._ensure_started()
+        self._queue.put((item, future))
+        return future
+
+    def submit_many(self, items):
+        """Submit ``items`` in order; returns one future per item."""
+        return [self.submit(item) for item in items]
+
+    def _ensure_started(self):
+        # Threads don't survive fork, so each worker process starts its own
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        pending = self._queue
+        while True:
+            batch = [pending.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        try:
+            results = self.handler([item for item, _ in batch])
+        except Exception as exc:
+            for _, future in batch:
+                future.set_exception(exc)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
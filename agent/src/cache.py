@@ -0,0 +1,196 @@
+"""Small in-process caches shared by the API endpoints."""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Optional shared tier (e.g. redis://cache:6379/0) behind every ReadThroughCache
+SHARED_CACHE_URL = os.getenv("SHARED_CACHE_URL")
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize=1024, ttl=60.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class MemoryBackend:
+    """In-process stand-in for a shared cache: bytes values with per-key TTLs."""
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (self._clock() + ttl, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class RedisBackend:
+    """Shared cache on a Redis server; requires the optional ``redis`` package."""
+
+    def __init__(self, url):
+        import redis
+
+        self._client = redis.Redis.from_url(url, socket_timeout=0.05)
+
+    def get(self, key):
+        return self._client.get(key)
+
+    def set(self, key, value, ttl):
+        self._client.set(key, value, px=max(1, int(ttl * 1000)))
+
+    def delete(self, key):
+        self._client.delete(key)
+
+
+def shared_backend(url):
+    """Shared cache backend for ``url``, or None when no URL is configured."""
+    if not url:
+        return None
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url)
+    if url == "memory://":
+        return MemoryBackend()
+    raise ValueError(f"Unsupported shared cache URL: {url}")
+
+
+class ReadThroughCache:
+    """A local ``TTLCache`` in front of an optional shared backend.
+
+    Values are bytes so they can live in either tier.  A shared backend that
+    errors is treated as a miss rather than failing the request.
+
+    Shared entries are filed under a per-key version that every invalidation
+    replaces, so a fill that raced an invalidation in another worker lands
+    under the old version and is never read back.
+    """
+
+    def __init__(self, local, shared=None, shared_ttl=60.0):
+        self.local = local
+        self.shared = shared
+        self.shared_ttl = shared_ttl
+        # Outlives the entries filed under a version, so a key whose version
+        # expired can't fall back to a fill from before its last invalidation
+        self.version_ttl = shared_ttl * 2 + 60
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, load):
+        """Cached value for ``key``, calling ``load()`` on a miss; None results aren't cached."""
+        value = self.local.get(key)
+        if value is not None:
+            return value
+        # The version is read before loading, so the fill below goes under
+        # the version that was current when this read started
+        shared_key = self._shared_key(key)
+        if shared_key is not None:
+            value = self._shared_call("get", shared_key)
+            if value is not None:
+                self.local.set(key, value)
+                return value
+
+        generation = self._generation
+        value = load()
+        if value is None:
+            return None
+        # Skip the fill if a write invalidated anything while we were loading,
+        # otherwise a pre-write read could repopulate the entry it just dropped
+        with self._lock:
+            if generation != self._generation:
+                return value
+            self.local.set(key, value)
+        if shared_key is not None:
+            self._shared_call("set", shared_key, value, self.shared_ttl)
+        return value
+
+    def invalidate(self, *keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self.local.invalidate(key)
+        for key in keys:
+            self._shared_call("set", _version_key(key), os.urandom(8).hex().encode(), self.version_ttl)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.local.clear()
+
+    def _shared_key(self, key):
+        """``key`` at its current shared version, or None when the shared tier is unavailable."""
+        if self.shared is None:
+            return None
+        try:
+            version = self.shared.get(_version_key(key))
+        except Exception:
+            logger.warning("Shared cache get failed", exc_info=True)
+            return None
+        return f"{key}#{version.decode() if version else '0'}"
+
+    def _shared_call(self, method, *args):
+        if self.shared is None:
+            return None
+        try:
+            return getattr(self.shared, method)(*args)
+        except Exception:
+            logger.warning("Shared cache %s failed", method, exc_info=True)
+            return None
+
+
+def _version_key(key):
+    return f"{key}#version"
@@ -0,0 +1,292 @@
+"""Population-wide habit analytics computed on columnar arrays.
+
+Completions are read in chunks with pandas and reduced per chunk to
+(a) the distinct days each habit was completed on and (b) per-category
+sufficient statistics for the mood/difficulty correlation.  Streaks,
+retention and percentiles are then computed with NumPy over those arrays,
+without Python loops over rows.
+
+    python -m src.cohort --max-weeks 12 --output cohort.json
+"""
+import argparse
+import itertools
+import json
+import os
+import threading
+from datetime import date, datetime, timezone
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+
+from . import archive
+from .cache import TTLCache
+from .models.database import Habit, HabitCompletion, engine
+
+PERCENTILES = [10, 25, 50, 75, 90, 99]
+STREAK_BUCKETS = [1, 2, 3, 7, 14, 30, 60, 90, 180, 365]
+EPOCH = np.datetime64("1970-01-01", "D")
+
+# Full recomputes are expensive; the admin endpoint serves this snapshot
+cohort_cache = TTLCache(maxsize=16, ttl=float(os.getenv("COHORT_CACHE_TTL", "300")))
+_compute_locks = {}
+_compute_locks_guard = threading.Lock()
+
+
+def _completions_query():
+    return (
+        select(
+            HabitCompletion.habit_id,
+            Habit.user_id,
+            Habit.category,
+            HabitCompletion.completed_at,
+            HabitCompletion.mood,
+            HabitCompletion.difficulty,
+        )
+        .join(Habit, Habit.id == HabitCompletion.habit_id)
+    )
+
+
+def _correlation_sums(chunk):
+    both = chunk.dropna(subset=["mood", "difficulty"])
+    x = both["mood"].astype(float)
+    y = both["difficulty"].astype(float)
+    sums = pd.DataFrame({
+        "category": both["category"],
+        "n": 1.0, "sx": x, "sy": y, "sxx": x * x, "syy": y * y, "sxy": x * y,
+    })
+    return sums.groupby("category").sum()
+
+
+def _archived_chunks(connection, chunk_size):
+    columns = ["habit_id", "user_id", "category", "completed_at", "mood", "difficulty"]
+    for batch in archive.iter_batches(
+        archive.archived_files(connection), columns=columns, batch_size=chunk_size
+    ):
+        yield batch.to_pandas()
+
+
+def load_columns(bind=engine, chunk_size=100_000):
+    """Read completions chunk by chunk into distinct habit-days and correlation sums.
+
+    Archived completions are read from their Parquet files first.
+    """
+    day_frames = []
+    correlation = None
+    with bind.connect() as connection:
+        connection = connection.execution_options(stream_results=True)
+        chunks = itertools.chain(
+            _archived_chunks(connection, chunk_size),
+            pd.read_sql(_completions_query(), connection, chunksize=chunk_size),
+        )
+        for chunk in chunks:
+            days = pd.to_datetime(chunk["completed_at"]).values.astype("datetime64[D]")
+            chunk = chunk.assign(day=(days - EPOCH).astype(np.int64))
+            day_frames.append(
+                chunk[["habit_id", "user_id", "category", "day"]].drop_duplicates()
+            )
+            sums = _correlation_sums(chunk)
+            correlation = sums if correlation is None else correlation.add(sums, fill_value=0)
+
+    columns = ["habit_id", "user_id", "category", "day"]
+    habit_days = (
+        pd.concat(day_frames, ignore_index=True).drop_duplicates()
+        if day_frames else pd.DataFrame(columns=columns)
+    )
+    if correlation is None:
+        correlation = pd.DataFrame(columns=["n", "sx", "sy", "sxx", "syy", "sxy"])
+    return habit_days, correlation
+
+
+def streak_runs(habit_codes, days):
+    """Consecutive-day runs for arrays sorted by (habit, day) with distinct days.
+
+    Returns the habit code, last day and length of every run.
+    """
+    if len(days) == 0:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, empty
+    breaks = (np.diff(habit_codes) != 0) | (np.diff(days) != 1)
+    starts = np.flatnonzero(np.concatenate(([True], breaks)))
+    ends = np.concatenate((starts[1:], [len(days)])) - 1
+    return habit_codes[starts], days[ends], ends - starts + 1
+
+
+def _distribution(values):
+    values = np.asarray(values, dtype=float)
+    if len(values) == 0:
+        return {"count": 0}
+    histogram, _ = np.histogram(values, bins=STREAK_BUCKETS + [np.inf])
+    return {
+        "count": int(len(values)),
+        "mean": float(values.mean()),
+        "max": float(values.max()),
+        "percentiles": dict(zip(map(str, PERCENTILES), np.percentile(values, PERCENTILES).tolist())),
+        # Number of values in [bucket, next bucket)
+        "histogram": dict(zip(map(str, STREAK_BUCKETS), histogram.tolist())),
+    }
+
+
+def streak_distributions(habit_days, as_of_day):
+    ordered = habit_days.sort_values(["habit_id", "day"])
+    habit_codes, habit_ids = pd.factorize(ordered["habit_id"])
+    run_habits, run_last_days, run_lengths = streak_runs(
+        habit_codes.astype(np.int64), ordered["day"].to_numpy(dtype=np.int64)
+    )
+
+    longest = np.zeros(len(habit_ids), dtype=np.int64)
+    np.maximum.at(longest, run_habits, run_lengths)
+    # A habit's current streak is its latest run, if that run reaches yesterday
+    last_runs = np.flatnonzero(np.concatenate((np.diff(run_habits) != 0, [True])))[:len(run_habits)]
+    current = np.zeros(len(habit_ids), dtype=np.int64)
+    is_live = run_last_days[last_runs] >= as_of_day - 1
+    current[run_habits[last_runs]] = np.where(is_live, run_lengths[last_runs], 0)
+
+    habits = (
+        ordered.drop_duplicates("habit_id")
+        .set_index("habit_id")
+        .loc[habit_ids, ["user_id", "category"]]
+        .assign(longest=longest, current=current)
+    )
+    per_user = habits.groupby("user_id")["longest"].max()
+    return {
+        "habits": {
+            "longest": _distribution(habits["longest"]),
+            "current": _distribution(habits["current"][habits["current"] > 0]),
+        },
+        "users_best_streak": _distribution(per_user),
+        "by_category": {
+            category: _distribution(group)
+            for category, group in habits.groupby("category")["longest"]
+        },
+    }
+
+
+def retention_curve(habit_days, max_weeks=12):
+    """Share of users still active k weeks after their first active week."""
+    if habit_days.empty:
+        return {"weeks": [], "retention": [], "eligible_users": [], "cohort_sizes": {}}
+    user_codes, _ = pd.factorize(habit_days["user_id"])
+    # Weeks start on Monday; 1970-01-01 was a Thursday
+    weeks = (habit_days["day"].to_numpy(dtype=np.int64) + 3) // 7
+
+    first_week = np.full(user_codes.max() + 1, np.iinfo(np.int64).max)
+    np.minimum.at(first_week, user_codes, weeks)
+    offsets = weeks - first_week[user_codes]
+
+    active = np.unique(np.stack([user_codes, offsets]), axis=1)
+    active = active[:, active[1] <= max_weeks]
+    active_counts = np.bincount(active[1], minlength=max_weeks + 1)
+
+    # Only users whose cohort is old enough to have reached week k count toward it
+    last_week = weeks.max()
+    observable = np.minimum(last_week - first_week, max_weeks)
+    eligible = np.cumsum(np.bincount(observable, minlength=max_weeks + 1)[::-1])[::-1]
+
+    retention = np.divide(
+        active_counts, eligible, out=np.zeros(max_weeks + 1), where=eligible > 0
+    )
+    cohort_weeks, cohort_sizes = np.unique(first_week, return_counts=True)
+    cohort_starts = EPOCH + (cohort_weeks * 7 - 3).astype("timedelta64[D]")
+    return {
+        "weeks": list(range(max_weeks + 1)),
+        "retention": retention.tolist(),
+        "eligible_users": eligible.tolist(),
+        "cohort_sizes": dict(zip(map(str, cohort_starts), cohort_sizes.tolist())),
+    }
+
+
+def mood_difficulty_correlation(correlation):
+    def pearson(sums):
+        n, sx, sy = sums["n"], sums["sx"], sums["sy"]
+        denominator = np.sqrt((n * sums["sxx"] - sx ** 2) * (n * sums["syy"] - sy ** 2))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            r = (n * sums["sxy"] - sx * sy) / denominator
+        return np.where(np.isfinite(r), r, np.nan)
+
+    if correlation.empty:
+        return {"overall": None, "by_category": {}}
+    by_category = pearson(correlation)
+    overall = pearson(correlation.sum())
+    return {
+        "overall": None if np.isnan(overall) else float(overall),
+        "by_category": {
+            category: {"r": None if np.isnan(r) else float(r), "samples": int(n)}
+            for category, r, n in zip(correlation.index, by_category, correlation["n"])
+        },
+    }
+
+
+def success_rate_percentiles(bind=engine):
+    query = select(Habit.category, Habit.success_rate).where(Habit.is_active.is_(True))
+    with bind.connect() as connection:
+        habits = pd.read_sql(query, connection)
+    rates = habits["success_rate"].fillna(0.0).to_numpy(dtype=float)
+
+    def percentiles(values):
+        if len(values) == 0:
+            return {}
+        return dict(zip(map(str, PERCENTILES), np.percentile(values, PERCENTILES).tolist()))
+
+    return {
+        "overall": percentiles(rates),
+        "by_category": {
+            category: percentiles(group.fillna(0.0).to_numpy(dtype=float))
+            for category, group in habits.groupby("category")["success_rate"]
+        },
+    }
+
+
+def compute_cohort_analytics(bind=engine, max_weeks=12, as_of=None, chunk_size=100_000):
+    as_of = as_of or datetime.now(timezone.utc).date()
+    as_of_day = (np.datetime64(as_of, "D") - EPOCH).astype(np.int64)
+    habit_days, correlation = load_columns(bind, chunk_size=chunk_size)
+    return {
+        "as_of": as_of.isoformat(),
+        "users": int(habit_days["user_id"].nunique()),
+        "habits": int(habit_days["habit_id"].nunique()),
+        "streaks": streak_distributions(habit_days, as_of_day),
+        "retention": retention_curve(habit_days, max_weeks=max_weeks),
+        "mood_difficulty_correlation": mood_difficulty_correlation(correlation),
+        "success_rate_percentiles": success_rate_percentiles(bind),
+    }
+
+
+def get_cohort_analytics(max_weeks=12):
+    report = cohort_cache.get(max_weeks)
+    if report is not None:
+        return report
+
+    # Requests that miss together wait for one scan instead of each running
+    # their own, so a cold cache costs one connection and one pass over the data
+    with _compute_locks_guard:
+        lock = _compute_locks.setdefault(max_weeks, threading.Lock())
+    with lock:
+        report = cohort_cache.get(max_weeks)
+        if report is None:
+            report = compute_cohort_analytics(max_weeks=max_weeks)
+            cohort_cache.set(max_weeks, report)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Population-wide habit analytics")
+    parser.add_argument("--max-weeks", type=int, default=12)
+    parser.add_argument("--as-of", type=date.fromisoformat, default=None)
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    parser.add_argument("--output", help="Write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = compute_cohort_analytics(
+        max_weeks=args.max_weeks, as_of=args.as_of, chunk_size=args.chunk_size
+    )
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""Server-sent event fan-out.
+
+A ``Broadcaster`` keeps recent events in a fixed-size ring buffer, each one
+already encoded as an SSE frame.  Subscribers are cursors into that buffer
+rather than queues: publishing appends once and wakes the waiters, however
+many dashboards are connected, and an idle subscriber costs an integer.
+A subscriber that falls behind by more than the buffer holds doesn't slow
+anyone down.  It skips ahead to the oldest event still buffered and receives
+a ``lagged`` event with the number it missed, so the client can refetch.
+Reconnecting clients send ``Last-Event-ID`` and are replayed whatever the
+buffer still holds.
+
+Publishing is thread-safe: the completion writer and threadpool endpoints
+publish from worker threads.  Subscribers read from sync generators (Flask)
+or async generators (FastAPI).
+
+Event ids are per process.  With several workers, set ``EVENTS_RELAY_URL``
+(e.g. ``redis://cache:6379/0``) to relay events through Redis pub/sub, so
+every worker's subscribers see every event.
+"""
+import asyncio
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+BUFFER_SIZE = int(os.getenv("EVENTS_BUFFER_SIZE", "1024"))
+MAX_SUBSCRIBERS = int(os.getenv("EVENTS_MAX_SUBSCRIBERS", "1000"))
+HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+RELAY_CHANNEL = "habit-events"
+# Sent first on every stream: how long clients wait before reconnecting
+RETRY_FRAME = b"retry: 3000\n\n"
+HEARTBEAT_FRAME = b": keepalive\n\n"
+
+
+class TooManySubscribers(RuntimeError):
+    """The broadcaster is at its subscriber limit."""
+
+
+def format_event(event_id, event_type, data):
+    """One SSE frame; ``data`` is JSON bytes without newlines."""
+    return b"id: %d\nevent: %s\ndata: %s\n\n" % (event_id, event_type.encode(), data)
+
+
+class RedisRelay:
+    """Carries published events between processes over Redis pub/sub."""
+
+    def __init__(self, url, channel=RELAY_CHANNEL):
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+        self.channel = channel
+
+    def publish(self, messages):
+        pipeline = self._client.pipeline(transaction=False)
+        for message in messages:
+            pipeline.publish(self.channel, message)
+        pipeline.execute()
+
+    def listen(self, deliver):
+        """Call ``deliver(message)`` for every relayed message, from a daemon thread."""
+        def run():
+            while True:
+                try:
+                    pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+                    pubsub.subscribe(self.channel)
+                    for message in pubsub.listen():
+                        deliver(message["data"])
+                except Exception:
+                    # Events published while disconnected are lost to this process
+                    logger.warning("Event relay disconnected; reconnecting", exc_info=True)
+                    time.sleep(1)
+
+        threading.Thread(target=run, name="event-relay", daemon=True).start()
+
+
+def _encode_relayed(event_type, key, data):
+    return b"%s\n%s\n%s" % (event_type.encode(), (key or "").encode(), data)
+
+
+def _decode_relayed(message):
+    event_type, key, data = message.split(b"\n", 2)
+    return event_type.decode(), key.decode() or None, data
+
+
+class Broadcaster:
+    """Bounded fan-out of events to any number of SSE subscribers."""
+
+    def __init__(self, buffer_size=BUFFER_SIZE, max_subscribers=MAX_SUBSCRIBERS, relay=None):
+        self.max_subscribers = max_subscribers
+        # (event id, key, frame); ids are consecutive
+        self._frames = deque(maxlen=buffer_size)
+        self._last_id = 0
+        self._subscribers = 0
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        # One event per event loop with async subscribers waiting on it
+        self._loop_events = {}
+        self.relay = relay
+        if relay is not None:
+            relay.listen(self._append_relayed)
+
+    @property
+    def last_event_id(self):
+        return self._last_id
+
+    @property
+    def subscribers(self):
+        return self._subscribers
+
+    def publish(self, event_type, data, key=None):
+        """Send ``data`` (JSON-serializable) to subscribers; ``key`` lets them filter."""
+        self.publish_many(event_type, [(data, key)])
+
+    def publish_many(self, event_type, events):
+        """Publish (data, key) pairs with a single wake-up."""
+        encoded = [(orjson.dumps(data), key) for data, key in events]
+        if not encoded:
+            return
+        if self.relay is not None:
+            try:
+                self.relay.publish([_encode_relayed(event_type, key, data) for data, key in encoded])
+                return
+            except Exception:
+                logger.warning("Event relay failed; publishing locally", exc_info=True)
+        self._append(event_type, encoded)
+
+    def _append_relayed(self, message):
+        event_type, key, data = _decode_relayed(message)
+        self._append(event_type, [(data, key)])
+
+    def _append(self, event_type, encoded):
+        with self._lock:
+            for data, key in encoded:
+                self._last_id += 1
+                self._frames.append((self._last_id, key, format_event(self._last_id, event_type, data)))
+            self._condition.notify_all()
+            loop_events, self._loop_events = self._loop_events, {}
+        for loop, event in loop_events.items():
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The loop has closed
+                pass
+
+    def subscribe(self, last_event_id=None, key=None):
+        """A subscription starting after ``last_event_id``, or at the next new event.
+
+        Only events published with ``key`` (or with no key) are delivered when
+        ``key`` is given.
+        """
+        with self._lock:
+            if self._subscribers >= self.max_subscribers:
+                raise TooManySubscribers(f"{self._subscribers} subscribers connected")
+            self._subscribers += 1
+            cursor = self._last_id
+            lagged = False
+            if last_event_id is not None:
+                if 0 <= last_event_id <= self._last_id:
+                    cursor = last_event_id
+                else:
+                    # An id from another process or before a restart
+                    lagged = True
+        return Subscription(self, cursor, key, lagged)
+
+    def _unsubscribe(self):
+        with self._lock:
+            self._subscribers -= 1
+
+
+class Subscription:
+    """A subscriber's position in a ``Broadcaster``; close it when the client leaves."""
+
+    def __init__(self, broadcaster, cursor, key=None, lagged=False):
+        self._broadcaster = broadcaster
+        self.cursor = cursor
+        self.key = key
+        self.closed = False
+        self._unknown_lag = lagged
+
+    def _collect(self):
+        # Callers hold the broadcaster's lock
+        broadcaster = self._broadcaster
+        frames = []
+        if self._unknown_lag:
+            frames.append(format_event(self.cursor, "lagged", b'{"dropped":null}'))
+            self._unknown_lag = False
+        if self.cursor >= broadcaster._last_id:
+            return frames
+        buffered = broadcaster._frames
+        first_id = buffered[0][0]
+        if self.cursor + 1 < first_id:
+            dropped = first_id - self.cursor - 1
+            frames.append(format_event(first_id - 1, "lagged", b'{"dropped":%d}' % dropped))
+            self.cursor = first_id - 1
+        for event_id, key, frame in itertools.islice(buffered, self.cursor + 1 - first_id, None):
+            if self.key is None or key is None or key == self.key:
+                frames.append(frame)
+        self.cursor = broadcaster._last_id
+        return frames
+
+    def read(self):
+        """Frames published since the last read (maybe none), as one bytes object."""
+        with self._broadcaster._lock:
+            return b"".join(self._collect())
+
+    def wait(self, timeout):
+        """Block until new frames arrive or ``timeout`` passes; returns them, possibly empty."""
+        deadline = time.monotonic() + timeout
+        condition = self._broadcaster._condition
+        with condition:
+            frames = self._collect()
+            # Every publish wakes every subscriber; events for other keys
+            # leave this one with nothing to send, so it keeps waiting
+            while not frames:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                condition.wait(remaining)
+                frames = self._collect()
+        return b"".join(frames)
+
+    async def wait_async(self, timeout):
+        """Async ``wait`` for subscribers on an event loop."""
+        broadcaster = self._broadcaster
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            with broadcaster._lock:
+                frames = self._collect()
+                remaining = deadline - loop.time()
+                if frames or remaining <= 0:
+                    return b"".join(frames)
+                event = broadcaster._loop_events.get(loop)
+                if event is None:
+                    event = broadcaster._loop_events[loop] = asyncio.Event()
+            try:
+                await asyncio.wait_for(event.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._broadcaster._unsubscribe()
+
+    def stream(self, heartbeat=HEARTBEAT_SECONDS):
+        """SSE body for a sync (WSGI) response."""
+        try:
+            yield RETRY_FRAME
+            while True:
+                yield self.wait(heartbeat) or HEARTBEAT_FRAME
+        finally:
+            self.close()
+
+    async def astream(self, heartbeat=HEARTBEAT_SECONDS):
+        """SSE body for an async (ASGI) response."""
+        try:
+            yield RETRY_FRAME
+            while True:
+                yield await self.wait_async(heartbeat) or HEARTBEAT_FRAME
+        finally:
+            self.close()
+
+
+def parse_last_event_id(value):
+    try:
+        return int(value) if value not in (None, "") else None
+    except ValueError:
+        return None
+
+
+def _relay_from_env():
+    url = os.getenv("EVENTS_RELAY_URL")
+    return RedisRelay(url) if url else None
+
+
+# Completion and habit events published by the agent
+broadcaster = Broadcaster(relay=_relay_from_env())
@@ -0,0 +1,113 @@
+"""Streaming exports of completion history.
+
+Rows are read in keyset-paginated chunks (``id > last_id``), each in its own
+short read transaction and streamed from the cursor with ``yield_per``.
+Memory stays flat however large the history is, and no single export holds
+the database open for its whole duration.  Archived completions (see
+``src.archive``) come first, file by file, followed by the hot table.
+"""
+import csv
+import io
+import json
+
+from sqlalchemy import select
+
+from . import archive
+from .models.database import Habit, HabitCompletion, SessionLocal
+
+EXPORT_COLUMNS = [
+    "id", "habit_id", "user_id", "category", "completed_at", "notes", "mood", "difficulty"
+]
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def export_query(user_id=None, start=None, end=None, after_id=0, limit=5000):
+    query = (
+        select(
+            HabitCompletion.id,
+            HabitCompletion.habit_id,
+            Habit.user_id,
+            Habit.category,
+            HabitCompletion.completed_at,
+            HabitCompletion.notes,
+            HabitCompletion.mood,
+            HabitCompletion.difficulty,
+        )
+        .join(Habit, Habit.id == HabitCompletion.habit_id)
+        .where(HabitCompletion.id > after_id)
+        .order_by(HabitCompletion.id)
+        .limit(limit)
+    )
+    if user_id is not None:
+        query = query.where(Habit.user_id == user_id)
+    if start is not None:
+        query = query.where(HabitCompletion.completed_at >= start)
+    if end is not None:
+        query = query.where(HabitCompletion.completed_at < end)
+    return query
+
+
+def iter_completions(user_id=None, start=None, end=None, chunk_size=5000,
+                     session_factory=SessionLocal):
+    db = session_factory()
+    try:
+        archived = archive.archived_files(db, start, end)
+    finally:
+        db.close()
+    yield from archive.iter_rows(archived, user_id, start, end)
+
+    after_id = 0
+    while True:
+        db = session_factory()
+        try:
+            query = export_query(user_id, start, end, after_id, chunk_size)
+            rows = db.execute(query.execution_options(stream_results=True, yield_per=1000))
+            fetched = 0
+            for row in rows:
+                fetched += 1
+                after_id = row.id
+                yield row
+        finally:
+            db.close()
+        if fetched < chunk_size:
+            return
+
+
+def _row_values(row):
+    values = row._asdict()
+    values["completed_at"] = row.completed_at.isoformat() if row.completed_at else None
+    return values
+
+
+def to_ndjson(rows, rows_per_chunk=500):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(_row_values(row)))
+        if len(lines) >= rows_per_chunk:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def to_csv(rows, rows_per_chunk=500):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+    pending = 0
+    for row in rows:
+        writer.writerow(_row_values(row))
+        pending += 1
+        if pending >= rows_per_chunk:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue()
+
+
+def stream_export(export_format, user_id=None, start=None, end=None):
+    rows = iter_completions(user_id=user_id, start=start, end=end)
+    if export_format == "csv":
+        return to_csv(rows)
+    return to_ndjson(rows)
@@ -0,0 +1,106 @@
+"""Health probes and cached table statistics."""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from .models.database import Habit, HabitCompletion, SessionLocal, User
+
+logger = logging.getLogger(__name__)
+
+
+class TableCounts:
+    """Row counts and habit aggregates, recomputed at most every ``max_age`` seconds.
+
+    Probes read the last snapshot; when it goes stale one caller refreshes it
+    while concurrent callers keep getting the previous counts.  A failed
+    refresh keeps the last good counts and marks the snapshot ``stale``.
+    """
+
+    def __init__(self, session_factory=SessionLocal, max_age=30.0, clock=time.time):
+        self.session_factory = session_factory
+        self.max_age = max_age
+        self._clock = clock
+        self._refresh_lock = threading.Lock()
+        self._counts = None
+        self._refreshed_at = None
+        self._failed = False
+        self._refresher = None
+
+    def refresh(self):
+        db = self.session_factory()
+        try:
+            counts = {
+                "users_count": db.execute(select(func.count()).select_from(User)).scalar(),
+                "habits_count": db.execute(select(func.count()).select_from(Habit)).scalar(),
+                "completions_count": db.execute(
+                    select(func.count()).select_from(HabitCompletion)
+                ).scalar(),
+            }
+            active_habits, average_success_rate = db.execute(
+                select(func.count(), func.avg(Habit.success_rate)).where(Habit.is_active.is_(True))
+            ).one()
+            counts["active_habits_count"] = active_habits
+            counts["average_success_rate"] = float(average_success_rate or 0.0)
+        finally:
+            db.close()
+        self._counts = counts
+        self._refreshed_at = self._clock()
+
+    def _try_refresh(self):
+        try:
+            self.refresh()
+            self._failed = False
+        except SQLAlchemyError:
+            logger.warning("Refreshing table counts failed", exc_info=True)
+            self._failed = True
+
+    def _refresh_in_background(self):
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self._try_refresh()
+            finally:
+                self._refresh_lock.release()
+
+        self._refresher = threading.Thread(target=run, name="table-counts-refresh", daemon=True)
+        self._refresher.start()
+
+    def snapshot(self, background=False):
+        """The latest counts with their age; ``stale`` when the last refresh failed.
+
+        With ``background`` a due refresh runs on its own thread and this call
+        only reads the cached counts, so it never waits on the database.
+        """
+        due = self._counts is None or self._clock() - self._refreshed_at >= self.max_age
+        if due and background:
+            self._refresh_in_background()
+        elif self._counts is None:
+            with self._refresh_lock:
+                if self._counts is None:
+                    self._try_refresh()
+        elif due:
+            if self._refresh_lock.acquire(blocking=False):
+                try:
+                    self._try_refresh()
+                finally:
+                    self._refresh_lock.release()
+
+        refreshed_at = self._refreshed_at
+        if refreshed_at is None:
+            return {"stale": True, "counts_as_of": None, "counts_age_seconds": None}
+        return {
+            **self._counts,
+            "stale": self._failed,
+            "counts_as_of": datetime.fromtimestamp(refreshed_at, timezone.utc).isoformat(),
+            "counts_age_seconds": round(self._clock() - refreshed_at, 3),
+        }
+
+
+table_counts = TableCounts(max_age=float(os.getenv("HEALTH_COUNTS_MAX_AGE", "30")))
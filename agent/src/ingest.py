@@ -0,0 +1,112 @@
+"""Completion writes, grouped so many completions share one transaction.
+
+Each worker process runs its own writer.  A batch takes the database write
+lock (SQLite) or locks its habits' rows (other backends) before reading
+their stats, so writers in different processes update a habit's counters
+one after the other instead of overwriting each other.
+"""
+import os
+
+from fastapi import HTTPException
+from sqlalchemy import select
+
+from . import analytics, events, records, rollups, stats
+from .batching import BatchQueue
+from .metrics import QueryTiming, current_query_timing
+from .models.database import Habit, HabitCompletion, SessionLocal, begin_write
+
+
+def apply_completions(db, completions):
+    """Record completions in a single commit.
+
+    Returns one entry per input: the completion itself, or an
+    ``HTTPException`` for items that could not be recorded.
+    """
+    habit_ids = {completion.habit_id for completion in completions}
+    begin_write(db)
+    habits = {
+        habit.id: habit
+        for habit in db.execute(
+            # Locked in id order so concurrent batches can't deadlock
+            select(Habit).where(Habit.id.in_(habit_ids)).order_by(Habit.id).with_for_update()
+        ).scalars()
+    }
+
+    results = [
+        completion if completion.habit_id in habits
+        else HTTPException(status_code=404, detail="Habit not found")
+        for completion in completions
+    ]
+    accepted = [completion for completion in completions if completion.habit_id in habits]
+
+    # Stats rows missing so far are rebuilt from history before this batch's
+    # rows are added, so an autoflush can't count them twice
+    habit_stats = {
+        habit_id: stats.get_or_rebuild(db, habits[habit_id])
+        for habit_id in sorted({completion.habit_id for completion in accepted})
+    }
+    for completion in accepted:
+        db.add(HabitCompletion(
+            habit_id=completion.habit_id,
+            completed_at=completion.completed_at,
+            notes=completion.notes,
+            mood=completion.mood,
+            difficulty=completion.difficulty
+        ))
+
+    # Fold completions in time order so streaks are right within a batch
+    for completion in sorted(accepted, key=lambda c: stats.naive_utc(c.completed_at)):
+        stats.apply_completion(
+            habits[completion.habit_id], habit_stats[completion.habit_id], completion.completed_at
+        )
+
+    rollups.record(db, [(habits[completion.habit_id], completion) for completion in accepted])
+    db.commit()
+
+    for user_id in {habits[habit_id].user_id for habit_id in habit_stats}:
+        analytics.invalidate_user(user_id)
+    for habit_id in habit_stats:
+        records.invalidate_habit(habit_id, habits[habit_id].user_id)
+    events.broadcaster.publish_many("completion", [
+        ({
+            "habit_id": completion.habit_id,
+            "user_id": habits[completion.habit_id].user_id,
+            "completed_at": completion.completed_at,
+            "mood": completion.mood,
+            "difficulty": completion.difficulty,
+            "streak": habits[completion.habit_id].streak,
+        }, habits[completion.habit_id].user_id)
+        for completion in accepted
+    ])
+    return results
+
+
+def _write_batch(items):
+    # The writer thread serves no request of its own: time the batch's SQL
+    # and credit it to every request that waited on this batch
+    batch_timing = QueryTiming()
+    token = current_query_timing.set(batch_timing)
+    db = SessionLocal()
+    try:
+        return apply_completions(db, [completion for completion, _ in items])
+    finally:
+        db.close()
+        current_query_timing.reset(token)
+        for timing in {id(timing): timing for _, timing in items if timing is not None}.values():
+            timing.count += batch_timing.count
+            timing.seconds += batch_timing.seconds
+
+
+# Every completion, single or batched, is written here in group commits
+completion_writer = BatchQueue(
+    _write_batch,
+    max_batch_size=int(os.getenv("COMPLETION_BATCH_SIZE", "500")),
+    max_delay=float(os.getenv("COMPLETION_BATCH_DELAY_MS", "5")) / 1000,
+    name="completion-writer",
+)
+
+
+def submit_completions(completions):
+    """Queue ``completions`` for the writer; returns one future per completion."""
+    timing = current_query_timing.get()
+    return completion_writer.submit_many([(completion, timing) for completion in completions])
@@ -0,0 +1,62 @@
+"""Queries behind the keyset-paginated listing endpoints."""
+from datetime import datetime
+
+from sqlalchemy import select, tuple_
+
+from .models.database import Habit, HabitCompletion
+from .pagination import encode_cursor
+
+HABIT_FIELDS = [
+    "id", "name", "description", "frequency", "target_time", "created_at",
+    "last_completed", "streak", "success_rate", "difficulty", "category", "is_active"
+]
+COMPLETION_FIELDS = ["id", "habit_id", "completed_at", "notes", "mood", "difficulty"]
+
+
+def habits_page_query(user_id, fields, limit, after_id=None, category=None, is_active=None):
+    query = (
+        select(*(getattr(Habit, field) for field in fields))
+        .where(Habit.user_id == user_id)
+        .order_by(Habit.id)
+        .limit(limit + 1)
+    )
+    if after_id is not None:
+        query = query.where(Habit.id > after_id)
+    if category is not None:
+        query = query.where(Habit.category == category)
+    if is_active is not None:
+        query = query.where(Habit.is_active.is_(is_active))
+    return query
+
+
+def completions_page_query(habit_id, fields, limit, after=None, start=None, end=None):
+    # Newest first; (completed_at, id) breaks ties between equal timestamps
+    query = (
+        select(*(getattr(HabitCompletion, field) for field in fields))
+        .where(HabitCompletion.habit_id == habit_id)
+        .order_by(HabitCompletion.completed_at.desc(), HabitCompletion.id.desc())
+        .limit(limit + 1)
+    )
+    if after is not None:
+        completed_at, completion_id = after
+        query = query.where(
+            tuple_(HabitCompletion.completed_at, HabitCompletion.id)
+            < tuple_(datetime.fromisoformat(completed_at), completion_id)
+        )
+    if start is not None:
+        query = query.where(HabitCompletion.completed_at >= start)
+    if end is not None:
+        query = query.where(HabitCompletion.completed_at < end)
+    return query
+
+
+def build_page(rows, limit, fields, cursor_key):
+    """Turn ``limit + 1`` fetched rows into a page and the cursor for the next one."""
+    items = [row._asdict() for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor(*cursor_key(rows[limit - 1]))
+    return {
+        "items": [{field: item[field] for field in fields} for item in items],
+        "next_cursor": next_cursor
+    }
@@ -0,0 +1,390 @@
+"""Open-loop HTTP load generator for the agent.
+
+Requests are started on a fixed schedule (``rate`` per second) whatever the
+agent's response times, so an overloaded agent shows up as rising latency
+and dropped arrivals instead of quietly lowering the offered load.  Latency
+is measured from each request's *scheduled* start, which keeps client-side
+queueing in the numbers.  ``concurrency`` caps requests in flight (and the
+HTTP connection pool); arrivals beyond it are counted as dropped.
+
+    python -m src.loadgen --rate 500 --concurrency 200 --duration 60
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+AGENT_URL = os.getenv("AGENT_URL", "http://agent:8000")
+
+# Relative weights of each operation in the request mix
+DEFAULT_MIX = {
+    "get_habit": 35,
+    "get_user": 15,
+    "list_habits": 10,
+    "complete": 25,
+    "create_habit": 5,
+    "analytics": 8,
+    "timeseries": 2,
+}
+CATEGORIES = ["health", "work", "personal", "learning"]
+PERCENTILES = [50, 90, 95, 99]
+
+
+class LoadConfig:
+    def __init__(self, rate=50.0, concurrency=100, duration=None, mix=None,
+                 users=50, habits_per_user=3, timeout=10.0, seed=None):
+        if rate <= 0 or concurrency <= 0:
+            raise ValueError("rate and concurrency must be positive")
+        if users < 1 or habits_per_user < 1:
+            raise ValueError("the workload needs at least one user and one habit per user")
+        self.rate = float(rate)
+        self.concurrency = int(concurrency)
+        self.duration = duration
+        self.mix = {name: weight for name, weight in (mix or DEFAULT_MIX).items() if weight > 0}
+        unknown = set(self.mix) - set(DEFAULT_MIX)
+        if unknown or not self.mix:
+            raise ValueError(f"Invalid request mix: {sorted(unknown) or 'empty'}")
+        self.users = users
+        self.habits_per_user = habits_per_user
+        self.timeout = timeout
+        self.seed = seed
+
+    def as_dict(self):
+        return {
+            "rate": self.rate, "concurrency": self.concurrency, "duration": self.duration,
+            "mix": self.mix, "users": self.users, "habits_per_user": self.habits_per_user,
+        }
+
+
+def _percentiles(latencies):
+    if not latencies:
+        return {}
+    ordered = sorted(latencies)
+    last = len(ordered) - 1
+    return {
+        f"p{p}": round(ordered[min(last, int(round(p / 100 * last)))] * 1000, 2)
+        for p in PERCENTILES
+    }
+
+
+class LoadStats:
+    """Totals since start plus a sliding window for live throughput and percentiles."""
+
+    def __init__(self, window=10.0, clock=time.monotonic):
+        self.window = window
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = self._clock()
+            self.sent = 0
+            self.completed = 0
+            self.errors = 0
+            self.dropped = 0
+            self.in_flight = 0
+            self._recent = deque()
+            self._status_counts = {}
+
+    def started(self):
+        with self._lock:
+            self.sent += 1
+            self.in_flight += 1
+
+    def drop(self):
+        with self._lock:
+            self.dropped += 1
+
+    def finished(self, operation, latency, status):
+        now = self._clock()
+        ok = status is not None and status < 400
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+            if not ok:
+                self.errors += 1
+            key = str(status) if status is not None else "error"
+            self._status_counts[key] = self._status_counts.get(key, 0) + 1
+            self._recent.append((now, operation, latency, ok))
+            self._expire(now)
+
+    def _expire(self, now):
+        horizon = now - self.window
+        while self._recent and self._recent[0][0] < horizon:
+            self._recent.popleft()
+
+    def snapshot(self):
+        now = self._clock()
+        with self._lock:
+            self._expire(now)
+            recent = list(self._recent)
+            totals = {
+                "sent": self.sent, "completed": self.completed, "errors": self.errors,
+                "dropped": self.dropped, "in_flight": self.in_flight,
+                "status_codes": dict(self._status_counts),
+            }
+            elapsed = now - self.started_at
+
+        span = min(self.window, elapsed) or 1.0
+        by_operation = {}
+        for _, operation, latency, ok in recent:
+            entry = by_operation.setdefault(operation, {"latencies": [], "errors": 0})
+            entry["latencies"].append(latency)
+            entry["errors"] += not ok
+        return {
+            "elapsed_seconds": round(elapsed, 1),
+            "window_seconds": self.window,
+            "throughput_rps": round(len(recent) / span, 1),
+            "error_rate": round(sum(not ok for *_, ok in recent) / len(recent), 4) if recent else 0.0,
+            "latency_ms": _percentiles([latency for _, _, latency, _ in recent]),
+            "operations": {
+                operation: {
+                    "rps": round(len(entry["latencies"]) / span, 1),
+                    "errors": entry["errors"],
+                    "latency_ms": _percentiles(entry["latencies"]),
+                }
+                for operation, entry in sorted(by_operation.items())
+            },
+            **totals,
+        }
+
+
+class Workload:
+    """Users and habits created on the agent, and the requests that exercise them."""
+
+    def __init__(self, rng, templates=None):
+        self.rng = rng
+        self.templates = templates or []
+        self.user_ids = []
+        self.habit_ids = []
+        self.habit_owner = {}
+
+    def _habit_payload(self, user_id):
+        template = self.rng.choice(self.templates) if self.templates else {}
+        days_ago = self.rng.randint(0, 60)
+        return {
+            "id": f"load-{uuid.uuid4()}",
+            "name": template.get("name", "Load habit"),
+            "description": template.get("description", "Created by the load generator"),
+            "frequency": "daily",
+            "target_time": f"{self.rng.randint(6, 21):02d}:00:00",
+            "created_at": (datetime.now(timezone.utc) - timedelta(days=days_ago)).isoformat(),
+            "difficulty": template.get("difficulty", self.rng.randint(1, 5)),
+            "category": template.get("category", self.rng.choice(CATEGORIES)),
+        }
+
+    async def create_user(self, client):
+        user_id = f"load-{uuid.uuid4()}"
+        response = await client.post("/users/", json={
+            "id": user_id, "name": "Load user", "habits": [],
+            "preferred_notification_time": "09:00:00", "timezone": "UTC",
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        })
+        response.raise_for_status()
+        self.user_ids.append(user_id)
+        return user_id
+
+    async def create_habit(self, client, user_id=None):
+        user_id = user_id or self.rng.choice(self.user_ids)
+        payload = self._habit_payload(user_id)
+        response = await client.post("/habits/", params={"user_id": user_id}, json=payload)
+        if response.status_code == 200:
+            self.habit_ids.append(payload["id"])
+            self.habit_owner[payload["id"]] = user_id
+        return response
+
+    async def seed(self, client, users, habits_per_user):
+        for _ in range(users):
+            user_id = await self.create_user(client)
+            for _ in range(habits_per_user):
+                (await self.create_habit(client, user_id)).raise_for_status()
+
+    def request(self, client, operation):
+        """Coroutine performing one request of the given kind."""
+        if operation == "create_habit":
+            return self.create_habit(client)
+        habit_id = self.rng.choice(self.habit_ids)
+        user_id = self.habit_owner[habit_id]
+        if operation == "get_habit":
+            return client.get(f"/habits/{habit_id}")
+        if operation == "get_user":
+            return client.get(f"/users/{user_id}")
+        if operation == "list_habits":
+            return client.get(f"/users/{user_id}/habits", params={"limit": 20})
+        if operation == "complete":
+            return client.post("/completions/", json={
+                "habit_id": habit_id,
+                "completed_at": datetime.now(timezone.utc).isoformat(),
+                "mood": self.rng.randint(1, 5),
+                "difficulty": self.rng.randint(1, 5),
+            })
+        if operation == "analytics":
+            return client.get(f"/analytics/{user_id}")
+        if operation == "timeseries":
+            return client.get(f"/analytics/{user_id}/timeseries", params={"granularity": "day"})
+        raise ValueError(f"Unknown operation: {operation}")
+
+
+async def run_load(config, stats, stop_event=None, base_url=AGENT_URL, transport=None,
+                   templates=None, report=None):
+    """Drive the agent at ``config.rate`` requests/s until stopped or ``duration`` elapses."""
+    rng = random.Random(config.seed)
+    workload = Workload(rng, templates)
+    operations = list(config.mix)
+    weights = [config.mix[name] for name in operations]
+    limits = httpx.Limits(
+        max_connections=config.concurrency, max_keepalive_connections=config.concurrency
+    )
+    stop_event = stop_event or asyncio.Event()
+
+    async with httpx.AsyncClient(
+        base_url=base_url, transport=transport, limits=limits, timeout=config.timeout
+    ) as client:
+        await workload.seed(client, config.users, config.habits_per_user)
+        if report:
+            report(f"Seeded {len(workload.user_ids)} users and {len(workload.habit_ids)} habits")
+        stats.reset()
+
+        tasks = set()
+
+        async def fire(operation, scheduled_at):
+            status = None
+            try:
+                status = (await workload.request(client, operation)).status_code
+            except Exception:
+                # Timeouts, resets and the like count as errors without stopping the run
+                pass
+            finally:
+                stats.finished(operation, time.monotonic() - scheduled_at, status)
+
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        interval = 1.0 / config.rate
+        arrival = 0
+        while not stop_event.is_set():
+            scheduled_at = started + arrival * interval
+            if config.duration is not None and scheduled_at - started >= config.duration:
+                break
+            delay = scheduled_at - time.monotonic()
+            if delay > 0:
+                # Wake early for the stop signal instead of sleeping through it
+                try:
+                    await asyncio.wait_for(stop_event.wait(), delay)
+                    break
+                except asyncio.TimeoutError:
+                    pass
+            arrival += 1
+            if len(tasks) >= config.concurrency:
+                stats.drop()
+                continue
+            stats.started()
+            task = loop.create_task(fire(rng.choices(operations, weights)[0], scheduled_at))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.gather(*tasks)
+    return stats.snapshot()
+
+
+class LoadGenerator:
+    """Runs ``run_load`` on its own event loop thread so sync callers (Flask) can control it."""
+
+    def __init__(self, base_url=AGENT_URL, report=None, window=10.0):
+        self.base_url = base_url
+        self.report = report
+        self.stats = LoadStats(window=window)
+        self.config = None
+        self.last_error = None
+        self._thread = None
+        self._loop = None
+        self._stop_event = None
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, config, templates=None):
+        if self.is_running:
+            raise RuntimeError("Load generator is already running")
+        self.config = config
+        self.last_error = None
+        self.stats.reset()
+        ready = threading.Event()
+
+        def target():
+            self._loop = asyncio.new_event_loop()
+            self._stop_event = asyncio.Event()
+            ready.set()
+            try:
+                self._loop.run_until_complete(run_load(
+                    config, self.stats, self._stop_event, base_url=self.base_url,
+                    templates=templates, report=self.report
+                ))
+            except Exception as exc:
+                self.last_error = f"{type(exc).__name__}: {exc}"
+                if self.report:
+                    self.report(f"Load generator failed: {self.last_error}")
+            finally:
+                self._loop.close()
+
+        self._thread = threading.Thread(target=target, name="load-generator", daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    def stop(self, timeout=30.0):
+        if not self.is_running:
+            return
+        self._loop.call_soon_threadsafe(self._stop_event.set)
+        self._thread.join(timeout)
+
+    def snapshot(self):
+        return {
+            "is_running": self.is_running,
+            "config": self.config.as_dict() if self.config else None,
+            "error": self.last_error,
+            **self.stats.snapshot(),
+        }
+
+
+def _parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Open-loop load generator for the agent")
+    parser.add_argument("--url", default=AGENT_URL)
+    parser.add_argument("--rate", type=float, default=100.0, help="Requests started per second")
+    parser.add_argument("--concurrency", type=int, default=100, help="Maximum requests in flight")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run")
+    parser.add_argument("--mix", type=_parse_mix, default=None,
+                        help="Operation weights, e.g. get_habit=50,complete=50")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--habits-per-user", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    config = LoadConfig(
+        rate=args.rate, concurrency=args.concurrency, duration=args.duration, mix=args.mix,
+        users=args.users, habits_per_user=args.habits_per_user, seed=args.seed
+    )
+    stats = LoadStats(window=args.duration)
+    snapshot = asyncio.run(run_load(config, stats, base_url=args.url, report=print))
+    print(json.dumps(snapshot, indent=2))
+
+
+if __name__ == "__main__":
+    main()
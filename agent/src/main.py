@@ -1,24 +1,50 @@
-from fastapi import FastAPI, HTTPException, Depends
-from prometheus_client import make_asgi_app, Counter, Histogram, Gauge
+from contextlib import asynccontextmanager
+import anyio
+from fastapi import FastAPI, HTTPException, Depends, Header, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from prometheus_client import make_asgi_app
+import asyncio
+import os
 import time
-from datetime import datetime, time as dt_time
+from datetime import date, datetime, time as dt_time
 from typing import List, Optional
-import numpy as np
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
-from .models.database import User, Habit, HabitCompletion, get_db
+from .models.database import User, Habit, engine, get_db, init_db, POOL_SIZE, MAX_OVERFLOW
 from .models.habit import Habit as HabitModel, HabitCompletion as HabitCompletionModel, UserProfile
+from . import analytics, events, export, listing, motivation, recommendations, records, reminders, rollups
+from .health import table_counts
+from .ingest import submit_completions
+from .pagination import decode_cursor, parse_fields
+from .responses import conditional_response, json_bytes_response
+from .metrics import request_counter, request_latency, instrument_engine, metrics_registry, PrometheusMiddleware
 
-app = FastAPI(title="Habit Wizard Agent")
+# Endpoints that touch the database are plain `def` functions, which FastAPI
+# runs in a worker threadpool so blocking queries never stall the event loop.
+# Size that pool to the connection pool so threads don't queue for connections.
+DB_THREADPOOL_SIZE = int(os.getenv("DB_THREADPOOL_SIZE", str(POOL_SIZE + MAX_OVERFLOW)))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    anyio.to_thread.current_default_thread_limiter().total_tokens = DB_THREADPOOL_SIZE
+    init_db()
+    yield
+
+app = FastAPI(
+    title="Habit Wizard Agent",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
+)
+app.add_middleware(PrometheusMiddleware)
+instrument_engine(engine)
 
 # Add prometheus asgi middleware to route /metrics requests
-metrics_app = make_asgi_app()
+metrics_app = make_asgi_app(registry=metrics_registry(table_counts))
 app.mount("/metrics", metrics_app)
 
-# Define metrics
-request_counter = Counter('agent_requests_total', 'Total number of requests')
-request_latency = Histogram('agent_request_latency_seconds', 'Request latency in seconds')
-active_habits = Gauge('active_habits_total', 'Number of active habits')
-habit_completion_rate = Gauge('habit_completion_rate', 'Average habit completion rate')
+MAX_COMPLETION_BATCH = int(os.getenv("MAX_COMPLETION_BATCH", "5000"))
 
 @app.get("/")
 async def root():
@@ -36,7 +62,7 @@ async def root():
         }
 
 @app.post("/users/", response_model=UserProfile)
-async def create_user(user: UserProfile, db: Session = Depends(get_db)):
+def create_user(user: UserProfile, db: Session = Depends(get_db)):
     db_user = User(
         id=user.id,
         name=user.name,
@@ -45,23 +71,25 @@ async def create_user(user: UserProfile, db: Session = Depends(get_db)):
         created_at=user.created_at
     )
     db.add(db_user)
+    reminders.record_change(db, user.id)
     db.commit()
     db.refresh(db_user)
+    records.invalidate_user(user.id)
     return user
 
 @app.get("/users/{user_id}", response_model=UserProfile)
-async def get_user(user_id: str, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.id == user_id).first()
-    if not db_user:
+def get_user(
+    user_id: str,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    cached = records.get_user(db, user_id)
+    if cached is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return UserProfile(
-        id=db_user.id,
-        name=db_user.name,
-        email=db_user.email
-    )
+    return conditional_response(*cached, if_none_match)
 
 @app.post("/habits/", response_model=HabitModel)
-async def create_habit(habit: HabitModel, user_id: str, db: Session = Depends(get_db)):
+def create_habit(habit: HabitModel, user_id: str, db: Session = Depends(get_db)):
     db_user = db.query(User).filter(User.id == user_id).first()
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -73,116 +101,234 @@ async def create_habit(habit: HabitModel, user_id: str, db: Session = Depends(ge
         description=habit.description,
         frequency=habit.frequency,
         target_time=habit.target_time,
+        created_at=habit.created_at,
         difficulty=habit.difficulty,
         category=habit.category
     )
     db.add(db_habit)
+    reminders.record_change(db, user_id)
     db.commit()
     db.refresh(db_habit)
+    analytics.invalidate_user(user_id)
+    records.invalidate_habit(habit.id, user_id)
+    events.broadcaster.publish("habit", {
+        "id": habit.id, "user_id": user_id, "name": habit.name,
+        "category": habit.category, "difficulty": habit.difficulty,
+    }, key=user_id)
     
-    active_habits.inc()
     return habit
 
 @app.get("/habits/{habit_id}", response_model=HabitModel)
-async def get_habit(habit_id: str, db: Session = Depends(get_db)):
-    db_habit = db.query(Habit).filter(Habit.id == habit_id).first()
-    if not db_habit:
+def get_habit(
+    habit_id: str,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    cached = records.get_habit(db, habit_id)
+    if cached is None:
         raise HTTPException(status_code=404, detail="Habit not found")
-    
-    return HabitModel(
-        id=db_habit.id,
-        name=db_habit.name,
-        description=db_habit.description,
-        frequency=db_habit.frequency,
-        target_time=db_habit.target_time,
-        created_at=db_habit.created_at,
-        difficulty=db_habit.difficulty,
-        category=db_habit.category
-    )
+    return conditional_response(*cached, if_none_match)
 
 @app.post("/completions/", response_model=HabitCompletionModel)
-async def record_completion(completion: HabitCompletionModel, db: Session = Depends(get_db)):
-    db_habit = db.query(Habit).filter(Habit.id == completion.habit_id).first()
-    if not db_habit:
-        raise HTTPException(status_code=404, detail="Habit not found")
+async def record_completion(completion: HabitCompletionModel):
+    # Concurrent requests are group-committed by the completion writer
+    return await asyncio.wrap_future(submit_completions([completion])[0])
+
+@app.post("/completions/batch")
+async def record_completions_batch(completions: List[HabitCompletionModel]):
+    if len(completions) > MAX_COMPLETION_BATCH:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch exceeds {MAX_COMPLETION_BATCH} completions"
+        )
     
-    db_completion = HabitCompletion(
-        habit_id=completion.habit_id,
-        completed_at=completion.completed_at,
-        notes=completion.notes,
-        mood=completion.mood,
-        difficulty=completion.difficulty
+    # The completion writer is the only thread that folds completions into
+    # habit stats, so batches and single completions never race on them.
+    # A large batch spans several writer transactions, some of which may
+    # already have committed when another fails, so every failure is
+    # reported against its own items rather than failing the request.
+    outcomes = await asyncio.gather(
+        *(asyncio.wrap_future(future) for future in submit_completions(completions)),
+        return_exceptions=True
     )
-    db.add(db_completion)
-    
-    # Update habit stats
-    db_habit.last_completed = completion.completed_at
-    db_habit.streak += 1
-    
-    # Update success rate
-    total_completions = db.query(HabitCompletion).filter(
-        HabitCompletion.habit_id == completion.habit_id
-    ).count()
-    db_habit.success_rate = total_completions / 30  # Assuming 30-day window
+    results = []
+    for index, result in enumerate(outcomes):
+        if isinstance(result, HTTPException):
+            results.append({"index": index, "status": result.status_code, "detail": result.detail})
+        elif isinstance(result, Exception):
+            results.append({"index": index, "status": 503, "detail": "Completion could not be recorded, retry"})
+        else:
+            results.append({"index": index, "status": 200, "completion": result})
     
-    db.commit()
-    db.refresh(db_completion)
-    
-    # Update metrics
-    habit_completion_rate.set(db_habit.success_rate)
-    
-    return completion
+    accepted = sum(1 for result in results if result["status"] == 200)
+    return {
+        "accepted": accepted,
+        "failed": len(results) - accepted,
+        "results": results
+    }
+
+@app.get("/events/stream")
+async def stream_events(
+    user_id: Optional[str] = None,
+    last_event_id: Optional[str] = Header(None)
+):
+    # Server-sent completion and habit events, optionally for one user
+    try:
+        subscription = events.broadcaster.subscribe(
+            events.parse_last_event_id(last_event_id), key=user_id
+        )
+    except events.TooManySubscribers:
+        raise HTTPException(status_code=503, detail="Too many event stream subscribers")
+    return StreamingResponse(
+        subscription.astream(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.get("/analytics/{user_id}")
-async def get_user_analytics(user_id: str, db: Session = Depends(get_db)):
-    # Get all habits for the user
-    user_habits = db.query(Habit).filter(Habit.user_id == user_id).all()
-    total_habits = len(user_habits)
-    
-    if total_habits == 0:
-        return {
-            "total_habits": 0,
-            "average_success_rate": 0.0,
-            "total_streaks": 0,
-            "habits_by_category": {}
-        }
+def get_user_analytics(user_id: str, db: Session = Depends(get_db)):
+    return json_bytes_response(analytics.get_user_analytics_json(db, user_id))
 
-    # Calculate success rate
-    total_completions = sum(
-        db.query(HabitCompletion).filter(
-            HabitCompletion.habit_id.in_([h.id for h in user_habits])
-        ).count()
-    )
-    success_rate = (total_completions / (total_habits * 30)) * 100 if total_habits > 0 else 0.0
-    
-    # Count streaks
-    total_streaks = sum(h.streak for h in user_habits)
+@app.get("/users/{user_id}/habits")
+def list_user_habits(
+    user_id: str,
+    category: Optional[str] = None,
+    is_active: Optional[bool] = None,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    if db.get(User, user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
     
-    # Group habits by category
-    habits_by_category = {}
-    for habit in user_habits:
-        if habit.category not in habits_by_category:
-            habits_by_category[habit.category] = 0
-        habits_by_category[habit.category] += 1
+    selected = parse_fields(fields, listing.HABIT_FIELDS)
+    # The sort key is always fetched so the next cursor can be built
+    columns = list(dict.fromkeys(["id", *selected]))
+    after_id = decode_cursor(cursor, 1)[0] if cursor else None
+    rows = db.execute(listing.habits_page_query(
+        user_id, columns, limit, after_id=after_id, category=category, is_active=is_active
+    )).all()
+    return listing.build_page(rows, limit, selected, lambda row: (row.id,))
+
+@app.get("/habits/{habit_id}/completions")
+def list_habit_completions(
+    habit_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    if db.get(Habit, habit_id) is None:
+        raise HTTPException(status_code=404, detail="Habit not found")
     
-    return {
-        "total_habits": total_habits,
-        "average_success_rate": float(success_rate),
-        "total_streaks": total_streaks,
-        "habits_by_category": habits_by_category
-    }
+    selected = parse_fields(fields, listing.COMPLETION_FIELDS)
+    columns = list(dict.fromkeys(["completed_at", "id", *selected]))
+    after = decode_cursor(cursor, 2) if cursor else None
+    try:
+        query = listing.completions_page_query(
+            habit_id, columns, limit, after=after, start=start, end=end
+        )
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    rows = db.execute(query).all()
+    return listing.build_page(
+        rows, limit, selected, lambda row: (row.completed_at.isoformat(), row.id)
+    )
+
+@app.get("/users/{user_id}/notification-time")
+def get_notification_time(user_id: str, db: Session = Depends(get_db)):
+    # Precomputed by `python -m src.recommendations refresh`; a primary-key read
+    recommendation = recommendations.get_recommendation(db, user_id)
+    if recommendation is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return recommendation
+
+@app.get("/habits/{habit_id}/motivation")
+async def get_motivation(
+    habit_id: str,
+    service: motivation.MotivationService = Depends(motivation.get_motivation_service)
+):
+    # No pooled connection is held while awaiting the model
+    prompt = await run_in_threadpool(motivation.load_habit_prompt, habit_id)
+    if prompt is None:
+        raise HTTPException(status_code=404, detail="Habit not found")
+    # Generation happens on the batcher thread, batched with concurrent requests
+    try:
+        message = await asyncio.wrap_future(service.submit(prompt))
+    except motivation.ModelUnavailable as exc:
+        raise HTTPException(status_code=503, detail=str(exc))
+    return {"habit_id": habit_id, "message": message}
+
+def _export_response(export_format, filename, **filters):
+    return StreamingResponse(
+        export.stream_export(export_format, **filters),
+        media_type=export.MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{export_format}"'}
+    )
+
+@app.get("/users/{user_id}/completions/export")
+def export_user_completions(
+    user_id: str,
+    export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+):
+    return _export_response(
+        export_format, f"completions-{user_id}", user_id=user_id, start=start, end=end
+    )
+
+@app.get("/admin/completions/export")
+def export_all_completions(
+    export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+):
+    return _export_response(export_format, "completions", start=start, end=end)
+
+@app.get("/analytics/{user_id}/timeseries")
+def get_user_timeseries(
+    user_id: str,
+    granularity: str = Query("day", pattern="^(day|week)$"),
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    category: Optional[str] = None,
+    habit_id: Optional[str] = None,
+    by_category: bool = False,
+    db: Session = Depends(get_db)
+):
+    return rollups.get_timeseries(
+        db, user_id, granularity, by_category=by_category,
+        start=start, end=end, category=category, habit_id=habit_id
+    )
+
+@app.get("/admin/analytics/cohort")
+def get_cohort_analytics(max_weeks: int = Query(12, ge=1, le=104)):
+    # numpy/pandas are only loaded by the processes that serve this endpoint
+    from . import cohort
+    return cohort.get_cohort_analytics(max_weeks=max_weeks)
+
+@app.get("/health/live")
+async def liveness():
+    # Answers as long as the process serves requests; never touches the DB
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+def readiness(db: Session = Depends(get_db)):
+    try:
+        db.execute(text("SELECT 1"))
+    except SQLAlchemyError:
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    return {"status": "ready"}
 
 @app.get("/health")
-async def health_check(db: Session = Depends(get_db)):
-    users_count = db.query(User).count()
-    habits_count = db.query(Habit).count()
-    completions_count = db.query(HabitCompletion).count()
-    
+def health_check():
+    # Counts that couldn't be refreshed are served as they were, with their age
+    snapshot = table_counts.snapshot()
     return {
-        "status": "healthy",
-        "users_count": users_count,
-        "habits_count": habits_count,
-        "completions_count": completions_count
+        "status": "degraded" if snapshot["stale"] else "healthy",
+        **snapshot
     }
 
 if __name__ == "__main__":
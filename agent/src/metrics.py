@@ -0,0 +1,166 @@
+import os
+from contextvars import ContextVar
+from time import perf_counter
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, Gauge, REGISTRY, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event
+
+request_counter = Counter('agent_requests_total', 'Total number of requests')
+request_latency = Histogram('agent_request_latency_seconds', 'Request latency in seconds')
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+http_request_duration = Histogram(
+    'agent_http_request_duration_seconds',
+    'HTTP request latency by route template, method and status',
+    ['route', 'method', 'status'],
+    buckets=LATENCY_BUCKETS
+)
+http_requests_in_flight = Gauge(
+    'agent_http_requests_in_flight',
+    'HTTP requests currently being served',
+    multiprocess_mode='livesum'
+)
+db_query_duration = Histogram(
+    'agent_db_query_duration_seconds',
+    'Duration of individual SQL statements',
+    buckets=LATENCY_BUCKETS
+)
+db_queries_per_request = Histogram(
+    'agent_db_queries_per_request',
+    'Number of SQL statements executed while serving a request',
+    ['route'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+)
+db_time_per_request = Histogram(
+    'agent_db_time_per_request_seconds',
+    'Total SQL time spent while serving a request',
+    ['route'],
+    buckets=LATENCY_BUCKETS
+)
+
+
+class QueryTiming:
+    __slots__ = ('count', 'seconds')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+# Set per request by PrometheusMiddleware; threadpool workers inherit a copy
+# of the context, so they update the same QueryTiming object
+current_query_timing = ContextVar('current_query_timing', default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    elapsed = perf_counter() - started
+    db_query_duration.observe(elapsed)
+    timing = current_query_timing.get()
+    if timing is not None:
+        timing.count += 1
+        timing.seconds += elapsed
+
+
+def instrument_engine(engine):
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def _route_label(scope):
+    route = scope.get('route')
+    if route is not None:
+        return route.path
+    if 'endpoint' in scope:
+        # Mounted sub-applications such as /metrics
+        return scope.get('root_path') or '/'
+    return '<unmatched>'
+
+
+class PrometheusMiddleware:
+    """Records latency, in-flight requests and SQL usage per route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        timing = QueryTiming()
+        token = current_query_timing.set(timing)
+        http_requests_in_flight.inc()
+        started = perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = perf_counter() - started
+            http_requests_in_flight.dec()
+            current_query_timing.reset(token)
+
+            route = _route_label(scope)
+            http_request_duration.labels(route, scope['method'], str(status_code)).observe(elapsed)
+            db_queries_per_request.labels(route).observe(timing.count)
+            db_time_per_request.labels(route).observe(timing.seconds)
+
+
+class HabitStatsCollector:
+    """Exposes habit gauges computed from the database rather than process memory.
+
+    In-memory gauges drift as soon as several workers serve writes, so these
+    values come from the cached ``TableCounts`` snapshot at scrape time.
+    Scrapes are served on the event loop, so a due refresh of that snapshot
+    runs in the background and the scrape reports the previous counts.
+    """
+
+    def __init__(self, table_counts):
+        self.table_counts = table_counts
+
+    def _families(self, snapshot):
+        return [
+            GaugeMetricFamily(
+                'active_habits_total', 'Number of active habits',
+                value=snapshot['active_habits_count']
+            ),
+            GaugeMetricFamily(
+                'habit_completion_rate', 'Average habit completion rate across active habits',
+                value=snapshot['average_success_rate']
+            ),
+        ]
+
+    def describe(self):
+        # Lets the registry check metric names without querying the database
+        return self._families({'active_habits_count': 0, 'average_success_rate': 0.0})
+
+    def collect(self):
+        snapshot = self.table_counts.snapshot(background=True)
+        if 'active_habits_count' not in snapshot:
+            # The database hasn't answered yet; report no gauges
+            return []
+        return self._families(snapshot)
+
+
+def metrics_registry(table_counts):
+    """Registry to scrape: merges all workers' samples when PROMETHEUS_MULTIPROC_DIR is set."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    registry.register(HabitStatsCollector(table_counts))
+    return registry
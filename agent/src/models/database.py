@@ -1,14 +1,69 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey, Boolean, Time
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy import create_engine, event, Index, Column, Integer, String, Float, Date, DateTime, ForeignKey, Boolean, Time
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import declarative_base, sessionmaker, relationship
+from sqlalchemy.pool import StaticPool
 from datetime import datetime
 import os
 
-# Create database directory if it doesn't exist
-os.makedirs('/app/data', exist_ok=True)
+DEFAULT_DATABASE_URL = 'sqlite:////app/data/habits.db'
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '20'))
 
-# Create SQLite engine
-engine = create_engine('sqlite:////app/data/habits.db')
+def get_database_url():
+    return os.getenv('DATABASE_URL', DEFAULT_DATABASE_URL)
+
+def _is_memory_sqlite(url):
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+def _sqlite_pragmas(busy_timeout_ms):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # WAL lets readers run alongside the single writer instead of
+        # failing with "database is locked"
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute(f'PRAGMA busy_timeout={busy_timeout_ms}')
+        cursor.close()
+    return set_pragmas
+
+def build_engine(url=None, **overrides):
+    """Create an engine for `url` (default: $DATABASE_URL) with tuned pooling.
+
+    SQLite gets WAL journaling, synchronous=NORMAL and a busy timeout; any
+    other backend (e.g. postgresql+psycopg://...) gets a pre-pinged,
+    recycled connection pool.
+    """
+    url = make_url(url or get_database_url())
+    options = {'echo': os.getenv('DB_ECHO', '').lower() in ('1', 'true')}
+
+    if url.get_backend_name() == 'sqlite':
+        busy_timeout_ms = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+        options['connect_args'] = {
+            'check_same_thread': False,
+            'timeout': busy_timeout_ms / 1000,
+        }
+        if _is_memory_sqlite(url):
+            # Every connection to :memory: is a new database, so share one
+            options['poolclass'] = StaticPool
+        else:
+            options['pool_size'] = POOL_SIZE
+            options['max_overflow'] = MAX_OVERFLOW
+            options['pool_timeout'] = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+    else:
+        options['pool_size'] = POOL_SIZE
+        options['max_overflow'] = MAX_OVERFLOW
+        options['pool_timeout'] = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+        options['pool_recycle'] = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+        options['pool_pre_ping'] = True
+
+    options.update(overrides)
+    engine = create_engine(url, **options)
+    if url.get_backend_name() == 'sqlite' and not _is_memory_sqlite(url):
+        event.listen(engine, 'connect', _sqlite_pragmas(busy_timeout_ms))
+    return engine
+
+# Engines connect lazily, so importing this module touches neither disk nor DB
+engine = build_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -42,6 +97,13 @@ class Habit(Base):
     user = relationship("User", back_populates="habits")
     completions = relationship("HabitCompletion", back_populates="habit")
 
+    __table_args__ = (
+        # Per-user habit lookups and the analytics GROUP BY category
+        Index("ix_habits_user_active_category", "user_id", "is_active", "category"),
+        # Keyset-paginated listing of a user's habits
+        Index("ix_habits_user_id_id", "user_id", "id"),
+    )
+
 class HabitCompletion(Base):
     __tablename__ = "habit_completions"
     
@@ -54,8 +116,156 @@ class HabitCompletion(Base):
     
     habit = relationship("Habit", back_populates="completions")
 
-# Create all tables
-Base.metadata.create_all(bind=engine)
+    __table_args__ = (
+        # Completion counts and date-range reads for one habit
+        Index("ix_habit_completions_habit_completed", "habit_id", "completed_at"),
+        # Global date-range scans (exports, archival)
+        Index("ix_habit_completions_completed_at", "completed_at"),
+    )
+
+class HabitStats(Base):
+    __tablename__ = "habit_stats"
+
+    habit_id = Column(String, ForeignKey("habits.id"), primary_key=True)
+    # Completion counts per day for the rolling window, newest day (window_end) first
+    day_buckets = Column(String, default="")
+    window_end = Column(Date, nullable=True)
+    last_completed_day = Column(Date, nullable=True)
+
+class DailyRollup(Base):
+    __tablename__ = "completion_daily_rollups"
+
+    user_id = Column(String, primary_key=True)
+    habit_id = Column(String, ForeignKey("habits.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    category = Column(String)
+    completions = Column(Integer, default=0)
+    mood_sum = Column(Integer, default=0)
+    mood_count = Column(Integer, default=0)
+    difficulty_sum = Column(Integer, default=0)
+    difficulty_count = Column(Integer, default=0)
+
+    __table_args__ = (
+        Index("ix_completion_daily_rollups_user_day", "user_id", "day"),
+    )
+
+class WeeklyRollup(Base):
+    __tablename__ = "completion_weekly_rollups"
+
+    user_id = Column(String, primary_key=True)
+    habit_id = Column(String, ForeignKey("habits.id"), primary_key=True)
+    # Monday of the ISO week
+    week_start = Column(Date, primary_key=True)
+    category = Column(String)
+    completions = Column(Integer, default=0)
+    mood_sum = Column(Integer, default=0)
+    mood_count = Column(Integer, default=0)
+    difficulty_sum = Column(Integer, default=0)
+    difficulty_count = Column(Integer, default=0)
+
+    __table_args__ = (
+        Index("ix_completion_weekly_rollups_user_week", "user_id", "week_start"),
+    )
+
+class NotificationRecommendation(Base):
+    __tablename__ = "notification_recommendations"
+
+    user_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    # Local time of day in the user's timezone
+    recommended_time = Column(Time)
+    # Share of the user's weighted completions within an hour of the peak
+    confidence = Column(Float)
+    completions_used = Column(Integer)
+    computed_at = Column(DateTime, default=datetime.utcnow)
+
+class RecommendationRun(Base):
+    __tablename__ = "recommendation_runs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    started_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+    full = Column(Boolean, default=False)
+    # Highest habit_completions.id seen; the next run refreshes users with newer rows
+    completion_watermark = Column(Integer, default=0)
+    users_refreshed = Column(Integer, default=0)
+    # Population time-of-day density per 15-minute slot, comma-separated
+    global_density = Column(String, default="")
+    global_time = Column(Time, nullable=True)
+
+class ReminderCheckpoint(Base):
+    __tablename__ = "reminder_checkpoints"
+
+    name = Column(String, primary_key=True)
+    # Last reminder delivered, in dispatch order (fire time, then user id)
+    fired_at = Column(DateTime)
+    user_id = Column(String)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class ReminderChange(Base):
+    __tablename__ = "reminder_changes"
+
+    # The reminder scheduler reads rows past the highest id it has seen
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(String)
+    changed_at = Column(DateTime, default=datetime.utcnow)
+
+class CompletionArchive(Base):
+    __tablename__ = "completion_archives"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # First day of the month the file's completions fall in
+    month = Column(Date)
+    # Relative to ARCHIVE_DIR
+    path = Column(String, unique=True)
+    rows = Column(Integer)
+    size_bytes = Column(Integer)
+    min_id = Column(Integer)
+    max_id = Column(Integer)
+    min_completed_at = Column(DateTime)
+    max_completed_at = Column(DateTime)
+    # Every completion before this had been archived when the file was written
+    archived_before = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_completion_archives_completed", "min_completed_at", "max_completed_at"),
+    )
+
+class ArchivedCompletionCount(Base):
+    __tablename__ = "archived_completion_counts"
+
+    habit_id = Column(String, ForeignKey("habits.id"), primary_key=True)
+    completions = Column(Integer, default=0)
+    last_completed_at = Column(DateTime, nullable=True)
+
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+
+    version = Column(Integer, primary_key=True)
+    name = Column(String)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+def begin_write(db):
+    """Start `db`'s transaction holding the write lock, before it reads anything.
+
+    SQLite takes its database-wide lock up front (BEGIN IMMEDIATE), so rows
+    read in the transaction can't change before it commits, even from another
+    process.  Other backends lock the rows the caller selects FOR UPDATE.
+    """
+    connection = db.connection()
+    if connection.dialect.name == 'sqlite' and not connection.connection.driver_connection.in_transaction:
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+def init_db(bind=None):
+    """Create the database directory (SQLite), missing tables, and run migrations."""
+    from .migrations import migrate
+
+    bind = bind or engine
+    if bind.url.get_backend_name() == 'sqlite' and not _is_memory_sqlite(bind.url):
+        directory = os.path.dirname(os.path.abspath(bind.url.database))
+        os.makedirs(directory, exist_ok=True)
+    Base.metadata.create_all(bind=bind)
+    migrate(bind)
 
 # Dependency to get DB session
 def get_db():
@@ -1,8 +1,11 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import List, Optional
 from datetime import datetime, time
 
 class Habit(BaseModel):
+    # Built directly from ORM rows with model_validate()
+    model_config = ConfigDict(from_attributes=True)
+
     id: str
     name: str
     description: str
@@ -16,6 +19,8 @@ class Habit(BaseModel):
     category: str  # health, learning, productivity, etc.
 
 class HabitCompletion(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     habit_id: str
     completed_at: datetime
     notes: Optional[str] = None
@@ -23,6 +28,8 @@ class HabitCompletion(BaseModel):
     difficulty: Optional[int] = None  # 1-5 scale
 
 class UserProfile(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     id: str
     name: str
     habits: List[Habit]
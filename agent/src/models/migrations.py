@@ -0,0 +1,49 @@
+"""Versioned schema changes for databases created by older releases.
+
+``create_all`` only creates missing tables, so anything added to an existing
+table (indexes, columns) is applied here.  Each migration runs once and is
+recorded in ``schema_migrations``.
+"""
+from datetime import datetime
+
+from sqlalchemy import select
+
+from .database import Base, SchemaMigration
+
+
+def _create_indexes(*names):
+    def step(connection):
+        indexes = {
+            index.name: index
+            for table in Base.metadata.tables.values()
+            for index in table.indexes
+        }
+        for name in names:
+            indexes[name].create(connection, checkfirst=True)
+    return step
+
+
+MIGRATIONS = [
+    (1, "query pattern indexes", _create_indexes(
+        "ix_habits_user_active_category",
+        "ix_habit_completions_habit_completed",
+        "ix_habit_completions_completed_at",
+    )),
+    (2, "habit listing index", _create_indexes("ix_habits_user_id_id")),
+]
+
+
+def migrate(bind):
+    """Apply pending migrations in order; returns the versions applied."""
+    applied_now = []
+    with bind.begin() as connection:
+        applied = set(connection.execute(select(SchemaMigration.version)).scalars())
+        for version, name, step in MIGRATIONS:
+            if version in applied:
+                continue
+            step(connection)
+            connection.execute(SchemaMigration.__table__.insert().values(
+                version=version, name=name, applied_at=datetime.utcnow()
+            ))
+            applied_now.append(version)
+    return applied_now
@@ -0,0 +1,178 @@
+"""Personalized motivation messages from a small local transformer.
+
+Concurrent requests are coalesced by a ``BatchQueue`` into a single
+``generate`` call, so a core spends one forward pass on a whole batch rather
+than one per request.  The model loads once, on first use, with a fixed
+number of torch threads.  Prompts are built from rounded habit features and
+decoding is greedy, so identical inputs give identical messages: those are
+served from a cache, and identical prompts already in flight share a result.
+
+``torch`` and ``transformers`` are imported only when the model loads.
+"""
+import os
+import threading
+from concurrent.futures import Future
+
+from sqlalchemy import select
+
+from .batching import BatchQueue
+from .cache import TTLCache
+from .models.database import Habit, HabitCompletion, SessionLocal
+
+MODEL_NAME = os.getenv("MOTIVATION_MODEL", "google/flan-t5-small")
+MODEL_THREADS = int(os.getenv("MOTIVATION_THREADS", "1"))
+MAX_NEW_TOKENS = int(os.getenv("MOTIVATION_MAX_NEW_TOKENS", "40"))
+BATCH_SIZE = int(os.getenv("MOTIVATION_BATCH_SIZE", "16"))
+BATCH_DELAY = float(os.getenv("MOTIVATION_BATCH_DELAY_MS", "10")) / 1000
+# Completions whose mood and difficulty describe how the habit feels lately
+RECENT_COMPLETIONS = 14
+
+MOODS = {1: "low", 2: "a bit down", 3: "okay", 4: "good", 5: "great"}
+DIFFICULTIES = {1: "very easy", 2: "easy", 3: "manageable", 4: "hard", 5: "very hard"}
+
+
+class ModelUnavailable(RuntimeError):
+    """The motivation model can't be loaded (missing packages or weights)."""
+
+
+def recent_completions_query(habit_id):
+    return (
+        select(HabitCompletion.mood, HabitCompletion.difficulty)
+        .where(HabitCompletion.habit_id == habit_id)
+        .order_by(HabitCompletion.completed_at.desc())
+        .limit(RECENT_COMPLETIONS)
+    )
+
+
+def _rounded_mean(values):
+    values = [value for value in values if value is not None]
+    return round(sum(values) / len(values)) if values else None
+
+
+def build_prompt(name, category, streak, success_rate, mood, difficulty):
+    streak = streak or 0
+    parts = [
+        f'Write one short, encouraging sentence for someone building the habit "{name}"'
+        f"{f' ({category})' if category else ''}.",
+        f"They are on a {streak}-day streak" if streak else "They are starting fresh today",
+        f"and completed it on {round((success_rate or 0) * 10) * 10}% of recent days.",
+    ]
+    if mood in MOODS:
+        parts.append(f"Lately they have felt {MOODS[mood]}.")
+    if difficulty in DIFFICULTIES:
+        parts.append(f"They find it {DIFFICULTIES[difficulty]}.")
+    return " ".join(parts)
+
+
+def habit_prompt(db, habit_id):
+    """Prompt describing the habit's streak, mood and difficulty; None if it doesn't exist."""
+    habit = db.get(Habit, habit_id)
+    if habit is None:
+        return None
+    recent = db.execute(recent_completions_query(habit_id)).all()
+    return build_prompt(
+        habit.name, habit.category, habit.streak, habit.success_rate,
+        mood=_rounded_mean(row.mood for row in recent),
+        difficulty=_rounded_mean(row.difficulty for row in recent) or habit.difficulty,
+    )
+
+
+def load_habit_prompt(habit_id):
+    """``habit_prompt`` on its own session, closed again before generation starts."""
+    with SessionLocal() as db:
+        return habit_prompt(db, habit_id)
+
+
+class TransformerModel:
+    """A seq2seq model loaded once and run on CPU with a fixed thread count."""
+
+    def __init__(self, name=MODEL_NAME, threads=MODEL_THREADS, max_new_tokens=MAX_NEW_TOKENS):
+        self.name = name
+        self.threads = threads
+        self.max_new_tokens = max_new_tokens
+        self._loaded = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self._loaded is None:
+                os.environ.setdefault("OMP_NUM_THREADS", str(self.threads))
+                try:
+                    import torch
+                    from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+                except ImportError as exc:
+                    raise ModelUnavailable("torch and transformers are not installed") from exc
+
+                torch.set_num_threads(self.threads)
+                try:
+                    torch.set_num_interop_threads(1)
+                except RuntimeError:
+                    # Only settable before torch starts any parallel work
+                    pass
+                try:
+                    tokenizer = AutoTokenizer.from_pretrained(self.name)
+                    model = AutoModelForSeq2SeqLM.from_pretrained(self.name).eval()
+                except OSError as exc:
+                    raise ModelUnavailable(f"Can't load model {self.name}: {exc}") from exc
+                self._loaded = (torch, tokenizer, model)
+            return self._loaded
+
+    def generate(self, prompts):
+        torch, tokenizer, model = self.load()
+        inputs = tokenizer(prompts, return_tensors="pt", padding=True, truncation=True, max_length=128)
+        with torch.inference_mode():
+            outputs = model.generate(
+                **inputs, max_new_tokens=self.max_new_tokens, do_sample=False, num_beams=1
+            )
+        return [text.strip() for text in tokenizer.batch_decode(outputs, skip_special_tokens=True)]
+
+
+class MotivationService:
+    """Batches prompts into model calls and caches the resulting messages."""
+
+    def __init__(self, model, max_batch_size=BATCH_SIZE, max_delay=BATCH_DELAY, cache=None):
+        self.model = model
+        self.cache = cache if cache is not None else TTLCache(
+            maxsize=int(os.getenv("MOTIVATION_CACHE_SIZE", "10000")),
+            ttl=float(os.getenv("MOTIVATION_CACHE_TTL", "3600")),
+        )
+        self._queue = BatchQueue(
+            self._generate_batch, max_batch_size=max_batch_size, max_delay=max_delay,
+            name="motivation-batcher"
+        )
+        self._pending = {}
+        # Re-entrant: a future that is already done runs its callback immediately
+        self._lock = threading.RLock()
+
+    def _generate_batch(self, prompts):
+        unique = list(dict.fromkeys(prompts))
+        messages = dict(zip(unique, self.model.generate(unique)))
+        return [messages[prompt] for prompt in prompts]
+
+    def submit(self, prompt):
+        """Future resolving to the message for ``prompt``."""
+        message = self.cache.get(prompt)
+        if message is not None:
+            future = Future()
+            future.set_result(message)
+            return future
+        with self._lock:
+            future = self._pending.get(prompt)
+            if future is None:
+                future = self._queue.submit(prompt)
+                self._pending[prompt] = future
+                future.add_done_callback(lambda done: self._settle(prompt, done))
+            return future
+
+    def _settle(self, prompt, future):
+        if future.exception() is None:
+            self.cache.set(prompt, future.result())
+        with self._lock:
+            self._pending.pop(prompt, None)
+
+
+motivation_service = MotivationService(TransformerModel())
+
+
+def get_motivation_service():
+    return motivation_service
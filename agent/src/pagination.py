@@ -0,0 +1,37 @@
+"""Keyset (cursor) pagination helpers for the listing endpoints.
+
+A cursor is the opaque, URL-safe encoding of the sort key of the last row on
+a page.  The next page starts strictly after that key, so every page costs an
+index seek no matter how deep the client has paged.
+"""
+import base64
+import json
+
+from fastapi import HTTPException
+
+
+def encode_cursor(*values):
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor, size):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded))
+    except ValueError:
+        values = None
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def parse_fields(fields, allowed, required=()):
+    """Columns to return for a ``fields=a,b`` projection (all when omitted)."""
+    if not fields:
+        return list(allowed)
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return list(dict.fromkeys([*required, *requested]))
@@ -0,0 +1,292 @@
+"""Notification-time recommendations learned from completion timestamps.
+
+A batch job estimates, for each user, a kernel density over the local time
+of day of their recent completions, weighted by recency and mood.  Times
+are binned into 15-minute slots and smoothed with a Gaussian kernel on the
+unit circle (scikit-learn's ``rbf_kernel``, so 23:45 and 00:15 are
+neighbours), which turns a whole batch of users into one matrix product.
+A global density over every user's completions acts as a prior, so users
+with little history lean on the population.  The peak of the blended
+density, minus a short lead, is written to ``notification_recommendations``;
+the endpoint serves that row by primary key.
+
+Each run records the highest completion id it saw.  An incremental run only
+refits users with newer completions; ``--full`` refits everyone and the
+global model.
+
+    python -m src.recommendations refresh          # incremental
+    python -m src.recommendations refresh --full
+"""
+import argparse
+import math
+import os
+from datetime import datetime, time as dt_time, timedelta
+
+from sqlalchemy import delete, func, insert, select
+
+from .models.database import (
+    Habit, HabitCompletion, NotificationRecommendation, RecommendationRun, SessionLocal, User,
+    engine
+)
+
+SLOTS = 96  # 15-minute slots per day
+LOOKBACK_DAYS = int(os.getenv("RECOMMENDATION_LOOKBACK_DAYS", "90"))
+HALF_LIFE_DAYS = 30.0
+# Notify this long before the typical completion time
+LEAD_MINUTES = int(os.getenv("RECOMMENDATION_LEAD_MINUTES", "15"))
+# Weighted completions at which a user's own density counts as much as the prior
+PRIOR_STRENGTH = 10.0
+BANDWIDTH = 0.15  # on the unit circle; about 35 minutes
+GLOBAL_SAMPLE = 200_000
+
+
+def _slot_time(slot):
+    minutes = (slot * (24 * 60 // SLOTS) - LEAD_MINUTES) % (24 * 60)
+    return dt_time(minutes // 60, minutes % 60)
+
+
+def _encode(density):
+    return ",".join(f"{value:.6g}" for value in density)
+
+
+def _decode(text_value):
+    import numpy as np
+
+    if not text_value:
+        return None
+    return np.array([float(value) for value in text_value.split(",")])
+
+
+def _circle(minutes):
+    import numpy as np
+
+    angles = np.asarray(minutes, dtype=float) / (24 * 60) * 2 * math.pi
+    return np.column_stack([np.cos(angles), np.sin(angles)])
+
+
+def _kernel():
+    """Gaussian kernel between slot centres on the unit circle."""
+    import numpy as np
+    from sklearn.metrics.pairwise import rbf_kernel
+
+    grid = _circle(np.arange(SLOTS) * (24 * 60 / SLOTS))
+    return rbf_kernel(grid, gamma=1 / (2 * BANDWIDTH ** 2))
+
+
+def densities(histograms):
+    """Normalised kernel densities for rows of per-slot completion weights."""
+    smoothed = histograms @ _kernel()
+    totals = smoothed.sum(axis=1, keepdims=True)
+    return smoothed / (totals + (totals == 0))
+
+
+def histograms(codes, minutes, weights, rows):
+    """Per-slot completion weight for each of ``rows`` groups."""
+    import numpy as np
+
+    slots = np.rint(np.asarray(minutes) / (24 * 60 / SLOTS)).astype(np.int64) % SLOTS
+    counts = np.zeros((rows, SLOTS))
+    np.add.at(counts, (codes, slots), weights)
+    return counts
+
+
+def recommend(density):
+    """(recommended times, confidences) for each row of slot densities."""
+    import numpy as np
+
+    density = np.atleast_2d(density)
+    peaks = density.argmax(axis=1)
+    # Mass within an hour either side of the peak
+    window = (peaks[:, None] + np.arange(-4, 5)) % SLOTS
+    confidence = np.take_along_axis(density, window, axis=1).sum(axis=1)
+    return [_slot_time(int(peak)) for peak in peaks], confidence.tolist()
+
+
+def _completions_query(since, user_ids=None):
+    query = (
+        select(Habit.user_id, User.timezone, HabitCompletion.completed_at, HabitCompletion.mood)
+        .join(Habit, Habit.id == HabitCompletion.habit_id)
+        .join(User, User.id == Habit.user_id)
+        .where(HabitCompletion.completed_at >= since)
+    )
+    if user_ids is not None:
+        query = query.where(Habit.user_id.in_(user_ids))
+    return query
+
+
+def _load(connection, query):
+    """Completions as a frame with each one's minute of day in the user's timezone."""
+    import numpy as np
+    import pandas as pd
+
+    frame = pd.read_sql(query, connection)
+    completed = pd.to_datetime(frame["completed_at"])
+    minutes = pd.Series(0, index=frame.index, dtype=np.int64)
+    for zone, rows in frame.groupby(frame["timezone"].fillna("UTC")).groups.items():
+        try:
+            local = completed.loc[rows].dt.tz_localize("UTC").dt.tz_convert(zone)
+        except Exception:
+            # Unknown timezone names fall back to UTC
+            local = completed.loc[rows]
+        minutes.loc[rows] = local.dt.hour * 60 + local.dt.minute
+    return frame.assign(minute=minutes, completed_at=completed)
+
+
+def _weights(frame, now):
+    import numpy as np
+
+    age_days = (now - frame["completed_at"]).dt.total_seconds().to_numpy() / 86400
+    recency = np.power(0.5, np.maximum(age_days, 0) / HALF_LIFE_DAYS)
+    # Completions logged in a good mood count a little more
+    mood = 0.5 + frame["mood"].fillna(2.5).to_numpy(dtype=float) / 5
+    return recency * mood
+
+
+def fit_users(frame, now, prior):
+    """(user ids, times, confidences, completion counts), each density blended with ``prior``."""
+    import numpy as np
+    import pandas as pd
+
+    codes, user_ids = pd.factorize(frame["user_id"])
+    weights = _weights(frame, now)
+    counts = histograms(codes, frame["minute"].to_numpy(), weights, len(user_ids))
+    density = densities(counts)
+    if prior is not None:
+        totals = counts.sum(axis=1, keepdims=True)
+        share = totals / (totals + PRIOR_STRENGTH)
+        density = share * density + (1 - share) * prior
+    times, confidences = recommend(density)
+    return list(user_ids), times, confidences, np.bincount(codes, minlength=len(user_ids)).tolist()
+
+
+def _fit_global(connection, since, now):
+    query = _completions_query(since).order_by(HabitCompletion.id.desc()).limit(GLOBAL_SAMPLE)
+    frame = _load(connection, query)
+    if frame.empty:
+        return None
+    counts = histograms(0, frame["minute"].to_numpy(), _weights(frame, now), 1)
+    return densities(counts)[0]
+
+
+def _changed_users(connection, watermark, since):
+    query = (
+        select(Habit.user_id)
+        .join(HabitCompletion, HabitCompletion.habit_id == Habit.id)
+        .where(HabitCompletion.id > watermark)
+        .distinct()
+    )
+    if watermark == 0:
+        query = query.where(HabitCompletion.completed_at >= since)
+    return connection.execute(query).scalars().all()
+
+
+def latest_run(db):
+    return db.execute(
+        select(RecommendationRun)
+        .where(RecommendationRun.finished_at.is_not(None))
+        .order_by(RecommendationRun.id.desc())
+        .limit(1)
+    ).scalar_one_or_none()
+
+
+def refresh(bind=engine, full=False, now=None, batch_size=500, report=print):
+    """Refit changed users (everyone with ``full``); returns the finished run."""
+    now = now or datetime.utcnow()
+    since = now - timedelta(days=LOOKBACK_DAYS)
+    with SessionLocal(bind=bind) as db:
+        previous = latest_run(db)
+        watermark = db.execute(select(func.max(HabitCompletion.id))).scalar() or 0
+        run = RecommendationRun(
+            started_at=now, full=full or previous is None, completion_watermark=watermark
+        )
+        db.add(run)
+        db.commit()
+
+        connection = db.connection()
+        if run.full or not previous.global_density:
+            prior = _fit_global(connection, since, now)
+            run.global_density = _encode(prior) if prior is not None else ""
+            run.global_time = recommend(prior)[0][0] if prior is not None else None
+        else:
+            prior = _decode(previous.global_density)
+            run.global_density, run.global_time = previous.global_density, previous.global_time
+
+        if run.full:
+            user_ids = _changed_users(connection, 0, since)
+        else:
+            user_ids = _changed_users(connection, previous.completion_watermark, since)
+        user_ids = [user_id for user_id in user_ids if user_id is not None]
+
+        for start in range(0, len(user_ids), batch_size):
+            batch = user_ids[start:start + batch_size]
+            frame = _load(db.connection(), _completions_query(since, batch))
+            rows = [
+                {"user_id": user_id, "recommended_time": recommended,
+                 "confidence": round(confidence, 4), "completions_used": used,
+                 "computed_at": now}
+                for user_id, recommended, confidence, used in zip(*fit_users(frame, now, prior))
+            ] if not frame.empty else []
+            db.execute(delete(NotificationRecommendation).where(
+                NotificationRecommendation.user_id.in_(batch)
+            ))
+            if rows:
+                db.execute(insert(NotificationRecommendation), rows)
+            db.commit()
+            report(f"{min(start + batch_size, len(user_ids))}/{len(user_ids)} users refreshed")
+
+        if run.full:
+            # Users with no recent completions fall back to the global recommendation
+            db.execute(delete(NotificationRecommendation).where(
+                NotificationRecommendation.computed_at < now
+            ))
+        run.users_refreshed = len(user_ids)
+        run.finished_at = datetime.utcnow()
+        db.commit()
+        db.refresh(run)
+        db.expunge(run)
+    return run
+
+
+def get_recommendation(db, user_id):
+    """The stored recommendation, else the global one, else the user's own setting."""
+    recommendation = db.get(NotificationRecommendation, user_id)
+    if recommendation is not None:
+        return {
+            "user_id": user_id,
+            "recommended_time": recommendation.recommended_time,
+            "source": "user",
+            "confidence": recommendation.confidence,
+            "completions_used": recommendation.completions_used,
+            "computed_at": recommendation.computed_at,
+        }
+    user = db.get(User, user_id)
+    if user is None:
+        return None
+    run = latest_run(db)
+    if run is not None and run.global_time is not None:
+        return {
+            "user_id": user_id, "recommended_time": run.global_time, "source": "global",
+            "confidence": None, "completions_used": 0, "computed_at": run.started_at,
+        }
+    return {
+        "user_id": user_id, "recommended_time": user.preferred_notification_time,
+        "source": "preferred", "confidence": None, "completions_used": 0, "computed_at": None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Notification-time recommendations")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    refresh_parser = subcommands.add_parser(
+        "refresh", help="Refit users with new completions since the last run"
+    )
+    refresh_parser.add_argument("--full", action="store_true",
+                                help="Refit every user and the global model")
+    args = parser.parse_args(argv)
+
+    run = refresh(full=args.full)
+    print(f"Refreshed {run.users_refreshed} users (watermark {run.completion_watermark})")
+
+
+if __name__ == "__main__":
+    main()
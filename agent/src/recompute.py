@@ -0,0 +1,210 @@
+"""Recompute habit streaks and success rates across CPU cores.
+
+Users are split into contiguous id ranges (shards).  Each worker process
+opens its own engine, streams its shard's completions in (habit, time)
+order, merged with any archived ones (see ``src.archive``), folds them with
+the same rolling-window logic as the write path and writes the results back
+in batched UPDATEs.  Finished shards are recorded in a state file so an
+interrupted run can continue with ``--resume``.
+
+    python -m src.recompute --workers 8 --state-file recompute.json
+
+Run it while completion writes are paused: a completion recorded while its
+shard is being recomputed may be overwritten.
+"""
+import argparse
+import heapq
+import itertools
+import json
+import multiprocessing
+import operator
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from types import SimpleNamespace
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.orm import Session
+
+from . import stats
+from .models.database import (
+    ArchivedCompletionCount, Habit, HabitCompletion, HabitStats, build_engine, get_database_url
+)
+
+_worker_engine = None
+
+
+def plan_shards(bind, shard_size):
+    """Half-open [low, high) user id ranges covering every user id, present or future."""
+    with bind.connect() as connection:
+        user_ids = connection.execute(
+            select(Habit.user_id).distinct().order_by(Habit.user_id)
+        ).scalars().all()
+    boundaries = user_ids[shard_size::shard_size]
+    lows = [None] + boundaries
+    highs = boundaries + [None]
+    return [list(shard) for shard in zip(lows, highs)]
+
+
+def _shard_filter(query, low, high):
+    if low is not None:
+        query = query.where(Habit.user_id >= low)
+    if high is not None:
+        query = query.where(Habit.user_id < high)
+    return query
+
+
+def _fold_shard(connection, low, high):
+    """Yield (habit, stats) namespaces for every habit in the shard."""
+    # Completions moved out by src.archive are merged back in, habit by habit
+    archived = stats.archived_times(connection, connection.execute(_shard_filter(
+        select(Habit.user_id).distinct()
+        .join(ArchivedCompletionCount, ArchivedCompletionCount.habit_id == Habit.id),
+        low, high
+    )).scalars().all())
+    query = _shard_filter(
+        select(Habit.id, Habit.created_at, HabitCompletion.completed_at)
+        .outerjoin(HabitCompletion, HabitCompletion.habit_id == Habit.id)
+        .order_by(Habit.id, HabitCompletion.completed_at),
+        low, high
+    )
+    rows = connection.execution_options(stream_results=True, yield_per=5000).execute(query)
+    for habit_id, group in itertools.groupby(rows, key=operator.itemgetter(0)):
+        group = list(group)
+        habit = SimpleNamespace(
+            id=habit_id, created_at=group[0][1],
+            streak=0, success_rate=0.0, last_completed=None
+        )
+        habit_stats = SimpleNamespace(
+            day_buckets="", window_end=None, last_completed_day=None
+        )
+        hot = (completed_at for _, _, completed_at in group if completed_at is not None)
+        for completed_at in heapq.merge(archived.get(habit_id, ()), hot):
+            stats.apply_completion(habit, habit_stats, completed_at)
+        yield habit, habit_stats
+
+
+def _write_batch(db, batch):
+    habit_ids = [habit.id for habit, _ in batch]
+    db.execute(update(Habit), [
+        {"id": habit.id, "streak": habit.streak, "success_rate": habit.success_rate,
+         "last_completed": habit.last_completed}
+        for habit, _ in batch
+    ])
+    db.execute(delete(HabitStats).where(HabitStats.habit_id.in_(habit_ids)))
+    db.execute(insert(HabitStats), [
+        {"habit_id": habit.id, "day_buckets": habit_stats.day_buckets,
+         "window_end": habit_stats.window_end,
+         "last_completed_day": habit_stats.last_completed_day}
+        for habit, habit_stats in batch
+    ])
+    db.commit()
+
+
+def _init_worker(database_url):
+    global _worker_engine
+    _worker_engine = build_engine(database_url, pool_size=2, max_overflow=0)
+
+
+def recompute_shard(index, low, high, batch_size=1000, bind=None):
+    bind = bind or _worker_engine
+    updated = 0
+    batch = []
+    with bind.connect() as reader, Session(bind) as writer:
+        for habit, habit_stats in _fold_shard(reader, low, high):
+            batch.append((habit, habit_stats))
+            if len(batch) >= batch_size:
+                _write_batch(writer, batch)
+                updated += len(batch)
+                batch = []
+        if batch:
+            _write_batch(writer, batch)
+            updated += len(batch)
+    return index, updated
+
+
+def _load_state(path):
+    if path and os.path.exists(path):
+        with open(path) as state_file:
+            return json.load(state_file)
+    return None
+
+
+def _save_state(path, state):
+    if not path:
+        return
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as state_file:
+        json.dump(state, state_file)
+    os.replace(temporary, path)
+
+
+def run(database_url=None, workers=None, shard_size=1000, batch_size=1000,
+        state_file=None, resume=False, report=print):
+    """Recompute every shard not yet marked done; returns the number of habits updated."""
+    database_url = database_url or get_database_url()
+    workers = workers or os.cpu_count() or 1
+
+    state = _load_state(state_file) if resume else None
+    if state is None:
+        planner = build_engine(database_url)
+        try:
+            state = {"shards": plan_shards(planner, shard_size), "done": []}
+        finally:
+            planner.dispose()
+        _save_state(state_file, state)
+
+    done = set(state["done"])
+    pending = [
+        (index, low, high) for index, (low, high) in enumerate(state["shards"])
+        if index not in done
+    ]
+    total_shards = len(state["shards"])
+    report(f"{len(pending)} of {total_shards} shards to recompute on {workers} workers")
+
+    started = time.monotonic()
+    updated = 0
+    # Spawned workers start clean instead of inheriting the parent's threads and connections
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=context,
+        initializer=_init_worker, initargs=(database_url,)
+    ) as pool:
+        futures = [
+            pool.submit(recompute_shard, index, low, high, batch_size)
+            for index, low, high in pending
+        ]
+        for future in as_completed(futures):
+            index, shard_updated = future.result()
+            updated += shard_updated
+            done.add(index)
+            state["done"] = sorted(done)
+            _save_state(state_file, state)
+
+            elapsed = time.monotonic() - started
+            report(
+                f"[{len(done)}/{total_shards}] shard {index}: {shard_updated} habits "
+                f"({updated} total, {updated / elapsed if elapsed else 0:.0f} habits/s)"
+            )
+    return updated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recompute habit streaks and success rates")
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--shard-size", type=int, default=1000, help="Users per shard")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Habits per UPDATE batch")
+    parser.add_argument("--state-file", default="recompute-state.json")
+    parser.add_argument("--resume", action="store_true", help="Skip shards finished by a previous run")
+    args = parser.parse_args(argv)
+
+    updated = run(
+        database_url=args.database_url, workers=args.workers, shard_size=args.shard_size,
+        batch_size=args.batch_size, state_file=args.state_file, resume=args.resume
+    )
+    print(f"Recomputed {updated} habits")
+
+
+if __name__ == "__main__":
+    main()
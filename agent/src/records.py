@@ -0,0 +1,85 @@
+"""Read-through caching of single habit and user lookups.
+
+Entries hold the serialized JSON body together with its ETag, so a hit is
+served without touching the database or re-encoding, and a matching
+``If-None-Match`` is answered with 304 from the ETag alone.  Writes that
+change a habit or a user's profile call ``invalidate_habit`` /
+``invalidate_user`` after committing.
+
+Setting ``SHARED_CACHE_URL`` (e.g. ``redis://cache:6379/0``) adds a shared tier
+behind the per-process cache so all workers benefit from one another's
+fills.  Invalidations reach the shared tier and the writing worker
+immediately, but other workers' local copies live until
+``RECORD_CACHE_LOCAL_TTL`` expires, so that TTL is short by default, with or
+without a shared tier.
+"""
+import hashlib
+import os
+
+from .cache import SHARED_CACHE_URL, ReadThroughCache, TTLCache, shared_backend
+from .models.database import Habit, User
+from .models.habit import Habit as HabitModel, UserProfile
+
+RECORD_CACHE_TTL = float(os.getenv("RECORD_CACHE_TTL", "60"))
+RECORD_CACHE_LOCAL_TTL = float(os.getenv("RECORD_CACHE_LOCAL_TTL", "2"))
+
+record_cache = ReadThroughCache(
+    TTLCache(maxsize=int(os.getenv("RECORD_CACHE_SIZE", "10000")), ttl=RECORD_CACHE_LOCAL_TTL),
+    shared=shared_backend(SHARED_CACHE_URL),
+    shared_ttl=RECORD_CACHE_TTL,
+)
+
+
+def _pack(body):
+    etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    return etag.encode() + b"\n" + body
+
+
+def unpack(entry):
+    """Split a cache entry into its ETag and JSON body."""
+    etag, body = entry.split(b"\n", 1)
+    return etag.decode(), body
+
+
+def _habit_key(habit_id):
+    return f"habit:{habit_id}"
+
+
+def _user_key(user_id):
+    return f"user:{user_id}"
+
+
+def get_habit(db, habit_id):
+    """(etag, body) for the habit, or None if it doesn't exist."""
+    def load():
+        db_habit = db.get(Habit, habit_id)
+        if db_habit is None:
+            return None
+        return _pack(HabitModel.model_validate(db_habit).model_dump_json().encode())
+
+    entry = record_cache.get_or_load(_habit_key(habit_id), load)
+    return None if entry is None else unpack(entry)
+
+
+def get_user(db, user_id):
+    """(etag, body) for the user's profile, or None if it doesn't exist."""
+    def load():
+        db_user = db.get(User, user_id)
+        if db_user is None:
+            return None
+        return _pack(UserProfile.model_validate(db_user).model_dump_json().encode())
+
+    entry = record_cache.get_or_load(_user_key(user_id), load)
+    return None if entry is None else unpack(entry)
+
+
+def invalidate_habit(habit_id, user_id=None):
+    # User profiles embed their habits, so they go stale together
+    keys = [_habit_key(habit_id)]
+    if user_id is not None:
+        keys.append(_user_key(user_id))
+    record_cache.invalidate(*keys)
+
+
+def invalidate_user(user_id):
+    record_cache.invalidate(_user_key(user_id))
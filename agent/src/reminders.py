@@ -0,0 +1,438 @@
+"""Timezone-aware habit reminders.
+
+Every user with a preferred notification time and at least one active habit
+has one pending reminder: the next UTC instant at which their local clock
+shows that time.  Pending reminders sit in a heap ordered by (fire time,
+user id).  Changing a user pushes a new entry and leaves the old one to be
+skipped when it reaches the top (lazy invalidation).  An update is therefore
+O(log n), and nothing scans the users table on a timer.
+
+Due reminders are popped in order and handed to a sink in batches, together
+with each user's active habits.  After every batch the scheduler checkpoints
+the last (fire time, user id) it delivered.  On restart it reloads users in
+keyset pages and schedules each user after that checkpoint.  Nothing is sent
+twice, and reminders that came due during a short outage (up to
+``REMINDER_CATCH_UP_SECONDS``) still go out.  Delivery is at least once: a
+batch whose sink call fails is retried.
+
+The scheduler runs in a process of its own, exactly one per deployment:
+
+    python -m src.reminders run
+
+API workers never start it, since every worker would send every reminder.
+Instead, the API appends the id of every user it creates or gives a habit to
+``reminder_changes`` in the same transaction (``record_change``).  The
+scheduler polls that table past the highest id it has read, reschedules just
+those users and deletes the rows it consumed.  A full resync every
+``REMINDER_RESYNC_SECONDS`` is the safety net for offline jobs that write
+users or habits directly.  Code running inside the scheduler process can call
+``notify`` to reschedule users straight away.
+"""
+import argparse
+import calendar
+import heapq
+import logging
+import os
+import signal
+import threading
+import time
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from sqlalchemy import delete, func, select
+
+from .models.database import (
+    Habit, ReminderChange, ReminderCheckpoint, SessionLocal, User, engine, init_db
+)
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", "1000"))
+CATCH_UP_SECONDS = int(os.getenv("REMINDER_CATCH_UP_SECONDS", "900"))
+# Full re-read of users; changes made through the API arrive via reminder_changes
+RESYNC_SECONDS = float(os.getenv("REMINDER_RESYNC_SECONDS", "3600"))
+RETRY_SECONDS = 30.0
+LOAD_CHUNK = 10_000
+# Longest the loop sleeps, so stop() and notify() are handled promptly
+MAX_SLEEP = 1.0
+CHECKPOINT_NAME = "reminders"
+
+Reminder = namedtuple("Reminder", "user_id due_at local_time timezone habits")
+
+
+@lru_cache(maxsize=None)
+def _zone(name):
+    try:
+        return ZoneInfo(name or "UTC")
+    except (ZoneInfoNotFoundError, ValueError):
+        # Unknown timezone names fall back to UTC
+        return ZoneInfo("UTC")
+
+
+@lru_cache(maxsize=65536)
+def next_fire(zone_name, local_time, after):
+    """First epoch second after ``after`` at which ``zone_name``'s clock shows ``local_time``.
+
+    Cached: users sharing a timezone and time share every fire time, and the
+    cache key includes ``after``.
+    """
+    zone = _zone(zone_name)
+    day = datetime.fromtimestamp(after, zone).date()
+    while True:
+        # Times skipped by a DST jump resolve to the same wall time after it
+        candidate = int(datetime.combine(day, local_time, tzinfo=zone).timestamp())
+        if candidate > after:
+            return candidate
+        day += timedelta(days=1)
+
+
+def _epoch(value):
+    return calendar.timegm(value.timetuple())
+
+
+def _utc(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None)
+
+
+def _schedulable_users():
+    has_active_habit = (
+        select(Habit.id)
+        .where(Habit.user_id == User.id, Habit.is_active.is_(True))
+        .exists()
+    )
+    return (
+        select(User.id, User.preferred_notification_time, User.timezone)
+        .where(User.preferred_notification_time.is_not(None), has_active_habit)
+    )
+
+
+def record_change(db, *user_ids):
+    """Queue ``user_ids`` for rescheduling; commits with the caller's transaction."""
+    db.add_all(ReminderChange(user_id=user_id) for user_id in user_ids)
+
+
+class LogSink:
+    """Logs each reminder; the default until a push provider is configured."""
+
+    def send(self, reminders):
+        for reminder in reminders:
+            logger.info(
+                "Reminder for %s at %s (%s): %d habits", reminder.user_id, reminder.due_at,
+                reminder.timezone, len(reminder.habits)
+            )
+
+
+class MemorySink:
+    """Keeps delivered batches in memory; a local stand-in for push delivery."""
+
+    def __init__(self):
+        self.batches = []
+
+    def send(self, reminders):
+        self.batches.append(list(reminders))
+
+    @property
+    def reminders(self):
+        return [reminder for batch in self.batches for reminder in batch]
+
+
+class ReminderScheduler:
+    """Heap of next-fire times, dispatched in batches to ``sink.send(reminders)``."""
+
+    def __init__(self, sink=None, bind=None, batch_size=BATCH_SIZE,
+                 catch_up=CATCH_UP_SECONDS, resync_interval=RESYNC_SECONDS, clock=time.time):
+        self.sink = sink if sink is not None else LogSink()
+        self.bind = bind or engine
+        self.batch_size = batch_size
+        self.catch_up = catch_up
+        self.resync_interval = resync_interval
+        self._clock = clock
+        self._heap = []
+        # user id -> (fire time, local time, timezone); a heap entry is live
+        # only while its fire time matches this
+        self._users = {}
+        self._interned = {}
+        self._changed = set()
+        # Highest reminder_changes id applied; set by the first load
+        self._change_id = None
+        self._retry_at = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.checkpoint = None
+
+    def __len__(self):
+        return len(self._users)
+
+    def scheduled(self, user_id):
+        """UTC time of the user's next reminder, or None."""
+        entry = self._users.get(user_id)
+        return _utc(entry[0]) if entry else None
+
+    def next_due(self):
+        with self._lock:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def _drop_stale(self):
+        heap, users = self._heap, self._users
+        while heap and users.get(heap[0][1], (None,))[0] != heap[0][0]:
+            heapq.heappop(heap)
+
+    def _schedule(self, user_id, local_time, zone_name, after):
+        # Callers hold the lock
+        fire_at = next_fire(zone_name, local_time, after)
+        self._users[user_id] = (fire_at, local_time, zone_name)
+        heapq.heappush(self._heap, (fire_at, user_id))
+
+    def _compact(self):
+        if len(self._heap) > 2 * len(self._users) + 1024:
+            self._heap = [(entry[0], user_id) for user_id, entry in self._users.items()]
+            heapq.heapify(self._heap)
+
+    def _apply(self, rows, after):
+        """Schedule ``rows`` of (user id, local time, timezone); unchanged users keep their slot."""
+        with self._lock:
+            for user_id, local_time, zone_name in rows:
+                # Share the few distinct times and zone names across users
+                local_time = self._interned.setdefault(local_time, local_time)
+                zone_name = self._interned.setdefault(zone_name, zone_name)
+                current = self._users.get(user_id)
+                if current is not None and current[1:] == (local_time, zone_name):
+                    continue
+                user_after = after[0]
+                if after[1] is not None:
+                    # Restarting: a user fires at the checkpointed time only if
+                    # they sort after the last user delivered at that time
+                    user_after -= 1
+                    if next_fire(zone_name, local_time, user_after) == after[0] \
+                            and user_id <= after[1]:
+                        user_after = after[0]
+                self._schedule(user_id, local_time, zone_name, user_after)
+            self._compact()
+
+    def _restore_checkpoint(self, db):
+        checkpoint = db.get(ReminderCheckpoint, CHECKPOINT_NAME)
+        if checkpoint is not None and checkpoint.fired_at is not None:
+            self.checkpoint = (_epoch(checkpoint.fired_at), checkpoint.user_id)
+
+    def load(self, reconcile=False):
+        """Schedule every eligible user, a page at a time; returns the number scheduled.
+
+        The first load resumes after the stored checkpoint.  With
+        ``reconcile``, users who are no longer eligible are dropped.
+        """
+        now = int(self._clock())
+        with SessionLocal(bind=self.bind) as db:
+            if self.checkpoint is None:
+                self._restore_checkpoint(db)
+            if self._change_id is None:
+                # Read before the users, so changes committed mid-load are polled again
+                self._change_id = db.scalar(select(func.max(ReminderChange.id))) or 0
+            after = (now, None)
+            if not reconcile and self.checkpoint is not None:
+                # Resume after the last reminder delivered, replaying at most catch_up
+                if self.checkpoint[0] >= now - self.catch_up:
+                    after = self.checkpoint
+                else:
+                    after = (now - self.catch_up, None)
+
+            seen = set()
+            last_id = ""
+            while True:
+                rows = db.execute(
+                    _schedulable_users().where(User.id > last_id).order_by(User.id).limit(LOAD_CHUNK)
+                ).all()
+                if not rows:
+                    break
+                self._apply(rows, after)
+                if reconcile:
+                    seen.update(row[0] for row in rows)
+                last_id = rows[-1][0]
+
+        if reconcile:
+            with self._lock:
+                for user_id in [user_id for user_id in self._users if user_id not in seen]:
+                    del self._users[user_id]
+                self._compact()
+        return len(self._users)
+
+    def refresh_users(self, user_ids):
+        """Re-read ``user_ids`` from the database and reschedule or drop them."""
+        user_ids = list(user_ids)
+        now = int(self._clock())
+        found = set()
+        with SessionLocal(bind=self.bind) as db:
+            for start in range(0, len(user_ids), 500):
+                rows = db.execute(
+                    _schedulable_users().where(User.id.in_(user_ids[start:start + 500]))
+                ).all()
+                self._apply(rows, (now, None))
+                found.update(row[0] for row in rows)
+        with self._lock:
+            for user_id in user_ids:
+                if user_id not in found:
+                    self._users.pop(user_id, None)
+            self._compact()
+
+    def poll_changes(self):
+        """Reschedule users recorded in ``reminder_changes`` since the last poll; returns how many."""
+        if self._change_id is None:
+            # Nothing is scheduled before the first load
+            return 0
+        with SessionLocal(bind=self.bind) as db:
+            rows = db.execute(
+                select(ReminderChange.id, ReminderChange.user_id)
+                .where(ReminderChange.id > self._change_id)
+                .order_by(ReminderChange.id)
+                .limit(LOAD_CHUNK)
+            ).all()
+        if not rows:
+            return 0
+        user_ids = {user_id for _, user_id in rows}
+        self.refresh_users(user_ids)
+        self._change_id = rows[-1][0]
+        with SessionLocal(bind=self.bind) as db:
+            # This scheduler is the feed's only reader
+            db.execute(delete(ReminderChange).where(ReminderChange.id <= self._change_id))
+            db.commit()
+        return len(user_ids)
+
+    def notify(self, *user_ids):
+        """Queue changed users for the scheduler thread; a no-op if it isn't running."""
+        if self._thread is None:
+            return
+        with self._lock:
+            self._changed.update(user_ids)
+        self._wake.set()
+
+    def _pop_due(self, now):
+        batch = []
+        with self._lock:
+            heap, users = self._heap, self._users
+            while heap and len(batch) < self.batch_size and heap[0][0] <= now:
+                fire_at, user_id = heapq.heappop(heap)
+                entry = users.get(user_id)
+                if entry is not None and entry[0] == fire_at:
+                    batch.append((fire_at, user_id, entry[1], entry[2]))
+        return batch
+
+    def _deliver(self, batch):
+        user_ids = [user_id for _, user_id, _, _ in batch]
+        habits = defaultdict(list)
+        with SessionLocal(bind=self.bind) as db:
+            for user_id, habit_id, name in db.execute(
+                select(Habit.user_id, Habit.id, Habit.name)
+                .where(Habit.user_id.in_(user_ids), Habit.is_active.is_(True))
+            ):
+                habits[user_id].append({"id": habit_id, "name": name})
+            reminders = [
+                Reminder(user_id, _utc(fire_at), local_time, zone_name, habits[user_id])
+                for fire_at, user_id, local_time, zone_name in batch
+                if habits[user_id]
+            ]
+            if reminders:
+                self.sink.send(reminders)
+            fired_at, user_id = batch[-1][:2]
+            db.merge(ReminderCheckpoint(
+                name=CHECKPOINT_NAME, fired_at=_utc(fired_at), user_id=user_id,
+                updated_at=datetime.utcnow()
+            ))
+            db.commit()
+        self.checkpoint = (fired_at, user_id)
+        return len(reminders)
+
+    def dispatch_due(self, now=None):
+        """Deliver every reminder due by ``now``; returns how many were sent."""
+        now = int(self._clock() if now is None else now)
+        if now < self._retry_at:
+            return 0
+        sent = 0
+        while True:
+            batch = self._pop_due(now)
+            if not batch:
+                return sent
+            try:
+                sent += self._deliver(batch)
+            except Exception:
+                logger.exception("Delivering %d reminders failed; retrying", len(batch))
+                with self._lock:
+                    for fire_at, user_id, _, _ in batch:
+                        if self._users.get(user_id, (None,))[0] == fire_at:
+                            heapq.heappush(self._heap, (fire_at, user_id))
+                self._retry_at = now + RETRY_SECONDS
+                return sent
+            with self._lock:
+                for fire_at, user_id, local_time, zone_name in batch:
+                    # Users changed mid-delivery were already rescheduled
+                    if self._users.get(user_id, (None,))[0] == fire_at:
+                        self._schedule(user_id, local_time, zone_name, fire_at)
+
+    def _sleep_time(self):
+        next_due = self.next_due()
+        if next_due is None:
+            return MAX_SLEEP
+        return min(MAX_SLEEP, max(0.0, next_due - self._clock()))
+
+    def _run(self):
+        next_resync = None
+        while not self._stop.is_set():
+            try:
+                if next_resync is None:
+                    count = self.load()
+                    logger.info("Scheduled reminders for %d users", count)
+                    next_resync = self._clock() + self.resync_interval
+                self.poll_changes()
+                with self._lock:
+                    changed, self._changed = self._changed, set()
+                if changed:
+                    self.refresh_users(changed)
+                if self.resync_interval and self._clock() >= next_resync:
+                    self.load(reconcile=True)
+                    next_resync = self._clock() + self.resync_interval
+                self.dispatch_due()
+            except Exception:
+                logger.exception("Reminder scheduler iteration failed")
+            self._wake.wait(self._sleep_time())
+            self._wake.clear()
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="reminder-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        if self._thread is not None:
+            self._stop.set()
+            self._wake.set()
+            self._thread.join(timeout)
+            self._thread = None
+
+
+reminder_scheduler = ReminderScheduler()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Habit reminder scheduler")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("run", help="Dispatch reminders until interrupted")
+    parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    init_db()
+    stopping = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stopping.set())
+    reminder_scheduler.start()
+    try:
+        stopping.wait()
+    finally:
+        reminder_scheduler.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""Serialization shortcuts for the read-heavy endpoints.
+
+By default FastAPI re-validates a handler's return value against its
+``response_model``, walks it with ``jsonable_encoder`` and encodes it with
+``json.dumps``.  Handlers that return a ``Response`` built here skip all
+three: models are dumped straight to JSON bytes by pydantic-core and plain
+data by orjson.
+"""
+import orjson
+from fastapi.responses import Response
+
+JSON_MEDIA_TYPE = "application/json"
+
+
+def dumps(content):
+    return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+def json_bytes_response(body, status_code=200, headers=None):
+    return Response(body, status_code=status_code, headers=headers, media_type=JSON_MEDIA_TYPE)
+
+
+def json_response(content):
+    return json_bytes_response(dumps(content))
+
+
+def etag_matches(etag, if_none_match):
+    """Weak comparison of ``etag`` against an If-None-Match header value."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def conditional_response(etag, body, if_none_match):
+    """200 with ``body``, or an empty 304 if the client already has this ETag."""
+    # no-cache: clients may keep the response but must revalidate it each time
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(etag, if_none_match):
+        return Response(status_code=304, headers=headers)
+    return json_bytes_response(body, headers=headers)
@@ -0,0 +1,194 @@
+"""Daily and weekly completion rollups keyed by (user, habit, period).
+
+``record`` folds new completions into both tables inside the caller's
+transaction, so time-series reads cost O(periods in range) instead of
+O(history).  ``backfill`` rebuilds them from ``habit_completions``.
+"""
+import argparse
+from collections import defaultdict
+from datetime import timedelta
+
+from sqlalchemy import delete, func, select
+
+from . import stats
+from .models.database import (
+    CompletionArchive, DailyRollup, Habit, HabitCompletion, SessionLocal, WeeklyRollup
+)
+
+MEASURES = ["completions", "mood_sum", "mood_count", "difficulty_sum", "difficulty_count"]
+
+
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def _increments(entries):
+    """Sum (habit, completion) pairs into per-day and per-week measure dicts."""
+    daily = defaultdict(lambda: dict.fromkeys(MEASURES, 0))
+    weekly = defaultdict(lambda: dict.fromkeys(MEASURES, 0))
+    for habit, completion in entries:
+        day = stats.naive_utc(completion.completed_at).date()
+        for rollup, period in ((daily, day), (weekly, week_start(day))):
+            measures = rollup[(habit.user_id, habit.id, period, habit.category)]
+            measures["completions"] += 1
+            if completion.mood is not None:
+                measures["mood_sum"] += completion.mood
+                measures["mood_count"] += 1
+            if completion.difficulty is not None:
+                measures["difficulty_sum"] += completion.difficulty
+                measures["difficulty_count"] += 1
+    return daily, weekly
+
+
+def _upsert(db, model, period_column, increments):
+    if not increments:
+        return
+    rows = [
+        {"user_id": user_id, "habit_id": habit_id, period_column: period,
+         "category": category, **measures}
+        for (user_id, habit_id, period, category), measures in increments.items()
+    ]
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        for row in rows:
+            key = (row["user_id"], row["habit_id"], row[period_column])
+            existing = db.get(model, key)
+            if existing is None:
+                db.add(model(**row))
+            else:
+                for measure in MEASURES:
+                    setattr(existing, measure, getattr(existing, measure) + row[measure])
+        return
+
+    table = model.__table__
+    statement = insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=["user_id", "habit_id", period_column],
+        set_={measure: table.c[measure] + statement.excluded[measure] for measure in MEASURES}
+    )
+    db.execute(statement, rows)
+
+
+def record(db, entries):
+    """Add (habit, completion) pairs to the rollups; the caller commits."""
+    daily, weekly = _increments(entries)
+    _upsert(db, DailyRollup, "day", daily)
+    _upsert(db, WeeklyRollup, "week_start", weekly)
+
+
+def backfill(db, habit_ids=None, batch_size=200):
+    """Rebuild rollups for the given habits (all by default) from raw completions.
+
+    Each batch of habits is cleared and recomputed in one transaction, so
+    completions recorded concurrently are never counted twice.  Periods
+    before the archive cutoff (see ``src.archive``) are left alone: their
+    completions are no longer in ``habit_completions``.
+    """
+    if habit_ids is None:
+        habit_ids = db.execute(select(Habit.id).order_by(Habit.id)).scalars().all()
+    cutoff = db.execute(select(func.max(CompletionArchive.archived_before))).scalar()
+
+    rebuilt = 0
+    for start in range(0, len(habit_ids), batch_size):
+        batch = habit_ids[start:start + batch_size]
+        daily = delete(DailyRollup).where(DailyRollup.habit_id.in_(batch))
+        weekly = delete(WeeklyRollup).where(WeeklyRollup.habit_id.in_(batch))
+        if cutoff is not None:
+            # The cutoff is a Monday, so it splits neither days nor weeks
+            daily = daily.where(DailyRollup.day >= cutoff.date())
+            weekly = weekly.where(WeeklyRollup.week_start >= cutoff.date())
+        db.execute(daily)
+        db.execute(weekly)
+        habits = {
+            habit.id: habit
+            for habit in db.execute(select(Habit).where(Habit.id.in_(batch))).scalars()
+        }
+        query = select(
+            HabitCompletion.habit_id,
+            HabitCompletion.completed_at,
+            HabitCompletion.mood,
+            HabitCompletion.difficulty,
+        ).where(HabitCompletion.habit_id.in_(batch))
+        if cutoff is not None:
+            # Older stragglers are already counted and go with the next archive run
+            query = query.where(HabitCompletion.completed_at >= cutoff)
+        completions = db.execute(query).all()
+        record(db, ((habits[completion.habit_id], completion) for completion in completions))
+        db.commit()
+        rebuilt += len(habits)
+    return rebuilt
+
+
+def timeseries_query(user_id, granularity="day", start=None, end=None,
+                     category=None, habit_id=None, by_category=False):
+    model, period = (
+        (WeeklyRollup, WeeklyRollup.week_start) if granularity == "week"
+        else (DailyRollup, DailyRollup.day)
+    )
+    columns = [period.label("period")]
+    if by_category:
+        columns.append(model.category)
+    columns += [func.sum(getattr(model, measure)).label(measure) for measure in MEASURES]
+
+    group_by = columns[:2] if by_category else columns[:1]
+    query = (
+        select(*columns)
+        .where(model.user_id == user_id)
+        .group_by(*group_by)
+        .order_by(*group_by)
+    )
+    if start is not None:
+        query = query.where(period >= (week_start(start) if granularity == "week" else start))
+    if end is not None:
+        query = query.where(period <= end)
+    if category is not None:
+        query = query.where(model.category == category)
+    if habit_id is not None:
+        query = query.where(model.habit_id == habit_id)
+    return query
+
+
+def _average(total, count):
+    return total / count if count else None
+
+
+def get_timeseries(db, user_id, granularity="day", by_category=False, **filters):
+    series = []
+    for row in db.execute(timeseries_query(
+        user_id, granularity, by_category=by_category, **filters
+    )):
+        point = {"period": row.period.isoformat()}
+        if by_category:
+            point["category"] = row.category
+        point.update({
+            "completions": row.completions,
+            "average_mood": _average(row.mood_sum, row.mood_count),
+            "average_difficulty": _average(row.difficulty_sum, row.difficulty_count),
+        })
+        series.append(point)
+    return {"user_id": user_id, "granularity": granularity, "series": series}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Completion rollup maintenance")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    backfill_parser = subcommands.add_parser(
+        "backfill", help="Rebuild daily and weekly rollups from habit_completions"
+    )
+    backfill_parser.add_argument("--habit-id", action="append", dest="habit_ids")
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        rebuilt = backfill(db, habit_ids=args.habit_ids)
+    finally:
+        db.close()
+    print(f"Rebuilt rollups for {rebuilt} habits")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""Rolling-window habit statistics.
+
+Every habit has a ``HabitStats`` row holding one completion counter per day
+for the last ``WINDOW_DAYS`` days.  Recording a completion shifts expired
+buckets out of the window and bumps the bucket for the completion day, so the
+write path costs the same no matter how much history a habit has.
+
+Habits that go idle get no writes, so ``expire`` (run daily) slides their
+windows forward to today and ends streaks that missed a day.
+"""
+import argparse
+import heapq
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+
+from . import analytics, records
+from .models.database import (
+    ArchivedCompletionCount, Habit, HabitCompletion, HabitStats, SessionLocal, begin_write
+)
+
+WINDOW_DAYS = 30
+
+
+def _decode(day_buckets):
+    if not day_buckets:
+        return [0] * WINDOW_DAYS
+    return [int(count) for count in day_buckets.split(",")]
+
+
+def _encode(buckets):
+    return ",".join(str(count) for count in buckets)
+
+
+def _window_length(habit, window_end):
+    # A habit created last week can't have missed 30 days yet
+    if habit.created_at is None:
+        return WINDOW_DAYS
+    age_days = (window_end - habit.created_at.date()).days + 1
+    return min(WINDOW_DAYS, max(1, age_days))
+
+
+def _run_length(buckets, offset):
+    """Consecutive active days ending at ``offset`` days before the window end."""
+    length = 0
+    for count in buckets[offset:]:
+        if not count:
+            break
+        length += 1
+    return length
+
+
+def naive_utc(value):
+    # SQLite hands back naive datetimes, so compare everything as naive UTC
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _slide(buckets, window_end, day):
+    """Move the window end forward to ``day``, expiring buckets that fall out of it."""
+    shift = (day - window_end).days
+    if shift > 0:
+        buckets = ([0] * min(shift, WINDOW_DAYS) + buckets)[:WINDOW_DAYS]
+        window_end = day
+    return buckets, window_end
+
+
+def apply_completion(habit, stats, completed_at):
+    """Fold a single completion into the habit's counters in O(WINDOW_DAYS)."""
+    completed_at = naive_utc(completed_at)
+    day = completed_at.date()
+    buckets, window_end = _slide(_decode(stats.day_buckets), stats.window_end or day, day)
+
+    offset = (window_end - day).days
+    if offset < WINDOW_DAYS:
+        buckets[offset] += 1
+
+    # Streak counts consecutive days and resets on a gap
+    last_day = stats.last_completed_day
+    if last_day is None or day > last_day:
+        if last_day is not None and (day - last_day).days == 1:
+            # `expire` may have ended the streak before this late completion
+            # for the next day arrived; the window still has the run
+            habit.streak = max((habit.streak or 0) + 1, _run_length(buckets, offset))
+        else:
+            habit.streak = 1
+        stats.last_completed_day = day
+    elif offset < WINDOW_DAYS and buckets[offset] == 1:
+        # A late completion on a new day may close a gap in the window.  A run
+        # reaching past the window keeps the longer known streak; `rebuild`
+        # settles late completions older than the window.
+        habit.streak = max(habit.streak or 0, _run_length(buckets, (window_end - last_day).days))
+
+    if habit.last_completed is None or completed_at > habit.last_completed:
+        habit.last_completed = completed_at
+
+    stats.day_buckets = _encode(buckets)
+    stats.window_end = window_end
+    active_days = sum(1 for count in buckets if count)
+    habit.success_rate = active_days / _window_length(habit, window_end)
+
+
+def advance(habit, stats, today):
+    """Slide an idle habit's window forward to ``today`` and end a streak that missed a day."""
+    if stats.window_end is not None and stats.window_end < today:
+        buckets, window_end = _slide(_decode(stats.day_buckets), stats.window_end, today)
+        stats.day_buckets = _encode(buckets)
+        stats.window_end = window_end
+        active_days = sum(1 for count in buckets if count)
+        habit.success_rate = active_days / _window_length(habit, window_end)
+    # Yesterday's completion keeps the streak alive through today
+    last_day = stats.last_completed_day
+    if last_day is not None and (today - last_day).days > 1:
+        habit.streak = 0
+
+
+def get_or_rebuild(db, habit):
+    """Return the habit's stats row, building it from history the first time."""
+    stats = db.get(HabitStats, habit.id)
+    if stats is None:
+        stats = rebuild_habit(db, habit)
+    return stats
+
+
+def habit_completions_query(habit_id):
+    return (
+        select(HabitCompletion.completed_at)
+        .where(HabitCompletion.habit_id == habit_id)
+        .order_by(HabitCompletion.completed_at)
+    )
+
+
+def _ensure_stats_row(db, habit_id):
+    """The habit's stats row, inserted if missing; concurrent callers don't conflict."""
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        stats = db.get(HabitStats, habit_id)
+        if stats is None:
+            stats = HabitStats(habit_id=habit_id)
+            db.add(stats)
+            db.flush([stats])
+        return stats
+
+    db.execute(
+        insert(HabitStats).values(habit_id=habit_id).on_conflict_do_nothing(index_elements=["habit_id"])
+    )
+    return db.get(HabitStats, habit_id)
+
+
+def archived_times(db, user_ids):
+    """Archived completion times of the users' habits (see ``src.archive``)."""
+    # Imported here: src.archive builds on this module
+    from . import archive
+    return archive.completion_times(db, user_ids)
+
+
+def rebuild_habit(db, habit, archived=None):
+    """Recompute the habit's counters from its completions, archived ones included.
+
+    ``archived`` holds the habit's archived completion times when the caller
+    has loaded them already.
+    """
+    stats = _ensure_stats_row(db, habit.id)
+    stats.day_buckets = _encode([0] * WINDOW_DAYS)
+    stats.window_end = None
+    stats.last_completed_day = None
+    habit.streak = 0
+    habit.success_rate = 0.0
+    habit.last_completed = None
+
+    if archived is None and db.get(ArchivedCompletionCount, habit.id) is not None:
+        archived = archived_times(db, [habit.user_id]).get(habit.id)
+    history = db.execute(habit_completions_query(habit.id)).scalars()
+    for completed_at in heapq.merge(archived or (), history):
+        apply_completion(habit, stats, completed_at)
+    return stats
+
+
+def rebuild(db, habit_ids=None, batch_size=500):
+    """Recompute counters for the given habits (all habits by default)."""
+    if habit_ids is None:
+        habit_ids = db.execute(select(Habit.id).order_by(Habit.id)).scalars().all()
+
+    rebuilt = 0
+    for start in range(0, len(habit_ids), batch_size):
+        batch = habit_ids[start:start + batch_size]
+        # Hold off completion writers until this batch commits
+        begin_write(db)
+        habits = db.execute(
+            select(Habit).where(Habit.id.in_(batch)).order_by(Habit.id).with_for_update()
+        ).scalars().all()
+        with_archive = set(db.execute(
+            select(ArchivedCompletionCount.habit_id).where(ArchivedCompletionCount.habit_id.in_(batch))
+        ).scalars())
+        archived = archived_times(db, {habit.user_id for habit in habits if habit.id in with_archive})
+        for habit in habits:
+            rebuild_habit(db, habit, archived.get(habit.id, ()))
+            rebuilt += 1
+        db.commit()
+    return rebuilt
+
+
+def expire(db, today=None, batch_size=500):
+    """Advance every habit whose window ends before ``today`` (UTC); returns how many changed."""
+    today = today or datetime.utcnow().date()
+    expired = 0
+    last_id = ""
+    while True:
+        habit_ids = db.execute(
+            select(HabitStats.habit_id)
+            .where(HabitStats.window_end < today, HabitStats.habit_id > last_id)
+            .order_by(HabitStats.habit_id)
+            .limit(batch_size)
+        ).scalars().all()
+        if not habit_ids:
+            return expired
+        last_id = habit_ids[-1]
+        # Hold off completion writers until this batch commits
+        begin_write(db)
+        habits = db.execute(
+            select(Habit).where(Habit.id.in_(habit_ids)).order_by(Habit.id).with_for_update()
+        ).scalars().all()
+        rows = {
+            row.habit_id: row
+            for row in db.execute(select(HabitStats).where(HabitStats.habit_id.in_(habit_ids))).scalars()
+        }
+        for habit in habits:
+            advance(habit, rows[habit.id], today)
+        db.commit()
+        expired += len(habits)
+        for habit in habits:
+            records.invalidate_habit(habit.id, habit.user_id)
+        for user_id in {habit.user_id for habit in habits}:
+            analytics.invalidate_user(user_id)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Habit statistics maintenance")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = subcommands.add_parser(
+        "rebuild", help="Recompute rolling-window counters from completions, archived ones included"
+    )
+    rebuild_parser.add_argument("--habit-id", action="append", dest="habit_ids")
+    subcommands.add_parser(
+        "expire", help="Slide idle habits' windows to today and end streaks that missed a day"
+    )
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        if args.command == "expire":
+            print(f"Advanced stats for {expire(db)} idle habits")
+        else:
+            print(f"Rebuilt stats for {rebuild(db, habit_ids=args.habit_ids)} habits")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
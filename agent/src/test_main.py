@@ -1,14 +1,50 @@
+import asyncio
+import csv
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import httpx
 import pytest
+
+# Point the agent at a throwaway database before its modules are imported
+os.environ.setdefault(
+    "DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'habits.db')}"
+)
+
 from fastapi.testclient import TestClient
-from src.main import app
-from src.models.database import get_db, Base, engine
+from prometheus_client import CollectorRegistry, REGISTRY
+from src.main import app, stream_events
+from src.ingest import apply_completions, completion_writer
+from src.models.database import (
+    build_engine, get_db, init_db, engine, Habit, HabitCompletion as HabitCompletionRow, ReminderChange,
+    SessionLocal, User
+)
+from src.models.habit import HabitCompletion as HabitCompletionModel
+from src import (
+    analytics, archive, cohort, events, export, listing, loadgen, motivation, recommendations, recompute,
+    reminders, rollups, seed, stats
+)
+from src.models.migrations import MIGRATIONS, migrate
+from src.batching import BatchQueue
+from src.cache import MemoryBackend, ReadThroughCache, TTLCache
+from src.health import TableCounts
+from src.metrics import HabitStatsCollector
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+import numpy as np
 import uuid
-from datetime import datetime, time
+from datetime import date, datetime, time, timedelta, timezone
+from time import perf_counter, sleep
 
 @pytest.fixture
 def test_db():
-    Base.metadata.create_all(bind=engine)
+    init_db()
     db = Session(engine)
     try:
         yield db
@@ -25,7 +61,8 @@ def client(test_db):
             test_db.close()
     
     app.dependency_overrides[get_db] = override_get_db
-    return TestClient(app)
+    yield TestClient(app)
+    app.dependency_overrides.pop(get_db, None)
 
 def test_create_user(client):
     user_id = str(uuid.uuid4())
@@ -74,4 +111,1197 @@ def test_get_analytics_empty(client):
     assert data["total_habits"] == 0
     assert data["average_success_rate"] == 0.0
     assert data["total_streaks"] == 0
-    assert data["habits_by_category"] == {} 
\ No newline at end of file
+    assert data["habits_by_category"] == {}
+
+def _create_user_and_habit(client, created_at="2024-04-01T08:00:00"):
+    user_id = str(uuid.uuid4())
+    habit_id = str(uuid.uuid4())
+    client.post("/users/", json={
+        "id": user_id,
+        "name": "Test User",
+        "habits": [],
+        "preferred_notification_time": "09:00:00",
+        "timezone": "UTC",
+        "created_at": created_at
+    })
+    client.post(f"/habits/?user_id={user_id}", json={
+        "id": habit_id,
+        "name": "Test Habit",
+        "description": "A test habit",
+        "frequency": "daily",
+        "target_time": "09:00:00",
+        "created_at": created_at,
+        "difficulty": 3,
+        "category": "health"
+    })
+    return user_id, habit_id
+
+def _complete(client, habit_id, completed_at):
+    response = client.post("/completions/", json={
+        "habit_id": habit_id,
+        "completed_at": completed_at,
+        "mood": 4,
+        "difficulty": 2
+    })
+    assert response.status_code == 200
+    return response
+
+def test_completion_streak_resets_on_gap(client, test_db):
+    _, habit_id = _create_user_and_habit(client)
+    for completed_at in ["2024-04-01T09:00:00", "2024-04-02T09:00:00",
+                         "2024-04-02T18:00:00", "2024-04-03T09:00:00"]:
+        _complete(client, habit_id, completed_at)
+
+    habit = test_db.get(Habit, habit_id)
+    assert habit.streak == 3
+    assert habit.success_rate == 1.0
+
+    _complete(client, habit_id, "2024-04-06T09:00:00")
+    test_db.expire_all()
+    habit = test_db.get(Habit, habit_id)
+    assert habit.streak == 1
+    assert habit.success_rate == 4 / 6
+
+def test_completion_window_expires_old_days(client, test_db):
+    _, habit_id = _create_user_and_habit(client, created_at="2024-01-01T08:00:00")
+    _complete(client, habit_id, "2024-01-01T09:00:00")
+    _complete(client, habit_id, "2024-03-01T09:00:00")
+
+    habit = test_db.get(Habit, habit_id)
+    assert habit.success_rate == 1 / 30
+
+def test_stats_rebuild_matches_incremental(client, test_db):
+    _, habit_id = _create_user_and_habit(client)
+    # Out-of-order arrival: the late completion for 04-02 fills the gap
+    for completed_at in ["2024-04-01T09:00:00", "2024-04-03T09:00:00",
+                         "2024-04-02T09:00:00"]:
+        _complete(client, habit_id, completed_at)
+    assert test_db.get(Habit, habit_id).streak == 3
+    # A second completion on an already counted day changes nothing
+    _complete(client, habit_id, "2024-04-02T18:00:00")
+    test_db.expire_all()
+    assert test_db.get(Habit, habit_id).streak == 3
+
+    assert stats.rebuild(test_db, habit_ids=[habit_id]) == 1
+    habit = test_db.get(Habit, habit_id)
+    assert habit.streak == 3
+    assert habit.success_rate == 1.0
+
+def test_stats_expire_idle_windows_and_broken_streaks(client, test_db):
+    _, habit_id = _create_user_and_habit(client)
+    for completed_at in ["2024-04-01T09:00:00", "2024-04-02T09:00:00", "2024-04-03T09:00:00"]:
+        _complete(client, habit_id, completed_at)
+
+    # The day after the last completion the streak is still alive
+    stats.expire(test_db, today=date(2024, 4, 4))
+    habit = test_db.get(Habit, habit_id)
+    assert (habit.streak, habit.success_rate) == (3, 3 / 4)
+
+    stats.expire(test_db, today=date(2024, 4, 10))
+    test_db.expire_all()
+    habit = test_db.get(Habit, habit_id)
+    assert (habit.streak, habit.success_rate) == (0, 3 / 10)
+    assert client.get(f"/habits/{habit_id}").json()["streak"] == 0
+
+    # Offline sync delivers the missing day late: the run is restored
+    _complete(client, habit_id, "2024-04-04T09:00:00")
+    test_db.expire_all()
+    assert test_db.get(Habit, habit_id).streak == 4
+
+    stats.expire(test_db, today=date(2024, 6, 1))
+    test_db.expire_all()
+    habit = test_db.get(Habit, habit_id)
+    assert (habit.streak, habit.success_rate) == (0, 0.0)
+
+def test_get_analytics_aggregates_by_category(client):
+    user_id, habit_id = _create_user_and_habit(client)
+    _complete(client, habit_id, "2024-04-01T09:00:00")
+    _complete(client, habit_id, "2024-04-02T09:00:00")
+
+    data = client.get(f"/analytics/{user_id}").json()
+    assert data["total_habits"] == 1
+    assert data["total_streaks"] == 2
+    assert data["total_completions"] == 2
+    assert data["average_success_rate"] == 100.0
+    assert data["habits_by_category"] == {"health": 1}
+    assert data["completions_by_category"] == {"health": 2}
+
+def test_get_analytics_cache_invalidated_on_write(client):
+    user_id, habit_id = _create_user_and_habit(client)
+    assert client.get(f"/analytics/{user_id}").json()["total_completions"] == 0
+
+    _complete(client, habit_id, "2024-04-01T09:00:00")
+    assert client.get(f"/analytics/{user_id}").json()["total_completions"] == 1
+
+def test_get_analytics_skips_fill_when_write_lands_mid_read(client, monkeypatch):
+    user_id, habit_id = _create_user_and_habit(client)
+    compute = analytics.compute_user_analytics
+
+    def racing_compute(db, user_id):
+        result = compute(db, user_id)
+        # A completion commits after this read's query ran
+        _complete(client, habit_id, "2024-04-01T09:00:00")
+        return result
+
+    monkeypatch.setattr(analytics, "compute_user_analytics", racing_compute)
+    assert client.get(f"/analytics/{user_id}").json()["total_completions"] == 0
+    monkeypatch.setattr(analytics, "compute_user_analytics", compute)
+    assert client.get(f"/analytics/{user_id}").json()["total_completions"] == 1
+
+def test_record_completions_batch_reports_per_item(client, test_db):
+    _, habit_id = _create_user_and_habit(client)
+    response = client.post("/completions/batch", json=[
+        {"habit_id": habit_id, "completed_at": "2024-04-02T09:00:00", "mood": 3},
+        {"habit_id": "missing-habit", "completed_at": "2024-04-02T09:00:00"},
+        {"habit_id": habit_id, "completed_at": "2024-04-01T09:00:00", "mood": 5},
+    ])
+    assert response.status_code == 200
+    data = response.json()
+    assert data["accepted"] == 2
+    assert data["failed"] == 1
+    assert [r["status"] for r in data["results"]] == [200, 404, 200]
+    assert data["results"][1]["detail"] == "Habit not found"
+
+    habit = test_db.get(Habit, habit_id)
+    assert habit.streak == 2
+
+def test_record_completions_batch_reports_failed_writer_groups(client, test_db, monkeypatch):
+    _, habit_id = _create_user_and_habit(client)
+    handler = completion_writer.handler
+    calls = []
+
+    def flaky_handler(items):
+        calls.append(len(items))
+        if len(calls) == 2:
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+        return handler(items)
+
+    monkeypatch.setattr(completion_writer, "max_batch_size", 2)
+    monkeypatch.setattr(completion_writer, "handler", flaky_handler)
+    response = client.post("/completions/batch", json=[
+        {"habit_id": habit_id, "completed_at": f"2024-04-{day:02d}T09:00:00"} for day in range(1, 7)
+    ])
+    assert response.status_code == 200
+    data = response.json()
+    assert calls == [2, 2, 2]
+    assert [r["status"] for r in data["results"]] == [200, 200, 503, 503, 200, 200]
+    assert data["accepted"] == 4
+    committed = test_db.query(HabitCompletionRow).filter(HabitCompletionRow.habit_id == habit_id).count()
+    assert committed == data["accepted"]
+
+def test_concurrent_single_and_batch_completions_keep_stats_whole(client, test_db):
+    _, habit_id = _create_user_and_habit(client)
+    days = [{"habit_id": habit_id, "completed_at": f"2024-04-{day:02d}T09:00:00"} for day in range(1, 11)]
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://agent") as http:
+            return await asyncio.gather(
+                *(http.post("/completions/", json=day) for day in days * 5),
+                *(http.post("/completions/batch", json=days) for _ in range(5)),
+            )
+
+    assert all(response.status_code == 200 for response in asyncio.run(run()))
+    habit_stats = test_db.get(stats.HabitStats, habit_id)
+    assert sum(stats._decode(habit_stats.day_buckets)) == 100
+    assert test_db.get(Habit, habit_id).streak == 10
+
+def test_completion_writers_in_separate_processes_serialize_on_stats(client, test_db):
+    # Each gunicorn worker has its own completion writer; two sessions on
+    # separate connections stand in for them
+    _, habit_id = _create_user_and_habit(client)
+    days = [
+        HabitCompletionModel(habit_id=habit_id, completed_at=f"2024-04-{day:02d}T09:00:00")
+        for day in range(1, 11)
+    ]
+
+    def writer():
+        with Session(engine) as db:
+            for _ in range(10):
+                apply_completions(db, days)
+
+    threads = [threading.Thread(target=writer) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    habit_stats = test_db.get(stats.HabitStats, habit_id)
+    assert sum(stats._decode(habit_stats.day_buckets)) == 200
+    assert test_db.get(Habit, habit_id).streak == 10
+
+def test_record_completion_unknown_habit(client):
+    response = client.post("/completions/", json={
+        "habit_id": "missing-habit",
+        "completed_at": "2024-04-02T09:00:00"
+    })
+    assert response.status_code == 404
+
+def test_batch_queue_coalesces_submissions():
+    batches = []
+
+    def handler(items):
+        batches.append(list(items))
+        return [ValueError(item) if item < 0 else item * 2 for item in items]
+
+    batch_queue = BatchQueue(handler, max_batch_size=100, max_delay=0.05)
+    futures = [batch_queue.submit(item) for item in [1, 2, -1, 3]]
+
+    assert [f.result(timeout=5) for f in futures if f.exception(timeout=5) is None] == [2, 4, 6]
+    assert isinstance(futures[2].exception(), ValueError)
+    assert len(batches) == 1
+
+def _query_plan(statement):
+    compiled = statement.compile(engine, compile_kwargs={"literal_binds": True})
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}").all()
+    return [row[-1] for row in rows]
+
+@pytest.mark.parametrize("statement", [
+    analytics.user_analytics_query("some-user"),
+    stats.habit_completions_query("some-habit"),
+    rollups.timeseries_query("some-user", "day", start=date(2024, 1, 1)),
+    rollups.timeseries_query("some-user", "week", start=date(2024, 1, 1), by_category=True),
+])
+def test_hot_queries_use_indexes(test_db, statement):
+    plan = _query_plan(statement)
+    full_scans = [step for step in plan if step.startswith("SCAN") and "INDEX" not in step]
+    assert full_scans == [], plan
+    assert any("USING" in step and "INDEX" in step for step in plan), plan
+
+def test_migrations_add_missing_indexes():
+    old_engine = create_engine("sqlite://")
+    init_db(old_engine)
+    with old_engine.begin() as connection:
+        connection.exec_driver_sql("DROP INDEX ix_habit_completions_habit_completed")
+        connection.exec_driver_sql("DELETE FROM schema_migrations")
+
+    assert migrate(old_engine) == [version for version, _, _ in MIGRATIONS]
+    assert migrate(old_engine) == []
+    index_names = {index["name"] for index in inspect(old_engine).get_indexes("habit_completions")}
+    assert "ix_habit_completions_habit_completed" in index_names
+
+def test_slow_db_request_does_not_block_event_loop(monkeypatch):
+    def slow_analytics(db, user_id):
+        sleep(0.5)
+        return b"{}"
+
+    monkeypatch.setattr(analytics, "get_user_analytics_json", slow_analytics)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://agent") as http:
+            started = perf_counter()
+            slow = asyncio.create_task(http.get("/analytics/slow-user"))
+            await asyncio.sleep(0.05)
+            responses = await asyncio.gather(*(http.get("/") for _ in range(5)))
+            fast_elapsed = perf_counter() - started
+            await slow
+        return responses, fast_elapsed
+
+    responses, fast_elapsed = asyncio.run(run())
+    assert all(response.status_code == 200 for response in responses)
+    assert fast_elapsed < 0.25
+
+def test_liveness_and_readiness(client):
+    assert client.get("/health/live").json() == {"status": "alive"}
+    assert client.get("/health/ready").json() == {"status": "ready"}
+
+def test_health_counts_are_cached_until_stale(client):
+    now = [1000.0]
+    counts = TableCounts(max_age=30, clock=lambda: now[0])
+    before = counts.snapshot()
+    assert before["counts_age_seconds"] == 0
+
+    _create_user_and_habit(client)
+    now[0] += 10
+    cached = counts.snapshot()
+    assert cached["users_count"] == before["users_count"]
+    assert cached["counts_age_seconds"] == 10
+
+    now[0] += 30
+    refreshed = counts.snapshot()
+    assert refreshed["users_count"] == before["users_count"] + 1
+    assert refreshed["habits_count"] == before["habits_count"] + 1
+    assert refreshed["counts_age_seconds"] == 0
+
+def test_health_serves_last_counts_when_refresh_fails(client, monkeypatch):
+    now = [1000.0]
+    counts = TableCounts(max_age=30, clock=lambda: now[0])
+    before = counts.snapshot()
+    assert before["stale"] is False
+
+    def unavailable():
+        raise OperationalError("SELECT count(*)", {}, Exception("database is locked"))
+
+    monkeypatch.setattr(counts, "session_factory", unavailable)
+    now[0] += 45
+    degraded = counts.snapshot()
+    assert degraded["stale"] is True
+    assert degraded["users_count"] == before["users_count"]
+    assert degraded["counts_age_seconds"] == 45
+
+    monkeypatch.setattr("src.main.table_counts", counts)
+    response = client.get("/health")
+    assert response.status_code == 200
+    assert response.json()["status"] == "degraded"
+
+    assert TableCounts(session_factory=unavailable).snapshot() == {
+        "stale": True, "counts_as_of": None, "counts_age_seconds": None
+    }
+
+def test_metrics_middleware_labels_route_templates(client):
+    _, habit_id = _create_user_and_habit(client)
+    route = {"route": "/habits/{habit_id}"}
+    duration_labels = {**route, "method": "GET", "status": "200"}
+    requests_before = REGISTRY.get_sample_value(
+        "agent_http_request_duration_seconds_count", duration_labels) or 0
+    queries_before = REGISTRY.get_sample_value("agent_db_queries_per_request_sum", route) or 0
+
+    assert client.get(f"/habits/{habit_id}").status_code == 200
+    assert client.get("/habits/missing-habit").status_code == 404
+
+    assert REGISTRY.get_sample_value(
+        "agent_http_request_duration_seconds_count", duration_labels) == requests_before + 1
+    assert REGISTRY.get_sample_value(
+        "agent_http_request_duration_seconds_count", {**route, "method": "GET", "status": "404"}) >= 1
+    assert REGISTRY.get_sample_value("agent_db_queries_per_request_sum", route) >= queries_before + 2
+    assert REGISTRY.get_sample_value("agent_http_requests_in_flight") == 0
+
+def test_metrics_credit_completion_writer_queries_to_requests(client):
+    _, habit_id = _create_user_and_habit(client)
+    single, batch = {"route": "/completions/"}, {"route": "/completions/batch"}
+    single_before = REGISTRY.get_sample_value("agent_db_queries_per_request_sum", single) or 0
+    batch_before = REGISTRY.get_sample_value("agent_db_queries_per_request_sum", batch) or 0
+
+    _complete(client, habit_id, "2024-04-01T09:00:00")
+    assert client.post("/completions/batch", json=[
+        {"habit_id": habit_id, "completed_at": "2024-04-02T09:00:00"}
+    ]).status_code == 200
+
+    assert REGISTRY.get_sample_value("agent_db_queries_per_request_sum", single) > single_before
+    assert REGISTRY.get_sample_value("agent_db_queries_per_request_sum", batch) > batch_before
+    assert REGISTRY.get_sample_value("agent_db_time_per_request_seconds_sum", single) > 0
+
+def test_habit_gauges_come_from_database(client):
+    now = [1000.0]
+    counts = TableCounts(max_age=30, clock=lambda: now[0])
+    registry = CollectorRegistry()
+    registry.register(HabitStatsCollector(counts))
+    counts.snapshot()
+    active_before = registry.get_sample_value("active_habits_total")
+
+    _, habit_id = _create_user_and_habit(client)
+    _complete(client, habit_id, "2024-04-01T09:00:00")
+    now[0] += 30
+
+    # The scrape that finds the counts due refreshes them in the background
+    registry.get_sample_value("active_habits_total")
+    counts._refresher.join(timeout=5)
+    assert registry.get_sample_value("active_habits_total") == active_before + 1
+    assert 0 < registry.get_sample_value("habit_completion_rate") <= 1
+
+def test_habit_gauges_never_query_on_the_scraping_thread(client):
+    refreshed_on = []
+    release = threading.Event()
+
+    def session_factory():
+        refreshed_on.append(threading.current_thread())
+        release.wait(timeout=5)
+        return SessionLocal()
+
+    counts = TableCounts(session_factory=session_factory)
+    collector = HabitStatsCollector(counts)
+    # The scrape returns while the first refresh is still waiting on the database
+    assert collector.collect() == []
+    release.set()
+    counts._refresher.join(timeout=5)
+    assert [family.name for family in collector.collect()] == ["active_habits_total", "habit_completion_rate"]
+    assert refreshed_on and threading.current_thread() not in refreshed_on
+
+def test_export_user_completions_ndjson(client):
+    user_id, habit_id = _create_user_and_habit(client)
+    for day in ["01", "02", "03"]:
+        _complete(client, habit_id, f"2024-04-{day}T09:00:00")
+
+    response = client.get(
+        f"/users/{user_id}/completions/export",
+        params={"start": "2024-04-02T00:00:00", "end": "2024-04-04T00:00:00"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["completed_at"] for row in rows] == ["2024-04-02T09:00:00", "2024-04-03T09:00:00"]
+    assert {row["user_id"] for row in rows} == {user_id}
+
+def test_export_completions_csv_spans_chunks(client):
+    user_id, habit_id = _create_user_and_habit(client)
+    for day in ["01", "02", "03"]:
+        _complete(client, habit_id, f"2024-04-{day}T09:00:00")
+
+    lines = list(export.to_csv(export.iter_completions(user_id=user_id, chunk_size=2)))
+    rows = list(csv.DictReader(io.StringIO("".join(lines))))
+    assert len(rows) == 3
+    assert rows[0]["habit_id"] == habit_id
+
+    response = client.get("/admin/completions/export", params={"format": "csv"})
+    assert response.status_code == 200
+    assert response.text.startswith(",".join(export.EXPORT_COLUMNS))
+
+def test_list_habit_completions_keyset_pages(client):
+    _, habit_id = _create_user_and_habit(client)
+    completed = ["2024-04-01T09:00:00", "2024-04-02T09:00:00", "2024-04-02T09:00:00",
+                 "2024-04-03T09:00:00", "2024-04-04T09:00:00"]
+    client.post("/completions/batch", json=[
+        {"habit_id": habit_id, "completed_at": completed_at} for completed_at in completed
+    ])
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 2, "fields": "completed_at"}
+        if cursor:
+            params["cursor"] = cursor
+        page = client.get(f"/habits/{habit_id}/completions", params=params).json()
+        seen.extend(item["completed_at"] for item in page["items"])
+        assert all(set(item) == {"completed_at"} for item in page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == sorted(completed, reverse=True)
+
+    filtered = client.get(f"/habits/{habit_id}/completions", params={
+        "start": "2024-04-02T00:00:00", "end": "2024-04-03T00:00:00"
+    }).json()
+    assert len(filtered["items"]) == 2
+    assert filtered["next_cursor"] is None
+
+def test_list_user_habits_filters_and_projection(client):
+    user_id, habit_id = _create_user_and_habit(client)
+    client.post(f"/habits/?user_id={user_id}", json={
+        "id": str(uuid.uuid4()),
+        "name": "Read",
+        "description": "Read a chapter",
+        "frequency": "daily",
+        "created_at": "2024-04-01T08:00:00",
+        "difficulty": 2,
+        "category": "learning"
+    })
+
+    first = client.get(f"/users/{user_id}/habits", params={"limit": 1}).json()
+    second = client.get(f"/users/{user_id}/habits", params={"limit": 1, "cursor": first["next_cursor"]}).json()
+    assert second["next_cursor"] is None
+    assert {first["items"][0]["name"], second["items"][0]["name"]} == {"Test Habit", "Read"}
+
+    health = client.get(f"/users/{user_id}/habits", params={
+        "category": "health", "is_active": True, "fields": "id,streak"
+    }).json()
+    assert health["items"] == [{"id": habit_id, "streak": 0}]
+
+    assert client.get(f"/users/{user_id}/habits", params={"fields": "password"}).status_code == 400
+    assert client.get(f"/users/{user_id}/habits", params={"cursor": "not-a-cursor"}).status_code == 400
+    assert client.get("/users/missing-user/habits").status_code == 404
+
+def test_deep_page_queries_seek_by_index(test_db):
+    completions = listing.completions_page_query(
+        "some-habit", ["completed_at", "id"], 50, after=("2024-04-01T09:00:00", 1000)
+    )
+    habits = listing.habits_page_query("some-user", ["id", "name"], 50, after_id="habit-500")
+    for statement in (completions, habits):
+        plan = _query_plan(statement)
+        assert all(step.startswith("SEARCH") for step in plan), plan
+
+def test_timeseries_served_from_rollups(client, test_db):
+    user_id, habit_id = _create_user_and_habit(client)
+    client.post("/completions/batch", json=[
+        {"habit_id": habit_id, "completed_at": "2024-04-01T09:00:00", "mood": 4, "difficulty": 2},
+        {"habit_id": habit_id, "completed_at": "2024-04-01T19:00:00", "mood": 2},
+        {"habit_id": habit_id, "completed_at": "2024-04-08T09:00:00", "mood": 5, "difficulty": 3},
+    ])
+    _complete(client, habit_id, "2024-04-09T09:00:00")
+
+    daily = client.get(f"/analytics/{user_id}/timeseries", params={"start": "2024-04-01"}).json()
+    assert daily["series"] == [
+        {"period": "2024-04-01", "completions": 2, "average_mood": 3.0, "average_difficulty": 2.0},
+        {"period": "2024-04-08", "completions": 1, "average_mood": 5.0, "average_difficulty": 3.0},
+        {"period": "2024-04-09", "completions": 1, "average_mood": 4.0, "average_difficulty": 2.0},
+    ]
+
+    weekly = client.get(f"/analytics/{user_id}/timeseries", params={
+        "granularity": "week", "by_category": True
+    }).json()
+    assert [(p["period"], p["category"], p["completions"]) for p in weekly["series"]] == [
+        ("2024-04-01", "health", 2), ("2024-04-08", "health", 2)
+    ]
+
+    # Backfill reproduces the incrementally maintained rollups
+    assert rollups.backfill(test_db, habit_ids=[habit_id]) == 1
+    assert client.get(f"/analytics/{user_id}/timeseries", params={"start": "2024-04-01"}).json() == daily
+
+def test_streak_runs_split_on_gaps_and_habits():
+    habits = np.array([0, 0, 0, 0, 1, 1])
+    days = np.array([1, 2, 3, 5, 3, 4])
+    run_habits, run_last_days, run_lengths = cohort.streak_runs(habits, days)
+    assert run_habits.tolist() == [0, 0, 1]
+    assert run_last_days.tolist() == [3, 5, 4]
+    assert run_lengths.tolist() == [3, 1, 2]
+
+def test_cohort_analytics_population_stats():
+    population = create_engine("sqlite://", poolclass=StaticPool)
+    init_db(population)
+    db = Session(population)
+    db.add_all([
+        User(id="alice", name="Alice"), User(id="bob", name="Bob"),
+        Habit(id="run", user_id="alice", category="health", created_at=datetime(2024, 4, 1)),
+        Habit(id="read", user_id="bob", category="learning", created_at=datetime(2024, 4, 1)),
+    ])
+    db.commit()
+    apply_completions(db, [
+        HabitCompletionModel(habit_id="run", completed_at=f"2024-04-0{day}T09:00:00",
+                             mood=mood, difficulty=6 - mood)
+        for day, mood in [(1, 1), (2, 2), (3, 3), (9, 4)]
+    ] + [
+        HabitCompletionModel(habit_id="read", completed_at="2024-04-01T20:00:00", mood=3),
+    ])
+    db.close()
+
+    report = cohort.compute_cohort_analytics(population, max_weeks=2, as_of=date(2024, 4, 10))
+    assert report["users"] == 2
+    assert report["streaks"]["habits"]["longest"]["max"] == 3
+    assert report["streaks"]["habits"]["current"]["count"] == 1
+    assert report["streaks"]["by_category"]["learning"]["max"] == 1
+    # Both users start in the week of 2024-04-01; only alice returns a week later
+    assert report["retention"]["retention"][:2] == [1.0, 0.5]
+    assert report["retention"]["cohort_sizes"] == {"2024-04-01": 2}
+    assert report["mood_difficulty_correlation"]["by_category"]["health"]["r"] == pytest.approx(-1.0)
+    assert report["success_rate_percentiles"]["overall"]["50"] > 0
+
+def test_cohort_cache_misses_share_one_computation(monkeypatch):
+    computed = []
+
+    def slow_compute(max_weeks):
+        computed.append(max_weeks)
+        sleep(0.1)
+        return {"max_weeks": max_weeks}
+
+    monkeypatch.setattr(cohort, "cohort_cache", TTLCache(maxsize=16, ttl=300))
+    monkeypatch.setattr(cohort, "compute_cohort_analytics", slow_compute)
+    reports = []
+    threads = [
+        threading.Thread(target=lambda: reports.append(cohort.get_cohort_analytics(max_weeks=12)))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert computed == [12]
+    assert reports == [{"max_weeks": 12}] * 4
+
+def test_parallel_recompute_restores_stats_and_resumes(client, test_db, tmp_path):
+    _, habit_id = _create_user_and_habit(client)
+    for day in ["01", "02", "03"]:
+        _complete(client, habit_id, f"2024-04-{day}T09:00:00")
+    habit = test_db.get(Habit, habit_id)
+    habit.streak = 99
+    habit.success_rate = 0.0
+    test_db.commit()
+
+    state_file = str(tmp_path / "recompute.json")
+    messages = []
+    updated = recompute.run(workers=2, shard_size=50, state_file=state_file, report=messages.append)
+    assert updated >= 1
+    test_db.expire_all()
+    habit = test_db.get(Habit, habit_id)
+    assert habit.streak == 3
+    assert habit.success_rate == 1.0
+
+    with open(state_file) as handle:
+        state = json.load(handle)
+    assert len(state["done"]) == len(state["shards"])
+    assert recompute.run(workers=1, state_file=state_file, resume=True, report=messages.append) == 0
+
+IMPORT_BUDGET_SECONDS = float(os.getenv("AGENT_IMPORT_BUDGET_SECONDS", "2.0"))
+
+def test_import_time_budget_without_heavy_dependencies():
+    probe = (
+        "import json, sys, time\n"
+        "started = time.perf_counter()\n"
+        "import src.main\n"
+        "print(json.dumps({'seconds': time.perf_counter() - started,\n"
+        "                  'modules': sorted(sys.modules)}))\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", probe], check=True, capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+
+    heavy = {"numpy", "pandas", "scipy", "sklearn", "torch", "transformers"}
+    assert heavy.isdisjoint(result["modules"])
+    assert result["seconds"] < IMPORT_BUDGET_SECONDS
+
+def test_get_user_and_habit_serialize_from_orm(client):
+    user_id, habit_id = _create_user_and_habit(client)
+    _complete(client, habit_id, "2024-04-01T09:00:00")
+
+    habit = client.get(f"/habits/{habit_id}").json()
+    assert habit["created_at"] == "2024-04-01T08:00:00"
+    assert habit["target_time"] == "09:00:00"
+    assert habit["streak"] == 1
+    assert habit["last_completed"] == "2024-04-01T09:00:00"
+
+    user = client.get(f"/users/{user_id}").json()
+    assert user["timezone"] == "UTC"
+    assert [h["id"] for h in user["habits"]] == [habit_id]
+    assert client.get("/users/missing-user").status_code == 404
+
+
+def test_habit_and_user_lookups_revalidate_with_etag(client):
+    user_id, habit_id = _create_user_and_habit(client)
+
+    first = client.get(f"/habits/{habit_id}")
+    etag = first.headers["etag"]
+    assert first.json()["streak"] == 0
+    not_modified = client.get(f"/habits/{habit_id}", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert not_modified.headers["etag"] == etag
+    user_etag = client.get(f"/users/{user_id}").headers["etag"]
+
+    _complete(client, habit_id, "2024-04-01T09:00:00")
+    changed = client.get(f"/habits/{habit_id}", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.json()["streak"] == 1
+    assert changed.headers["etag"] != etag
+    user = client.get(f"/users/{user_id}", headers={"If-None-Match": f'W/{user_etag}'})
+    assert user.status_code == 200
+    assert user.json()["habits"][0]["streak"] == 1
+
+
+def test_read_through_cache_shares_fills_and_invalidations():
+    shared = MemoryBackend()
+    loads = []
+
+    def load():
+        loads.append(1)
+        return b"value"
+
+    worker_a = ReadThroughCache(TTLCache(), shared=shared)
+    worker_b = ReadThroughCache(TTLCache(), shared=shared)
+    assert worker_a.get_or_load("habit:1", load) == b"value"
+    assert worker_b.get_or_load("habit:1", load) == b"value"
+    assert len(loads) == 1
+
+    worker_a.invalidate("habit:1")
+
+    # A write landing mid-load must not let the stale read fill the cache
+    def racing_load():
+        worker_a.invalidate("habit:1")
+        return b"stale"
+
+    assert worker_a.get_or_load("habit:1", racing_load) == b"stale"
+    assert worker_a.get_or_load("habit:1", load) == b"value"
+    assert worker_a.get_or_load("missing", lambda: None) is None
+    assert len(worker_a.local) == 1
+
+def test_read_through_cache_drops_fills_racing_another_workers_invalidation():
+    shared = MemoryBackend()
+    worker_a = ReadThroughCache(TTLCache(), shared=shared)
+    worker_b = ReadThroughCache(TTLCache(), shared=shared)
+
+    def racing_load():
+        # Worker B commits a write and invalidates while A is still loading
+        worker_b.invalidate("habit:1")
+        return b"stale"
+
+    assert worker_a.get_or_load("habit:1", racing_load) == b"stale"
+    worker_c = ReadThroughCache(TTLCache(), shared=shared)
+    assert worker_c.get_or_load("habit:1", lambda: b"fresh") == b"fresh"
+    assert worker_b.get_or_load("habit:1", lambda: b"other") == b"fresh"
+
+
+def test_read_through_cache_survives_shared_backend_errors():
+    class DownBackend:
+        def get(self, *args):
+            raise ConnectionError("cache down")
+
+        set = delete = get
+
+    cache = ReadThroughCache(TTLCache(), shared=DownBackend())
+    assert cache.get_or_load("user:1", lambda: b"profile") == b"profile"
+    assert cache.get_or_load("user:1", lambda: b"other") == b"profile"
+    cache.invalidate("user:1")
+
+
+def test_load_generator_drives_open_loop_mix(test_db):
+    # Uses the real per-request sessions: the shared test session isn't thread-safe
+    config = loadgen.LoadConfig(
+        rate=200, concurrency=20, duration=0.5, users=2, habits_per_user=2, seed=7,
+        mix={"get_habit": 3, "complete": 2, "analytics": 1, "create_habit": 1}
+    )
+    stats = loadgen.LoadStats(window=30)
+    transport = httpx.ASGITransport(app=app)
+
+    snapshot = asyncio.run(loadgen.run_load(config, stats, base_url="http://agent", transport=transport))
+
+    assert snapshot["sent"] + snapshot["dropped"] == 100
+    assert snapshot["completed"] == snapshot["sent"]
+    assert snapshot["in_flight"] == 0
+    assert snapshot["errors"] == 0, snapshot["status_codes"]
+    assert set(snapshot["operations"]) <= set(config.mix)
+    assert set(snapshot["latency_ms"]) == {"p50", "p90", "p95", "p99"}
+    with pytest.raises(ValueError):
+        loadgen.LoadConfig(mix={"delete_everything": 1})
+
+
+def test_benchmark_gates_flag_regressions_and_growth():
+    from benchmarks.endpoints import check_growth, compare
+
+    def scenario(p50, p95, rps):
+        return {"record_completion": {"p50_ms": p50, "p95_ms": p95, "rps": rps}}
+
+    baseline = {"1k": {"inprocess": scenario(2.0, 4.0, 500.0)}}
+    steady = {"1k": {"inprocess": scenario(2.1, 4.4, 480.0)}}
+    slower = {"1k": {"inprocess": scenario(3.0, 6.0, 300.0)}}
+    assert compare(steady, baseline, tolerance=0.25) == []
+    assert len(compare(slower, baseline, tolerance=0.25)) == 2
+
+    flat = {**steady, "100k": {"inprocess": scenario(2.5, 5.0, 450.0)}}
+    linear = {**steady, "100k": {"inprocess": scenario(90.0, 120.0, 11.0)}}
+    assert check_growth(flat, max_growth=3.0) == []
+    assert check_growth(linear, max_growth=3.0) == [
+        "inprocess/record_completion: p50 2.1ms at 1k -> 90.0ms at 100k (42.9x)"
+    ]
+
+
+def test_seed_generates_deterministic_consistent_dataset():
+    def generated(seed_value):
+        bind = create_engine("sqlite://", poolclass=StaticPool,
+                             connect_args={"check_same_thread": False})
+        counts = seed.generate(bind, users=20, days=45, as_of=date(2024, 6, 1),
+                               seed=seed_value, report=lambda message: None)
+        with bind.connect() as connection:
+            rows = connection.execute(text(
+                "SELECT habit_id, completed_at, mood, difficulty FROM habit_completions "
+                "ORDER BY habit_id, completed_at"
+            )).all()
+        return bind, counts, rows
+
+    bind, (users, habits, completions), rows = generated(3)
+    assert (users, completions) == (20, len(rows)) and habits >= 20
+    assert generated(3)[2] == rows
+    assert generated(4)[2] != rows
+    assert all(row.completed_at < "2024-06-01" for row in rows)
+    assert {row.mood for row in rows} <= {None, 1, 2, 3, 4, 5}
+
+    def rollup_totals(connection):
+        return connection.execute(text(
+            "SELECT habit_id, week_start, completions, mood_sum, mood_count, difficulty_sum "
+            "FROM completion_weekly_rollups ORDER BY habit_id, week_start"
+        )).all()
+
+    with bind.connect() as connection:
+        generated_rollups = rollup_totals(connection)
+    with Session(bind) as db:
+        rollups.backfill(db)
+    with bind.connect() as connection:
+        assert rollup_totals(connection) == generated_rollups
+
+
+class _CountingModel:
+    """Stand-in for the transformer: one slow call per batch."""
+
+    def __init__(self, error=None):
+        self.batches = []
+        self.error = error
+
+    def generate(self, prompts):
+        if self.error:
+            raise self.error
+        sleep(0.05)
+        self.batches.append(list(prompts))
+        return [f"Keep going! ({len(prompt)})" for prompt in prompts]
+
+
+def test_motivation_requests_are_batched_and_cached(test_db):
+    model = _CountingModel()
+    service = motivation.MotivationService(model, max_batch_size=64, max_delay=0.02)
+    app.dependency_overrides[motivation.get_motivation_service] = lambda: service
+    habit_ids = []
+    with TestClient(app) as setup:
+        for _ in range(4):
+            _, habit_id = _create_user_and_habit(setup)
+            habit_ids.append(habit_id)
+        _complete(setup, habit_ids[0], "2024-04-01T09:00:00")
+
+    async def burst():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://agent") as client:
+            return await asyncio.gather(*(
+                client.get(f"/habits/{habit_ids[index % 4]}/motivation") for index in range(32)
+            ))
+
+    try:
+        responses = asyncio.run(burst())
+        assert {response.status_code for response in responses} == {200}
+        # 32 concurrent requests, but only two distinct prompts (three habits are
+        # identical): each prompt is generated once, in one or two forward passes
+        generated = [prompt for batch in model.batches for prompt in batch]
+        assert len(generated) == len(set(generated)) == 2
+        assert len(model.batches) <= 2
+
+        batches = len(model.batches)
+        again = asyncio.run(burst())
+        assert [response.json() for response in again] == [response.json() for response in responses]
+        assert len(model.batches) == batches
+    finally:
+        app.dependency_overrides.pop(motivation.get_motivation_service, None)
+
+
+def test_motivation_prompt_and_unavailable_model(client, test_db):
+    user_id, habit_id = _create_user_and_habit(client)
+    _complete(client, habit_id, "2024-04-01T09:00:00")
+    prompt = motivation.habit_prompt(test_db, habit_id)
+    assert '"Test Habit" (health)' in prompt
+    assert "1-day streak" in prompt
+    assert motivation.habit_prompt(test_db, "missing") is None
+
+    broken = motivation.MotivationService(
+        _CountingModel(error=motivation.ModelUnavailable("torch and transformers are not installed"))
+    )
+    app.dependency_overrides[motivation.get_motivation_service] = lambda: broken
+    response = client.get(f"/habits/{habit_id}/motivation")
+    assert response.status_code == 503
+    assert client.get("/habits/missing/motivation").status_code == 404
+    app.dependency_overrides.pop(motivation.get_motivation_service, None)
+
+
+def test_motivation_releases_db_connection_before_generating(client):
+    _, habit_id = _create_user_and_habit(client)
+    in_use = []
+
+    class ProbeModel(_CountingModel):
+        def generate(self, prompts):
+            in_use.append(engine.pool.checkedout())
+            return super().generate(prompts)
+
+    service = motivation.MotivationService(ProbeModel())
+    app.dependency_overrides[motivation.get_motivation_service] = lambda: service
+    try:
+        assert client.get(f"/habits/{habit_id}/motivation").status_code == 200
+    finally:
+        app.dependency_overrides.pop(motivation.get_motivation_service, None)
+    assert in_use == [0]
+
+
+def test_notification_time_recommendations_refresh_incrementally(client, test_db):
+    early_user, early_habit = _create_user_and_habit(client, created_at="2024-03-01T00:00:00")
+    new_york_user = str(uuid.uuid4())
+    client.post("/users/", json={
+        "id": new_york_user, "name": "NY", "habits": [], "timezone": "America/New_York",
+        "preferred_notification_time": "20:00:00", "created_at": "2024-03-01T00:00:00"
+    })
+    ny_habit = str(uuid.uuid4())
+    client.post(f"/habits/?user_id={new_york_user}", json={
+        "id": ny_habit, "name": "Run", "description": "", "frequency": "daily",
+        "target_time": "08:00:00", "created_at": "2024-03-01T00:00:00",
+        "difficulty": 2, "category": "fitness"
+    })
+    idle_user, _ = _create_user_and_habit(client, created_at="2024-03-01T00:00:00")
+    for day in range(1, 21):
+        _complete(client, early_habit, f"2024-04-{day:02d}T07:{day % 3 * 10:02d}:00")
+        # 12:30 UTC is 08:30 in New York during daylight saving time
+        _complete(client, ny_habit, f"2024-04-{day:02d}T12:30:00")
+    now = datetime(2024, 4, 25)
+
+    first = recommendations.refresh(test_db.get_bind(), full=True, now=now, report=lambda message: None)
+    early = client.get(f"/users/{early_user}/notification-time").json()
+    assert early["source"] == "user"
+    assert "06:45:00" <= early["recommended_time"] <= "07:00:00"
+    assert early["confidence"] > 0.5
+    assert client.get(f"/users/{new_york_user}/notification-time").json()["recommended_time"] == "08:15:00"
+
+    # Users without recent completions get the population's recommendation
+    idle = client.get(f"/users/{idle_user}/notification-time").json()
+    assert idle["source"] == "global" and idle["recommended_time"] is not None
+    assert client.get("/users/missing/notification-time").status_code == 404
+
+    # Only users with completions newer than the watermark are refit
+    for day in range(21, 25):
+        _complete(client, ny_habit, f"2024-04-{day:02d}T22:00:00")
+    second = recommendations.refresh(test_db.get_bind(), now=now, report=lambda message: None)
+    assert not second.full
+    assert second.users_refreshed == 1
+    assert second.completion_watermark > first.completion_watermark
+    assert second.global_density == first.global_density
+
+
+def test_reminder_scheduler_fires_in_local_time_and_survives_restart():
+    bind = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    init_db(bind)
+    with Session(bind) as db:
+        for user_id, zone, habit_active in [("tokyo", "Asia/Tokyo", True),
+                                            ("new-york", "America/New_York", True),
+                                            ("lapsed", "UTC", False), ("no-habits", "UTC", None)]:
+            db.add(User(id=user_id, name=user_id, timezone=zone, preferred_notification_time=time(9)))
+            if habit_active is not None:
+                db.add(Habit(id=f"{user_id}-habit", user_id=user_id, name="Read",
+                             is_active=habit_active))
+        db.commit()
+
+    def at(*args):
+        return datetime(*args, tzinfo=timezone.utc).timestamp()
+
+    sink = reminders.MemorySink()
+    scheduler = reminders.ReminderScheduler(sink, bind, clock=lambda: at(2024, 3, 9, 12))
+    assert scheduler.load() == 2
+    assert scheduler.scheduled("tokyo") == datetime(2024, 3, 10, 0)
+    assert scheduler.dispatch_due(at(2024, 3, 9, 13, 59)) == 0
+    assert scheduler.dispatch_due(at(2024, 3, 9, 14)) == 1
+    (reminder,) = sink.reminders
+    assert (reminder.user_id, reminder.due_at) == ("new-york", datetime(2024, 3, 9, 14))
+    assert reminder.habits == [{"id": "new-york-habit", "name": "Read"}]
+    # Daylight saving starts overnight, so 09:00 in New York is an hour earlier in UTC
+    assert scheduler.scheduled("new-york") == datetime(2024, 3, 10, 13)
+
+    # A restarted scheduler resumes after the checkpoint: nothing is resent, and
+    # a reminder that came due while it was down still goes out
+    restarted = reminders.ReminderScheduler(sink, bind, clock=lambda: at(2024, 3, 10, 0, 5))
+    assert restarted.load() == 2
+    assert restarted.scheduled("new-york") == datetime(2024, 3, 10, 13)
+    assert restarted.dispatch_due() == 1
+    assert [reminder.user_id for reminder in sink.reminders] == ["new-york", "tokyo"]
+
+    # Users are rescheduled or dropped as their habits change
+    with Session(bind) as db:
+        db.add(Habit(id="no-habits-habit", user_id="no-habits", name="Walk", is_active=True))
+        db.get(Habit, "tokyo-habit").is_active = False
+        db.commit()
+    restarted.refresh_users(["no-habits", "tokyo"])
+    assert restarted.scheduled("tokyo") is None
+    assert restarted.scheduled("no-habits") == datetime(2024, 3, 10, 9)
+
+    class FailingSink:
+        def send(self, batch):
+            raise ConnectionError("push provider down")
+
+    restarted.sink = FailingSink()
+    assert restarted.dispatch_due(at(2024, 3, 10, 9)) == 0
+    restarted.sink = sink
+    assert restarted.dispatch_due(at(2024, 3, 10, 9, 0, 10)) == 0  # backing off
+    assert restarted.dispatch_due(at(2024, 3, 10, 9) + reminders.RETRY_SECONDS) == 1
+    assert sink.reminders[-1].user_id == "no-habits"
+
+
+def test_reminder_scheduler_polls_api_changes(client, test_db):
+    def at(*args):
+        return datetime(*args, tzinfo=timezone.utc).timestamp()
+
+    scheduler = reminders.ReminderScheduler(reminders.MemorySink(), engine, clock=lambda: at(2024, 3, 9, 12))
+    scheduler.load()
+    user_id, _ = _create_user_and_habit(client)
+    assert scheduler.scheduled(user_id) is None
+
+    assert scheduler.poll_changes() == 1
+    assert scheduler.scheduled(user_id) == datetime(2024, 3, 10, 9)
+    assert test_db.query(ReminderChange).filter(ReminderChange.id <= scheduler._change_id).count() == 0
+    assert scheduler.poll_changes() == 0
+
+def test_broadcaster_replays_filters_and_skips_slow_subscribers():
+    broadcaster = events.Broadcaster(buffer_size=4, max_subscribers=2)
+    everyone = broadcaster.subscribe()
+    alice = broadcaster.subscribe(key="alice")
+    with pytest.raises(events.TooManySubscribers):
+        broadcaster.subscribe()
+
+    broadcaster.publish("completion", {"habit": "run"}, key="alice")
+    broadcaster.publish("completion", {"habit": "read"}, key="bob")
+    assert everyone.read().count(b"event: completion") == 2
+    assert alice.read() == b'id: 1\nevent: completion\ndata: {"habit":"run"}\n\n'
+    assert everyone.read() == b""
+
+    # A subscriber more than a buffer behind skips ahead and is told how much it missed
+    broadcaster.publish_many("completion", [({"n": n}, None) for n in range(6)])
+    frames = alice.read()
+    assert frames.startswith(b'id: 4\nevent: lagged\ndata: {"dropped":2}')
+    assert frames.count(b"event: completion") == 4
+
+    # Reconnecting clients resume from Last-Event-ID; unknown ids are reported as a lag
+    everyone.close()
+    resumed = broadcaster.subscribe(last_event_id=7)
+    assert resumed.read().count(b"event: completion") == 1
+    alice.close()
+    assert b"event: lagged" in broadcaster.subscribe(last_event_id=99).read()
+
+def test_filtered_subscribers_sleep_through_other_keys_events():
+    broadcaster = events.Broadcaster()
+    alice = broadcaster.subscribe(key="alice")
+
+    def publish_for_bob():
+        for _ in range(5):
+            sleep(0.02)
+            broadcaster.publish("completion", {"habit": "read"}, key="bob")
+
+    for wait in (alice.wait, lambda timeout: asyncio.run(alice.wait_async(timeout))):
+        publisher = threading.Thread(target=publish_for_bob)
+        publisher.start()
+        started = perf_counter()
+        assert wait(0.3) == b""
+        assert perf_counter() - started >= 0.25
+        publisher.join()
+
+    threading.Timer(0.05, broadcaster.publish, ("completion", {"habit": "run"}), {"key": "alice"}).start()
+    started = perf_counter()
+    assert b"event: completion" in alice.wait(5)
+    assert perf_counter() - started < 1
+
+def test_event_stream_pushes_completions(client):
+    user_id, habit_id = _create_user_and_habit(client)
+
+    async def first_frames():
+        response = await stream_events(user_id=user_id, last_event_id=None)
+        body = response.body_iterator
+        assert await body.__anext__() == events.RETRY_FRAME
+        # The completion writer publishes from its own thread
+        threading.Thread(target=_complete, args=(client, habit_id, "2024-04-02T08:00:00")).start()
+        frame = await asyncio.wait_for(body.__anext__(), 5)
+        await body.aclose()
+        return frame
+
+    subscribers = events.broadcaster.subscribers
+    frame = asyncio.run(first_frames())
+    assert b"event: completion" in frame and habit_id.encode() in frame
+    assert events.broadcaster.subscribers == subscribers
+
+def test_ui_streams_log_lines():
+    from src import ui
+
+    response = ui.app.test_client().get("/events")
+    body = iter(response.response)
+    assert next(body) == events.RETRY_FRAME
+    ui.log_message("Load set to 5 req/s")
+    frame = next(body)
+    assert b"event: log" in frame and b"Load set to 5 req/s" in frame
+    logs = ui.app.test_client().get("/logs").json
+    assert logs["last_event_id"] == ui.ui_events.last_event_id
+    response.close()
+
+
+def test_archive_moves_old_completions_to_parquet_and_keeps_reads_whole(tmp_path, monkeypatch):
+    pytest.importorskip("pyarrow")
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path))
+    bind = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    seed.generate(bind, users=12, days=200, as_of=date(2024, 6, 1), seed=5, report=lambda message: None)
+    with bind.connect() as connection:
+        user_id = connection.execute(text(
+            "SELECT habits.user_id FROM habit_completions JOIN habits ON habits.id = habit_id "
+            "WHERE completed_at < '2024-03-01' GROUP BY habits.user_id ORDER BY COUNT(*) DESC LIMIT 1"
+        )).scalar()
+
+    def snapshot():
+        with Session(bind) as db:
+            weekly = db.execute(text(
+                "SELECT habit_id, week_start, completions, mood_sum FROM completion_weekly_rollups "
+                "ORDER BY habit_id, week_start"
+            )).all()
+            totals = analytics.compute_user_analytics(db, user_id)
+        rows = sorted(
+            export.iter_completions(session_factory=lambda: Session(bind)), key=lambda row: row.id
+        )
+        mine = export.iter_completions(
+            user_id=user_id, start=datetime(2024, 1, 1), end=datetime(2024, 3, 1),
+            session_factory=lambda: Session(bind)
+        )
+        return {
+            "rows": [tuple(row._asdict().values()) for row in rows],
+            "mine": sorted(row.id for row in mine),
+            "weekly": weekly,
+            "totals": totals,
+            "cohort": cohort.compute_cohort_analytics(bind, as_of=date(2024, 6, 1)),
+        }
+
+    before = snapshot()
+    assert before["mine"] and before["totals"]["total_completions"]
+    written = archive.run(bind, horizon_days=90, now=datetime(2024, 6, 1), report=lambda message: None)
+    cutoff = archive.archive_cutoff(datetime(2024, 6, 1), 90)
+    assert cutoff == datetime(2024, 2, 26) and cutoff.weekday() == 0
+    assert [file.month for file in written] == [date(2023, 11, 1), date(2023, 12, 1),
+                                                 date(2024, 1, 1), date(2024, 2, 1)]
+    with bind.connect() as connection:
+        assert connection.execute(text(
+            "SELECT COUNT(*) FROM habit_completions WHERE completed_at < :cutoff"
+        ), {"cutoff": cutoff}).scalar() == 0
+        hot = connection.execute(text("SELECT COUNT(*) FROM habit_completions")).scalar()
+    assert sum(file.rows for file in written) + hot == len(before["rows"])
+    assert all((tmp_path / file.path).exists() for file in written)
+
+    # Exports, analytics totals, rollups and cohort statistics still see everything
+    with Session(bind) as db:
+        rollups.backfill(db)
+    assert snapshot() == before
+    assert archive.run(bind, horizon_days=90, now=datetime(2024, 6, 1)) == []
+    with pytest.raises(ValueError):
+        archive.run(bind, horizon_days=7)
+
+
+def test_stats_rebuilds_fold_in_archived_completions(tmp_path, monkeypatch):
+    pytest.importorskip("pyarrow")
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    bind = build_engine(f"sqlite:///{tmp_path / 'habits.db'}")
+    init_db(bind)
+    user_id = str(uuid.uuid4())
+    start = datetime(2023, 1, 1, 9)
+    with Session(bind) as db:
+        db.add(User(id=user_id, name="Archived", timezone="UTC"))
+        # A 500-day streak up to 2024-05-14, and a habit whose every completion is archived
+        db.add(Habit(id="long-streak", user_id=user_id, name="Read", created_at=start))
+        db.add(Habit(id="all-archived", user_id=user_id, name="Run", created_at=start))
+        db.commit()
+        completions = [
+            HabitCompletionModel(habit_id="long-streak", completed_at=start + timedelta(days=day))
+            for day in range(500)
+        ] + [
+            HabitCompletionModel(habit_id="all-archived", completed_at=start + timedelta(days=day))
+            for day in range(60, 70)
+        ]
+        apply_completions(db, completions)
+
+    def counters():
+        with Session(bind) as db:
+            return {
+                habit.id: (habit.streak, habit.success_rate, habit.last_completed)
+                for habit in db.query(Habit).filter(Habit.user_id == user_id)
+            }
+
+    expected = counters()
+    assert expected["long-streak"] == (500, 1.0, datetime(2024, 5, 14, 9))
+    assert expected["all-archived"][::2] == (10, datetime(2023, 3, 11, 9))
+
+    written = archive.run(bind, horizon_days=100, now=datetime(2024, 5, 15), report=lambda message: None)
+    assert sum(file.rows for file in written) == 400 + 10
+
+    def forget():
+        with Session(bind) as db:
+            db.query(stats.HabitStats).delete()
+            db.query(Habit).filter(Habit.user_id == user_id).update(
+                {"streak": 0, "success_rate": 0.0, "last_completed": None}
+            )
+            db.commit()
+
+    forget()
+    with Session(bind) as db:
+        assert stats.rebuild(db, habit_ids=["long-streak", "all-archived"]) == 2
+    assert counters() == expected
+
+    forget()
+    with Session(bind) as db:
+        stats.rebuild_habit(db, db.get(Habit, "long-streak"))
+        db.commit()
+    assert counters()["long-streak"] == expected["long-streak"]
+
+    forget()
+    recompute.recompute_shard(0, user_id, user_id + "~", bind=bind)
+    assert counters() == expected
+
@@ -1,11 +1,13 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify
+import random
 import threading
 import time
-import requests
-import random
-from datetime import datetime, timedelta
+from datetime import datetime
 from collections import deque
 
+from .events import Broadcaster, TooManySubscribers, parse_last_event_id
+from .loadgen import AGENT_URL, LoadConfig, LoadGenerator
+
 app = Flask(__name__)
 
 # Preset tasks
@@ -18,78 +20,31 @@ PRESET_TASKS = [
 
 # Global state
 active_tasks = set()
-generation_interval = 10  # seconds
-is_running = False
-agent_thread = None
-last_event_time = None
+load_settings = {"rate": 20.0, "concurrency": 50}
 # Store last 100 log messages
 log_messages = deque(maxlen=100)
+log_lock = threading.Lock()
+# Log lines and load stats pushed to open dashboards over /events
+ui_events = Broadcaster(buffer_size=256, max_subscribers=500)
 
 def log_message(message):
-    timestamp = datetime.now().strftime("%H:%M:%S")
-    log_messages.append(f"[{timestamp}] {message}")
-
-def generate_habit():
-    global last_event_time
-    while is_running:
-        if active_tasks:
-            # Select a random active task
-            task_id = random.choice(list(active_tasks))
-            task = next(t for t in PRESET_TASKS if t["id"] == task_id)
-            
-            # Create habit
-            habit_data = {
-                "id": f"habit_{datetime.now().timestamp()}",
-                "name": task["name"],
-                "description": task["description"],
-                "frequency": "daily",
-                "target_time": "09:00:00",
-                "created_at": datetime.now().isoformat(),
-                "difficulty": task["difficulty"],
-                "category": task["category"]
-            }
-            
-            log_message(f"Creating habit: {task['name']}")
-            
-            # Create habit
-            habit_response = requests.post(
-                "http://agent:8000/habits/",
-                json=habit_data
-            )
-            
-            if habit_response.status_code == 200:
-                habit_id = habit_response.json()["id"]
-                
-                # Create completion
-                completion_data = {
-                    "habit_id": habit_id,
-                    "completed_at": datetime.now().isoformat(),
-                    "notes": f"Automated completion for {task['name']}",
-                    "mood": random.randint(1, 5),
-                    "difficulty": random.randint(1, 5)
-                }
-                
-                log_message(f"Completing habit: {task['name']} (Mood: {completion_data['mood']}, Difficulty: {completion_data['difficulty']})")
-                
-                completion_response = requests.post(
-                    "http://agent:8000/completions/",
-                    json=completion_data
-                )
-                
-                if completion_response.status_code == 200:
-                    log_message(f"Successfully completed habit: {task['name']}")
-                else:
-                    log_message(f"Failed to complete habit: {task['name']}")
-            
-            last_event_time = datetime.now()
-        time.sleep(generation_interval)
+    line = f"[{datetime.now().strftime('%H:%M:%S')}] {message}"
+    with log_lock:
+        log_messages.append(line)
+        ui_events.publish("log", line)
+
+load_generator = LoadGenerator(base_url=AGENT_URL, report=log_message)
+
+def habit_templates():
+    # Habits are created from the active tasks, or from any preset if none are active
+    return [task for task in PRESET_TASKS if task["id"] in active_tasks] or PRESET_TASKS
 
 @app.route('/')
 def index():
     return render_template('index.html', tasks=PRESET_TASKS, 
                          active_tasks=active_tasks, 
-                         interval=generation_interval,
-                         is_running=is_running)
+                         settings=load_settings,
+                         is_running=load_generator.is_running)
 
 @app.route('/toggle_task', methods=['POST'])
 def toggle_task():
@@ -102,43 +57,69 @@ def toggle_task():
         log_message(f"Activated task: {task_id}")
     return jsonify({"status": "success"})
 
-@app.route('/set_interval', methods=['POST'])
-def set_interval():
-    global generation_interval
-    interval = request.json.get('interval')
-    if interval and isinstance(interval, (int, float)) and interval > 0:
-        generation_interval = interval
-        log_message(f"Updated generation interval to {interval} seconds")
-        return jsonify({"status": "success"})
-    return jsonify({"status": "error", "message": "Invalid interval"}), 400
+@app.route('/set_load', methods=['POST'])
+def set_load():
+    rate = request.json.get('rate')
+    concurrency = request.json.get('concurrency')
+    for value in (rate, concurrency):
+        if not isinstance(value, (int, float)) or isinstance(value, bool) or value <= 0:
+            return jsonify({"status": "error", "message": "Invalid rate or concurrency"}), 400
+    load_settings.update(rate=float(rate), concurrency=int(concurrency))
+    log_message(f"Load set to {rate} req/s with up to {int(concurrency)} in flight")
+    return jsonify({"status": "success"})
 
 @app.route('/toggle_agent', methods=['POST'])
 def toggle_agent():
-    global is_running, agent_thread, last_event_time
-    is_running = not is_running
-    
-    if is_running and not agent_thread:
-        log_message("Starting habit generation")
-        last_event_time = datetime.now()  # Initialize last_event_time when starting
-        agent_thread = threading.Thread(target=generate_habit)
-        agent_thread.daemon = True
-        agent_thread.start()
-    elif not is_running:
-        log_message("Stopping habit generation")
+    if load_generator.is_running:
+        log_message("Stopping load generation")
+        load_generator.stop()
+    else:
+        log_message(f"Starting load generation at {load_settings['rate']} req/s")
+        load_generator.start(LoadConfig(**load_settings), templates=habit_templates())
     
-    return jsonify({"status": "success", "is_running": is_running})
+    return jsonify({"status": "success", "is_running": load_generator.is_running})
 
 @app.route('/logs')
 def get_logs():
-    return jsonify({"logs": list(log_messages)})
+    # The page loads history once, then follows /events from last_event_id
+    with log_lock:
+        return jsonify({"logs": list(log_messages), "last_event_id": ui_events.last_event_id})
 
-@app.route('/next_event_time')
-def get_next_event_time():
-    if not is_running or not last_event_time:
-        return jsonify({"next_event_time": None})
-    
-    next_time = last_event_time + timedelta(seconds=generation_interval)
-    return jsonify({"next_event_time": next_time.isoformat()})
+@app.route('/load_stats')
+def get_load_stats():
+    return jsonify(load_generator.snapshot())
+
+stats_publisher = None
+stats_publisher_lock = threading.Lock()
+
+def publish_load_stats(interval=1.0):
+    # One snapshot per interval for every open dashboard, and only when it changed
+    last = None
+    while True:
+        if ui_events.subscribers:
+            snapshot = load_generator.snapshot()
+            if snapshot != last:
+                ui_events.publish("stats", snapshot)
+                last = snapshot
+        time.sleep(interval)
+
+def ensure_stats_publisher():
+    global stats_publisher
+    with stats_publisher_lock:
+        if stats_publisher is None:
+            stats_publisher = threading.Thread(target=publish_load_stats, name="load-stats", daemon=True)
+            stats_publisher.start()
+
+@app.route('/events')
+def stream_events():
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        subscription = ui_events.subscribe(parse_last_event_id(last_event_id))
+    except TooManySubscribers:
+        return jsonify({"status": "error", "message": "Too many open dashboards"}), 503
+    ensure_stats_publisher()
+    return Response(subscription.stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000) 
\ No newline at end of file